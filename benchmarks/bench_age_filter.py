@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of listing filters: per-file Python loops vs NumPy masks.
+
+Usage: python benchmarks/bench_age_filter.py [files_count]
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import sly_functions as f  # noqa: E402
+from columnar import ListingColumns, filter_old_paths  # noqa: E402
+
+
+def make_page(files_count: int):
+    now = datetime.now()
+    page = []
+    for i in range(files_count):
+        updated_at = now - timedelta(days=random.randint(0, 60), seconds=random.randint(0, 86400))
+        ext = random.choice([".json", ".py", ".png", ".md", ".pkl"])
+        task_id = 10000 + i // 50
+        name = f"file_{i}{ext}"
+        page.append(
+            {
+                "path": f"/offline-sessions/{task_id}/app-data/{name}",
+                "name": name,
+                "updatedAt": updated_at.strftime("%Y-%m-%dT%H:%M:%S.") + "000Z",
+                "size": random.randint(1, 10**6),
+            }
+        )
+    return page
+
+
+def offline_loop(page, task_ids_to_remove):
+    task_ids = list({f.get_task_id(file_info["path"]) for file_info in page})
+    paths = []
+    for file_info in page:
+        if f.get_task_id(file_info["path"]) in task_ids_to_remove:
+            paths.append(file_info["path"])
+        elif f.should_delete_file(file_info):
+            paths.append(file_info["path"])
+    return task_ids, paths
+
+
+def offline_columnar(page, task_ids_to_remove):
+    columns = ListingColumns.from_page(
+        page, with_dates=False, with_task_ids=True, with_extensions=True
+    )
+    task_ids = columns.unique_task_ids()
+    mask = columns.in_tasks(task_ids_to_remove) | columns.has_extension(f.EXTENSIONS_TO_DELETE)
+    return task_ids, columns.select_paths(mask)
+
+
+def bench(name, func, *args, repeat=3):
+    best = min(_timeit(func, *args) for _ in range(repeat))
+    print(f"{name:<32} {best:8.3f} sec")
+    return best
+
+
+def _timeit(func, *args):
+    t = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t
+
+
+def main():
+    files_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"Generating {files_count} files...")
+    page = make_page(files_count)
+    del_date = datetime.now() - timedelta(days=30)
+    task_ids_to_remove = set(range(10000, 10000 + files_count // 50, 3))
+
+    assert f.sort_by_date(page, del_date) == filter_old_paths(page, del_date)
+    loop_result, columnar_result = offline_loop(page, task_ids_to_remove), offline_columnar(
+        page, task_ids_to_remove
+    )
+    assert sorted(loop_result[0]) == sorted(columnar_result[0])
+    assert loop_result[1] == columnar_result[1]
+
+    loop = bench("age filter: sort_by_date", f.sort_by_date, page, del_date)
+    vectorized = bench("age filter: filter_old_paths", filter_old_paths, page, del_date)
+    print(f"speedup: x{loop / vectorized:.1f}")
+    loop = bench("offline sessions: loop", offline_loop, page, task_ids_to_remove)
+    vectorized = bench("offline sessions: columnar", offline_columnar, page, task_ids_to_remove)
+    print(f"speedup: x{loop / vectorized:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+End-to-end benchmarks of the cleaner against the simulated server (`fake_server.py`).
+
+Scenarios:
+  list     - `storage_get_list_async` of the export directory of one team
+  crawl    - the same directory streamed page by page with `storage_crawl_async`
+  offline  - `clean_offline_sessions` of one team (by task folders with
+             `--env modal.state.offlineByFolder=true`)
+  main     - one cleaning cycle of `main(once=True)` over all teams
+
+Every scenario runs in its own process and reports wall time, requests issued (by method),
+peak RSS of the client, listed entities, entities/sec and the size of listing responses.
+The server runs in a separate process and is not included in the RSS.
+
+Usage:
+  python benchmarks/bench_cleaner.py [scenario ...] [--preset small|10k-teams|10m-files]
+      [--teams N] [--dirs N] [--files-per-dir N] [--sessions N] [--files-per-session N]
+      [--page-size N] [--latency SEC] [--jitter SEC] [--error-rate P] [--max-remove N]
+      [--recent-share P] [--connect-latency SEC] [--env KEY=VALUE ...]
+
+Examples:
+  python benchmarks/bench_cleaner.py
+  python benchmarks/bench_cleaner.py main --preset 10k-teams --latency 0.005
+  python benchmarks/bench_cleaner.py crawl main --preset 10m-files
+  # listing traffic saved by skipping recent folders, when 90% of folders are recent
+  python benchmarks/bench_cleaner.py main --recent-share 0.9
+  python benchmarks/bench_cleaner.py main --recent-share 0.9 --env modal.state.folderPrepass=true
+  # offline sessions removed by task folders instead of file by file
+  python benchmarks/bench_cleaner.py offline --env modal.state.offlineByFolder=true
+  # connection reuse with a remote server (50 ms per new connection)
+  python benchmarks/bench_cleaner.py main --preset 10k-teams --teams 500 --connect-latency 0.05
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from fake_server import Config, start_in_process  # noqa: E402
+
+SCENARIOS = ["list", "crawl", "offline", "main"]
+EXPORT_PATH = "/tmp/supervisely/export/"
+OFFLINES_PATH = "/offline-sessions/"
+APPS_TO_CLEAN = ["On-the-Fly Quality Assurance", "Render previews GUI"]
+
+PRESETS = {
+    # ~3 teams x 3 000 files, runs in seconds
+    "small": dict(teams=3, dirs=10, files_per_dir=100, sessions=100, files_per_session=10),
+    # 10 000 small teams: per-team overhead (team listing, listings of missing directories)
+    "10k-teams": dict(teams=10000, dirs=1, files_per_dir=5, sessions=2, files_per_session=2),
+    # one team with 10M files: listing throughput and memory
+    "10m-files": dict(
+        teams=1, dirs=1000, files_per_dir=3000, sessions=10000, files_per_session=100
+    ),
+}
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def server_request(port: int, path: str) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}") as response:
+        return json.loads(response.read())
+
+
+def run_scenario(scenario: str, port: int, teams: int, env: dict) -> dict:
+    """Run one scenario in this process against a running server."""
+    os.environ.update(
+        {
+            "SERVER_ADDRESS": f"http://127.0.0.1:{port}",
+            "API_TOKEN": "x" * 128,
+            "SLY_APP_DATA_DIR": tempfile.mkdtemp(prefix="cleaner_bench_"),
+            "modal.state.allTeams": "true",
+            "modal.state.clear": "30",
+            "modal.state.requestsPerSecond": "0",
+            **env,
+        }
+    )
+    import sly_functions as f
+
+    api = f.CleanerApi(os.environ["SERVER_ADDRESS"], os.environ["API_TOKEN"])
+    server_request(port, "/reset")
+    t = time.monotonic()
+    listed = None
+    if scenario == "list":
+        files = f.run_coroutine(
+            f.storage_get_list_async(api, 1, EXPORT_PATH, include_folders=False, return_type="dict")
+        )
+        listed = len(files)
+    elif scenario == "crawl":
+
+        async def _crawl():
+            count = 0
+            async for page in f.storage_crawl_async(api, 1, EXPORT_PATH, include_folders=False):
+                count += len(page)
+            return count
+
+        listed = f.run_coroutine(_crawl())
+    elif scenario == "offline":
+        by_folder = env.get("modal.state.offlineByFolder") == "true"
+        f.clean_offline_sessions(
+            api, 1, OFFLINES_PATH, APPS_TO_CLEAN, w_ids=[10], by_folder=by_folder
+        )
+    elif scenario == "main":
+        import main
+
+        main.main(once=True)
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+    elapsed = time.monotonic() - t
+
+    stats = server_request(port, "/stats")
+    if listed is None:
+        listed = stats["listed_entities"]
+    return {
+        "scenario": scenario,
+        "teams": teams,
+        "wall_sec": round(elapsed, 3),
+        "requests": stats["requests_count"],
+        "requests_by_method": stats["requests"],
+        "connections": stats["connections"],
+        "server_errors": stats["errors"],
+        "removed_files": stats["removed_files"],
+        "listed_entities": listed,
+        "listed_mb": round(stats["listed_bytes"] / 1024**2, 2),
+        "entities_per_sec": round(listed / elapsed, 1) if elapsed else 0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_results(results: list):
+    header = (
+        f"{'scenario':<10}{'wall, s':>10}{'requests':>10}{'conns':>8}{'listed':>12}"
+        f"{'listed, MB':>12}{'files/s':>12}{'removed':>10}{'RSS, MB':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if "error" in r:
+            print(f"{r['scenario']:<10} failed: {r['error']}")
+            continue
+        print(
+            f"{r['scenario']:<10}{r['wall_sec']:>10}{r['requests']:>10}{r['connections']:>8}"
+            f"{r['listed_entities']:>12}{r['listed_mb']:>12}{r['entities_per_sec']:>12}"
+            f"{r['removed_files']:>10}{r['peak_rss_mb']:>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cleaner benchmarks with a simulated server")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {SCENARIOS}, all by default")
+    parser.add_argument("--preset", choices=PRESETS.keys(), default="small")
+    parser.add_argument("--teams", type=int)
+    parser.add_argument("--dirs", type=int)
+    parser.add_argument("--files-per-dir", type=int)
+    parser.add_argument("--sessions", type=int)
+    parser.add_argument("--files-per-session", type=int)
+    parser.add_argument("--page-size", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max random extra latency")
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.0, help="seconds per new connection"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--max-remove", type=int, help="max paths in one remove request")
+    parser.add_argument(
+        "--recent-share", type=float, default=0.0, help="share of folders with only new files"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for main()")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario}, choose from {SCENARIOS}")
+
+    env = dict(item.split("=", 1) for item in args.env)
+    layout = dict(PRESETS[args.preset])
+    for key in layout:
+        if getattr(args, key) is not None:
+            layout[key] = getattr(args, key)
+
+    if args.worker:
+        print(json.dumps(run_scenario(args.worker, args.port, layout["teams"], env)))
+        return
+
+    config = Config(
+        page_size=args.page_size,
+        latency=args.latency,
+        jitter=args.jitter,
+        connect_latency=args.connect_latency,
+        error_rate=args.error_rate,
+        max_remove=args.max_remove,
+        recent_share=args.recent_share,
+        # remembering removed paths of huge instances would take the memory of the server
+        track_removals=False,
+        **layout,
+    )
+    print(
+        f"Preset: {args.preset}, teams: {config.teams}, files per team: {config.files_per_team}, "
+        f"latency: {args.latency}s, error rate: {args.error_rate}"
+    )
+    server = start_in_process(args.port, config)
+    options_argv = [arg for arg in sys.argv[1:] if arg not in SCENARIOS]
+    results = []
+    try:
+        for scenario in args.scenarios or SCENARIOS:
+            # a fresh process per scenario, so peak RSS belongs to one scenario
+            command = [sys.executable, __file__, "--worker", scenario, *options_argv]
+            process = subprocess.run(command, capture_output=True, text=True)
+            lines = process.stdout.strip().splitlines()
+            if process.returncode != 0 or not lines:
+                error = (process.stderr.strip().splitlines() or ["unknown error"])[-1]
+                results.append({"scenario": scenario, "error": error})
+                continue
+            results.append(json.loads(lines[-1]))
+    finally:
+        server.terminate()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Decoding speed and memory of `file-storage.v2.list` pages with every available backend.
+
+Pages are synthetic, with the fields of Team Files entities: besides the fields used by
+the cleaner, every entity has ids, hash, storage path, mime type and metadata.
+Backends:
+  json     - `response.json()` of httpx: bytes are decoded to str, then parsed by `json`
+  orjson   - `fast_json.loads`, full dicts
+  msgspec  - `fast_json.decode_page(light=True)`, only the fields of `ListingEntity`
+
+Usage:
+  python benchmarks/bench_json.py [--entities 1000 10000 20000] [--repeat 5]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fast_json  # noqa: E402
+
+
+def make_page(entities: int) -> bytes:
+    items = []
+    for i in range(entities):
+        path = f"/tmp/supervisely/export/Export to COCO/{i // 1000:05d}/image_{i:08d}.json"
+        updated_at = "2024-01-%02dT12:%02d:00.000Z" % (i % 28 + 1, i % 60)
+        items.append(
+            {
+                "type": "file",
+                "id": 1000000 + i,
+                "teamId": 8,
+                "userId": 7,
+                "name": path.rsplit("/", 1)[-1],
+                "path": path,
+                "prefix": path.rsplit("/", 1)[0],
+                "hash": "z7Wv1a7WIC5HIJrfX/69KVrvtDaLqucSprWHoCxyq0M=",
+                "storagePath": f"/h5un6l2bnaz1vj8a9qgms4-public/teams_storage/8/{i:08d}.json",
+                "mime": "application/json",
+                "ext": "json",
+                "size": 1024 + i,
+                "createdAt": updated_at,
+                "updatedAt": updated_at,
+                "meta": {"size": 1024 + i, "lastModified": updated_at},
+            }
+        )
+    token = "L3RtcC9zdXBlcnZpc2VseS9leHBvcnQvMDAwMDA5LzAwMDAwMDkudGFy"
+    return json.dumps({"entities": items, "continuationToken": token}).encode()
+
+
+def get_decoders() -> dict:
+    decoders = {"json": lambda content: json.loads(content.decode("utf-8"))}
+    if fast_json.orjson is not None:
+        decoders["orjson"] = fast_json.loads
+    if fast_json.msgspec is not None:
+        decoders["msgspec"] = lambda content: fast_json.decode_page(content, light=True)
+    return decoders
+
+
+def measure(decode, content: bytes, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        decode(content)
+        best = min(best, time.perf_counter() - t)
+    gc.collect()
+    tracemalloc.start()
+    page = decode(content)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(page["entities"]) > 0 and "updatedAt" in page["entities"][0]
+    return best, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Listing page decoding benchmark")
+    parser.add_argument("--entities", type=int, nargs="+", default=[1000, 10000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    decoders = get_decoders()
+    header = f"{'entities':>9}{'page, MB':>10}{'backend':>9}{'ms':>9}{'MB/s':>9}{'B/entity':>10}"
+    print(header)
+    print("-" * len(header))
+    for entities in args.entities:
+        content = make_page(entities)
+        size_mb = len(content) / 1024**2
+        for name, decode in decoders.items():
+            seconds, retained = measure(decode, content, args.repeat)
+            print(
+                f"{entities:>9}{size_mb:>10.2f}{name:>9}{seconds * 1000:>9.1f}"
+                f"{size_mb / seconds:>9.0f}{retained // entities:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Memory taken by files to remove, in every representation used by the cleaner.
+
+Candidates have Team Files paths (a few thousand files per directory), sizes and
+update dates. Representations:
+  dicts    - listed entities decoded as full dicts, as they come from the API
+  light    - entities decoded by msgspec with only the used fields (if installed)
+  tuples   - (priority, counter, size, path, updatedAt), entries of a heap
+  store    - `CandidateStore`: interned directories, packed names and dates, typed arrays
+The `selector` row is the peak memory of a size rule keeping all streamed files.
+
+With `--check` (or under pytest) the script fails if the store takes less than
+`MIN_STORE_RATIO` times less memory per candidate than dicts at 100 000 candidates.
+
+Usage:
+  python benchmarks/bench_memory.py [--candidates 100000 1000000] [--check]
+  python -m pytest benchmarks/bench_memory.py
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np  # noqa: E402
+
+import fast_json  # noqa: E402
+from candidates import CandidateStore  # noqa: E402
+from columnar import ListingColumns  # noqa: E402
+from policy import TopKSelector  # noqa: E402
+
+PAGE_SIZE = 10000
+# `CandidateStore` has to keep candidates in at least this many times less memory than dicts
+MIN_STORE_RATIO = 10
+
+
+def make_pages(candidates: int):
+    for start in range(0, candidates, PAGE_SIZE):
+        items = []
+        for i in range(start, min(start + PAGE_SIZE, candidates)):
+            path = f"/tmp/supervisely/export/Export to COCO/{i // 2000:05d}/image_{i:08d}.json"
+            updated_at = "2024-01-%02dT12:%02d:00.000Z" % (i % 28 + 1, i % 60)
+            items.append(
+                {
+                    "type": "file",
+                    "id": 1000000 + i,
+                    "teamId": 8,
+                    "name": path.rsplit("/", 1)[-1],
+                    "path": path,
+                    "hash": "z7Wv1a7WIC5HIJrfX/69KVrvtDaLqucSprWHoCxyq0M=",
+                    "storagePath": f"/h5un6l2bnaz1vj8a9qgms4-public/teams_storage/8/{i:08d}",
+                    "size": 1024 + i,
+                    "createdAt": updated_at,
+                    "updatedAt": updated_at,
+                }
+            )
+        yield json.dumps({"entities": items}).encode()
+
+
+def build_dicts(pages):
+    result = []
+    for content in pages:
+        result.extend(fast_json.loads(content)["entities"])
+    return result
+
+
+def build_light(pages):
+    result = []
+    for content in pages:
+        result.extend(fast_json.decode_page(content, light=True)["entities"])
+    return result
+
+
+def build_tuples(pages):
+    result = []
+    for content in pages:
+        for entity in fast_json.decode_page(content, light=True)["entities"]:
+            counter = len(result)
+            result.append((-counter, counter, entity["size"], entity["path"], entity["updatedAt"]))
+    return result
+
+
+def build_store(pages):
+    store = CandidateStore()
+    for content in pages:
+        store.extend(fast_json.decode_page(content, light=True)["entities"])
+    return store
+
+
+def build_selector(pages):
+    selector = TopKSelector("oldest", max_candidates=10**9)
+    for content in pages:
+        files_info = fast_json.decode_page(content, light=True)["entities"]
+        columns = ListingColumns.from_page(files_info, with_sizes=True)
+        selector.push(columns, files_info, np.ones(len(files_info), dtype=bool))
+    return selector
+
+
+def measure(build, candidates: int):
+    pages = list(make_pages(candidates))
+    gc.collect()
+    t = time.perf_counter()
+    build(pages)
+    seconds = time.perf_counter() - t
+    gc.collect()
+    tracemalloc.start()
+    result = build(pages)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(result) == candidates
+    return seconds, retained, peak
+
+
+def check_store_memory(candidates: int = 100000) -> float:
+    """Ratio of memory retained by dicts and by the store, fails if it is too small."""
+    _, dicts, _ = measure(build_dicts, candidates)
+    _, store, _ = measure(build_store, candidates)
+    ratio = dicts / store
+    assert ratio >= MIN_STORE_RATIO, (
+        f"CandidateStore takes {store // candidates} B per candidate, dicts take "
+        f"{dicts // candidates} B: {ratio:.1f}x less, expected at least {MIN_STORE_RATIO}x"
+    )
+    return ratio
+
+
+def test_candidate_store_memory():
+    check_store_memory()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of files to remove")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--check", action="store_true", help="only check the store memory")
+    args = parser.parse_args()
+    if args.check:
+        ratio = check_store_memory()
+        print(f"CandidateStore takes {ratio:.1f}x less memory than dicts")
+        return
+
+    builders = {"dicts": build_dicts}
+    if fast_json.msgspec is not None:
+        builders["light"] = build_light
+    builders.update(tuples=build_tuples, store=build_store, selector=build_selector)
+
+    header = f"{'candidates':>11}{'repr':>10}{'s':>8}{'retained, MB':>14}{'peak, MB':>10}"
+    header += f"{'B/file':>8}"
+    print(header)
+    print("-" * len(header))
+    for candidates in args.candidates:
+        for name, build in builders.items():
+            seconds, retained, peak = measure(build, candidates)
+            print(
+                f"{candidates:>11}{name:>10}{seconds:>8.2f}{retained / 1024**2:>14.1f}"
+                f"{peak / 1024**2:>10.1f}{retained // candidates:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
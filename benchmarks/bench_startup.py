@@ -0,0 +1,123 @@
+"""
+Start-up cost of the cleaner: time to import its modules and to run the CLI.
+
+Every case runs in a fresh interpreter, so nothing is cached in `sys.modules`; the
+median of `--repeat` runs is reported with the peak RSS of the process. Cases:
+  python          - an empty interpreter, the floor for all other cases
+  import X        - `import X` from `src`: settings, the CLI, supervisely, the app
+  cli --help      - `python src/cleaner.py --help`
+  cli if-due      - `python src/cleaner.py run --if-due` when no team is due, i.e. the
+                    cost of a cron run that has nothing to do
+Then the slowest modules imported by the app are listed from `python -X importtime`.
+
+Usage:
+  python benchmarks/bench_startup.py [--repeat 5] [--top 15]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+RSS_SNIPPET = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def run_python(code: str = None, argv: list = None, env: dict = None):
+    """Wall time and peak RSS (MB) of a fresh interpreter running `code` or a script."""
+    if argv is None:
+        argv = ["-c", f"{code}\n{RSS_SNIPPET}"]
+    t = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *argv],
+        cwd=SRC_DIR,
+        env={**os.environ, **(env or {})},
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - t
+    if result.returncode != 0:
+        raise RuntimeError(f"{argv} failed:\n{result.stderr}")
+    rss = None
+    if code is not None:
+        rss = int(result.stdout.strip().splitlines()[-1]) / 1024
+    return elapsed, rss
+
+
+def make_idle_data_dir() -> str:
+    """App data directory with a cycle that was just finished: no team is due."""
+    data_dir = tempfile.mkdtemp(prefix="cleaner_startup_")
+    # * in a child process: peak RSS is inherited by processes forked after heavy imports
+    code = f"""
+from datetime import datetime
+from checkpoint import CycleCheckpoint
+checkpoint = CycleCheckpoint({os.path.join(data_dir, "scan_state.db")!r})
+checkpoint.start_cycle("clean", datetime.now())
+for team_id in range(1, 11):
+    checkpoint.finish_team(team_id, 0, 0)
+checkpoint.finish_cycle()
+"""
+    subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, check=True)
+    return data_dir
+
+
+def import_times(module: str, top: int):
+    """Slowest modules by cumulative import time (`-X importtime`), in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:") :].split("|")]
+        # only top-level packages, nested modules are included in them
+        if not name.startswith(" ") and "." not in name:
+            rows.append((int(cumulative) / 1000, name))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    data_dir = make_idle_data_dir()
+    cases = [
+        ("python", dict(code="pass")),
+        ("import settings", dict(code="import settings")),
+        ("import cleaner", dict(code="import cleaner")),
+        ("import supervisely", dict(code="import supervisely")),
+        ("import sly_functions", dict(code="import sly_functions")),
+        ("import main", dict(code="import main")),
+        ("cli --help", dict(argv=["cleaner.py", "--help"])),
+        (
+            "cli if-due",
+            dict(argv=["cleaner.py", "run", "--if-due", "--data-dir", data_dir]),
+        ),
+    ]
+    print(f"{'case':<22}{'median, s':>10}{'min, s':>10}{'RSS, MB':>10}")
+    print("-" * 52)
+    for name, kwargs in cases:
+        runs = [run_python(**kwargs) for _ in range(args.repeat)]
+        times = [elapsed for elapsed, _ in runs]
+        rss = runs[-1][1]
+        rss_text = f"{rss:.1f}" if rss is not None else "-"
+        print(f"{name:<22}{statistics.median(times):>10.3f}{min(times):>10.3f}{rss_text:>10}")
+
+    print("\nSlowest top-level imports of the app (cumulative, ms):")
+    for ms, name in import_times("main", args.top):
+        print(f"  {name:<30}{ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
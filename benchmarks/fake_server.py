@@ -0,0 +1,440 @@
+"""
+Simulated Supervisely API server for offline benchmarks.
+
+Implements the methods used by the cleaner: `teams.list` (paged), `teams.info`,
+`workspaces.list`, `tasks.list`, `file-storage.v2.list` (continuation tokens, limit
+errors, recursive and non-recursive listing), `file-storage.bulk.remove` and
+`file-storage.remove` (a file or a whole folder).
+Unknown methods return `{}`.
+
+Files are not stored: every team has the same virtual tree, and the path of a file is
+computed from its index, so instances with millions of files take no memory. The tree
+of a team is:
+
+    <root>/<dir>/<file>.tar                  for every root in `roots`
+    /offline-sessions/<task_id>/<file>.json  every other file is .py
+
+Odd files are old (updated in 2020), even files are updated now. The last
+`recent_share` of directories of every root hold only new files and are created now.
+Tasks with
+`id % 3 == 0` belong to "Render previews GUI", `id % 3 == 1` to another app and
+`id % 3 == 2` don't exist. Removed files are remembered (and hidden from listings)
+only when `track_removals` is set.
+
+Every new connection waits `connect_latency` seconds to simulate TCP and TLS handshakes
+of a remote server. GET /stats returns request and connection counters, GET /reset
+clears them.
+
+Usage: python benchmarks/fake_server.py [port]
+"""
+
+import base64
+import bisect
+import json
+import multiprocessing
+import random
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+OLD_DATE = "2020-01-01T00:00:00.000Z"
+NEW_DATE = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+OFFLINES_ROOT = "/offline-sessions"
+DEFAULT_ROOTS = ["/tmp/supervisely/export", "/import", "/Export to COCO"]
+
+
+class Segment:
+    """`dirs` x `files_per_dir` files under `prefix`; paths are sorted by file index."""
+
+    def __init__(
+        self,
+        prefix: str,
+        dirs: int,
+        files_per_dir: int,
+        exts: List[str],
+        dir_start: int = 0,
+        recent_share: float = 0.0,
+    ):
+        self.prefix = prefix
+        self.dirs = dirs
+        self.files_per_dir = files_per_dir
+        self.exts = exts
+        self.dir_start = dir_start
+        self.count = dirs * files_per_dir
+        # directories from this one hold only new files
+        self.recent_from = dirs - int(dirs * recent_share)
+
+    def sort_key(self) -> str:
+        return self.prefix + "/"
+
+    def dir_path(self, j: int) -> str:
+        return f"{self.prefix}/{self.dir_start + j:06d}/"
+
+    def path(self, i: int) -> str:
+        j, k = divmod(i, self.files_per_dir)
+        return f"{self.dir_path(j)}{k:07d}{self.exts[k % len(self.exts)]}"
+
+    def is_old(self, i: int) -> bool:
+        return i % 2 == 1 and i // self.files_per_dir < self.recent_from
+
+    def dir_index(self, path: str) -> Optional[int]:
+        """Index of the directory if `path` is `<prefix>/<dir>/`."""
+        rest = path[len(self.prefix) + 1 :].rstrip("/")
+        if not rest.isdigit():
+            return None
+        j = int(rest) - self.dir_start
+        return j if 0 <= j < self.dirs else None
+
+
+def _file_entity(path: str, old: bool) -> dict:
+    updated_at = OLD_DATE if old else NEW_DATE
+    return {
+        "type": "file",
+        "path": path,
+        "name": path[path.rfind("/") + 1 :],
+        "size": 1024,
+        "createdAt": updated_at,
+        "updatedAt": updated_at,
+    }
+
+
+def _folder_entity(path: str, recent: bool = False) -> dict:
+    created_at = NEW_DATE if recent else OLD_DATE
+    return {
+        "type": "folder",
+        "path": path,
+        "name": path.rstrip("/").rsplit("/", 1)[-1],
+        "size": 0,
+        "createdAt": created_at,
+        "updatedAt": created_at,
+    }
+
+
+class _Removed:
+    """Removed paths: files and whole folders."""
+
+    def __init__(self, paths: set, dirs: set):
+        self.paths = paths
+        self.dirs = dirs
+
+    def __contains__(self, path: str) -> bool:
+        if path in self.paths or path in self.dirs:
+            return True
+        return path[: path.rfind("/", 0, len(path) - 1) + 1] in self.dirs
+
+
+class Config:
+    def __init__(
+        self,
+        teams: int = 3,
+        roots: List[str] = None,
+        dirs: int = 10,
+        files_per_dir: int = 10,
+        sessions: int = 30,
+        files_per_session: int = 4,
+        page_size: int = 10000,
+        max_limit: int = 10000,
+        teams_per_page: int = 500,
+        max_remove: Optional[int] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        connect_latency: float = 0.0,
+        error_rate: float = 0.0,
+        track_removals: bool = True,
+        recent_share: float = 0.0,
+    ):
+        self.teams = teams
+        self.page_size = page_size
+        self.max_limit = max_limit
+        self.teams_per_page = teams_per_page
+        self.max_remove = max_remove
+        self.latency = latency
+        self.jitter = jitter
+        self.connect_latency = connect_latency
+        self.error_rate = error_rate
+        self.track_removals = track_removals
+        segments = [
+            Segment(r, dirs, files_per_dir, [".tar"], recent_share=recent_share)
+            for r in roots or DEFAULT_ROOTS
+        ]
+        # session directories are task ids, starting from 100
+        segments.append(
+            Segment(OFFLINES_ROOT, sessions, files_per_session, [".json", ".py"], dir_start=100)
+        )
+        self.segments = sorted(segments, key=Segment.sort_key)
+
+    @property
+    def files_per_team(self) -> int:
+        return sum(s.count for s in self.segments)
+
+
+class State:
+    def __init__(self, config: Config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.removed: Dict[int, set] = {}
+        # folders removed by `file-storage.remove` are always remembered (until reset),
+        # there are few of them
+        self.removed_dirs: Dict[int, set] = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.removed_dirs = {}
+            self.requests: Dict[str, int] = {}
+            self.connections = 0
+            self.errors = 0
+            self.listed_entities = 0
+            self.listed_bytes = 0
+            self.removed_files = 0
+            self.started_at = time.time()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "requests_count": sum(self.requests.values()),
+                "connections": self.connections,
+                "errors": self.errors,
+                "listed_entities": self.listed_entities,
+                "listed_bytes": self.listed_bytes,
+                "removed_files": self.removed_files,
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # as real servers do; otherwise separate writes of headers and body of a response
+    # on a kept-alive connection are delayed by Nagle's algorithm
+    disable_nagle_algorithm = True
+    state: State = None
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+        if self.state.config.connect_latency:
+            time.sleep(self.state.config.connect_latency)
+
+    def _send(self, status: int, data: dict) -> int:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):
+        if self.path == "/reset":
+            self.state.reset()
+        self._send(200, self.state.stats() if self.path == "/stats" else {})
+
+    def do_POST(self):
+        method = self.path.split("/v3/")[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.state.config
+        with self.state.lock:
+            self.state.requests[method] = self.state.requests.get(method, 0) + 1
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.random() * config.jitter)
+        if config.error_rate and random.random() < config.error_rate:
+            with self.state.lock:
+                self.state.errors += 1
+            self._send(503, {"error": "Service temporarily unavailable"})
+            return
+        handler = getattr(self, "m_" + method.replace(".", "_").replace("-", "_"), None)
+        result = handler(body) if handler is not None else {}
+        status = 200
+        if isinstance(result, tuple):
+            status, result = result
+        sent = self._send(status, result)
+        if method == "file-storage.v2.list":
+            with self.state.lock:
+                self.state.listed_bytes += sent
+
+    def m_teams_list(self, body):
+        config = self.state.config
+        per_page = body.get("per_page") or config.teams_per_page
+        page = body.get("page") or 1
+        start = (page - 1) * per_page
+        ids = range(start + 1, min(start + per_page, config.teams) + 1)
+        entities = [{"id": i, "name": f"team_{i}"} for i in ids]
+        pages_count = max(1, -(-config.teams // per_page))
+        return {
+            "entities": entities,
+            "total": config.teams,
+            "pagesCount": pages_count,
+            "perPage": per_page,
+        }
+
+    def m_teams_info(self, body):
+        return {"id": body["id"], "name": f"team_{body['id']}"}
+
+    def m_workspaces_list(self, body):
+        entity = {"id": body["teamId"] * 10, "name": "workspace", "teamId": body["teamId"]}
+        return {"entities": [entity], "total": 1, "pagesCount": 1, "perPage": 1000}
+
+    def m_tasks_list(self, body):
+        ids = body["filter"][0]["value"]
+        entities = []
+        for task_id in ids:
+            if task_id % 3 == 2:
+                continue
+            app_name = "Render previews GUI" if task_id % 3 == 0 else "Other app"
+            entities.append({"id": task_id, "meta": {"app": {"name": app_name}}})
+        return {"entities": entities, "total": len(entities), "pagesCount": 1, "perPage": 1000}
+
+    def m_file_storage_bulk_remove(self, body):
+        config = self.state.config
+        paths = body["paths"]
+        if config.max_remove is not None and len(paths) > config.max_remove:
+            return 500, {"error": f"Too many files: {len(paths)} > {config.max_remove}"}
+        with self.state.lock:
+            self.state.removed_files += len(paths)
+            if config.track_removals:
+                self.state.removed.setdefault(body["teamId"], set()).update(paths)
+        return {"success": True}
+
+    def m_file_storage_remove(self, body):
+        config = self.state.config
+        path = body["path"]
+        removed = self.state.removed.get(body["teamId"], ())
+        paths = [path]
+        if path.endswith("/"):
+            paths += [
+                segment.path(i)
+                for segment, lo, hi in self._ranges(path)
+                for i in range(lo, hi)
+                if segment.path(i) not in removed
+            ]
+        with self.state.lock:
+            self.state.removed_files += len(paths) - path.endswith("/")
+            if path.endswith("/"):
+                self.state.removed_dirs.setdefault(body["teamId"], set()).add(path)
+            if config.track_removals:
+                self.state.removed.setdefault(body["teamId"], set()).update(paths)
+        return {"success": True}
+
+    def m_file_storage_v2_list(self, body):
+        config = self.state.config
+        limit = body.get("limit")
+        if limit is not None and limit > config.max_limit:
+            return 400, {"error": f"Limit must be less than or equal to {config.max_limit}"}
+        limit = min(limit or config.page_size, config.page_size)
+        path = body["path"]
+        if not path.endswith("/"):
+            path += "/"
+        after = None
+        if body.get("continuationToken"):
+            after = base64.b64decode(body["continuationToken"]).decode()
+        removed = self.state.removed.get(body["teamId"], set())
+        removed_dirs = self.state.removed_dirs.get(body["teamId"])
+        if removed_dirs:
+            removed = _Removed(removed, removed_dirs)
+        include_files = body.get("files", True)
+        include_folders = body.get("folders", True)
+
+        if body.get("recursive", True):
+            entities = self._list_files(path, after, limit + 1, removed) if include_files else []
+        else:
+            entities = self._list_children(path, after, limit + 1, removed)
+            entities = [
+                e
+                for e in entities
+                if (e["type"] == "file" and include_files)
+                or (e["type"] == "folder" and include_folders)
+            ]
+        token = None
+        if len(entities) > limit:
+            entities = entities[:limit]
+            token = base64.b64encode(entities[-1]["path"].encode()).decode()
+        with self.state.lock:
+            self.state.listed_entities += len(entities)
+        return {"entities": entities, "continuationToken": token}
+
+    def _ranges(self, path: str):
+        """Segments and file index ranges under `path`, in path order."""
+        for segment in self.state.config.segments:
+            if segment.sort_key().startswith(path):
+                yield segment, 0, segment.count
+            elif path.startswith(segment.sort_key()):
+                j = segment.dir_index(path)
+                if j is not None:
+                    lo = j * segment.files_per_dir
+                    yield segment, lo, lo + segment.files_per_dir
+
+    def _list_files(self, path: str, after: Optional[str], count: int, removed) -> List[dict]:
+        entities = []
+        for segment, lo, hi in self._ranges(path):
+            if after is not None:
+                lo = max(lo, bisect.bisect_right(range(segment.count), after, key=segment.path))
+            i = lo
+            while i < hi and len(entities) < count:
+                file_path = segment.path(i)
+                if file_path not in removed:
+                    entities.append(_file_entity(file_path, segment.is_old(i)))
+                i += 1
+            if len(entities) >= count:
+                break
+        return entities
+
+    def _list_children(self, path: str, after: Optional[str], count: int, removed) -> List[dict]:
+        children = set()
+        for segment in self.state.config.segments:
+            key = segment.sort_key()
+            if key.startswith(path) and key != path:
+                # a directory above the segment
+                children.add(path + key[len(path) :].split("/", 1)[0] + "/")
+        entities = [_folder_entity(p) for p in sorted(children) if after is None or p > after]
+        for segment in self.state.config.segments:
+            if segment.sort_key() == path:
+                dirs = range(segment.dirs)
+                start = 0
+                if after is not None:
+                    start = bisect.bisect_right(dirs, after, key=segment.dir_path)
+                for j in range(start, min(segment.dirs, start + count)):
+                    if segment.dir_path(j) in removed:
+                        continue
+                    recent = j >= segment.recent_from
+                    entities.append(_folder_entity(segment.dir_path(j), recent))
+            elif path.startswith(segment.sort_key()) and segment.dir_index(path) is not None:
+                entities.extend(self._list_files(path, after, count, removed))
+        return entities[:count]
+
+
+def serve(port: int, config: Config):
+    Handler.state = State(config)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler, bind_and_activate=False)
+    server.request_queue_size = 256
+    server.daemon_threads = True
+    server.server_bind()
+    server.server_activate()
+    server.serve_forever()
+
+
+def start_in_process(port: int, config: Config, timeout: float = 10) -> multiprocessing.Process:
+    """Run the server in a child process, so it doesn't share the CPU and memory of the client."""
+    process = multiprocessing.Process(target=serve, args=(port, config), daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError(f"Fake server didn't start on port {port}")
+
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8765, Config())
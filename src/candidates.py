@@ -0,0 +1,180 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TAKE_CHUNK = 65536
+
+
+class Candidate:
+    """File to remove, as it is read back from a `CandidateStore`."""
+
+    __slots__ = ("path", "size", "updated_at", "reason")
+
+    def __init__(self, path: str, size: int, updated_at: Optional[str], reason: Optional[str]):
+        self.path = path
+        self.size = size
+        self.updated_at = updated_at
+        self.reason = reason
+
+    def to_dict(self) -> dict:
+        """File info with the fields used by removers and manifests."""
+        return {"path": self.path, "size": self.size, "updatedAt": self.updated_at}
+
+
+def _view(values: array, dtype) -> np.ndarray:
+    # copy, a view would lock the array against appends
+    return np.frombuffer(values, dtype=dtype).copy()
+
+
+class PackedStrings:
+    """Strings stored as UTF-8 in one buffer with an array of end offsets."""
+
+    __slots__ = ("_data", "_ends")
+
+    def __init__(self):
+        self._data = bytearray()
+        self._ends = array("q")
+
+    def __len__(self):
+        return len(self._ends)
+
+    def __getitem__(self, i: int) -> str:
+        start = self._ends[i - 1] if i > 0 else 0
+        return self._data[start : self._ends[i]].decode("utf-8")
+
+    def extend(self, values: Iterable[str]):
+        encoded = [value.encode("utf-8") for value in values]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        self._ends.frombytes((np.cumsum(lengths) + len(self._data)).tobytes())
+        self._data += b"".join(encoded)
+
+    def take(self, indexes: np.ndarray) -> "PackedStrings":
+        ends = _view(self._ends, np.int64)
+        starts = np.concatenate(([0], ends[:-1]))
+        data = memoryview(self._data)
+        packed = PackedStrings()
+        starts, ends = starts[indexes], ends[indexes]
+        # in chunks, so bounds don't become Python ints all at once
+        for chunk in range(0, len(indexes), TAKE_CHUNK):
+            chunk_slice = slice(chunk, chunk + TAKE_CHUNK)
+            bounds = zip(starts[chunk_slice].tolist(), ends[chunk_slice].tolist())
+            packed._data += bytearray().join(data[start:end] for start, end in bounds)
+        lengths = ends - starts
+        packed._ends.frombytes(np.cumsum(lengths).tobytes())
+        return packed
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) + self._ends.itemsize * len(self._ends)
+
+
+class CandidateStore:
+    """
+    Compact list of files to remove.
+
+    A path is split into its directory, interned once for all files in it, and the file
+    name. Names and update dates are packed into byte buffers, sizes and ids into typed
+    arrays, so a candidate takes tens of bytes instead of a dict with its strings.
+    """
+
+    __slots__ = (
+        "_dirs",
+        "_dir_ids",
+        "_reasons",
+        "dir_ids",
+        "names",
+        "updated_at",
+        "sizes",
+        "reason_ids",
+    )
+
+    def __init__(self):
+        self._dirs: List[str] = []
+        self._dir_ids: Dict[str, int] = {}
+        self._reasons: List[Optional[str]] = []
+        self.dir_ids = array("I")
+        self.names = PackedStrings()
+        self.updated_at = PackedStrings()
+        self.sizes = array("q")
+        self.reason_ids = array("B")
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def _intern_dir(self, directory: str) -> int:
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self._dirs)
+            self._dirs.append(directory)
+        return dir_id
+
+    def extend(
+        self,
+        files_info: Sequence[dict],
+        reason: Optional[str] = None,
+        sizes: Optional[Iterable[int]] = None,
+    ):
+        """Add files with one reason. `sizes` are taken from file infos if not passed."""
+        if len(files_info) == 0:
+            return
+        if reason not in self._reasons:
+            self._reasons.append(reason)
+        paths = [file_info["path"] for file_info in files_info]
+        seps = [path.rfind("/") + 1 for path in paths]
+        self.dir_ids.extend(self._intern_dir(path[:sep]) for path, sep in zip(paths, seps))
+        self.names.extend(path[sep:] for path, sep in zip(paths, seps))
+        self.updated_at.extend(file_info.get("updatedAt") or "" for file_info in files_info)
+        if sizes is None:
+            sizes = (file_info.get("size") or 0 for file_info in files_info)
+        self.sizes.extend(sizes)
+        self.reason_ids.extend([self._reasons.index(reason)] * len(files_info))
+
+    def get_path(self, i: int) -> str:
+        return self._dirs[self.dir_ids[i]] + self.names[i]
+
+    def get(self, i: int) -> Candidate:
+        return Candidate(
+            self.get_path(i),
+            self.sizes[i],
+            self.updated_at[i] or None,
+            self._reasons[self.reason_ids[i]],
+        )
+
+    def get_sizes(self) -> np.ndarray:
+        return _view(self.sizes, np.int64)
+
+    def take(self, indexes: np.ndarray) -> "CandidateStore":
+        """New store with candidates at `indexes`, in that order."""
+        store = CandidateStore()
+        # directories without candidates are dropped
+        used, dir_ids = np.unique(_view(self.dir_ids, np.uint32)[indexes], return_inverse=True)
+        store._dirs = [self._dirs[i] for i in used.tolist()]
+        store._dir_ids = {directory: i for i, directory in enumerate(store._dirs)}
+        store._reasons = list(self._reasons)
+        store.dir_ids.frombytes(dir_ids.astype(np.uint32).tobytes())
+        store.names = self.names.take(indexes)
+        store.updated_at = self.updated_at.take(indexes)
+        store.sizes.frombytes(self.get_sizes()[indexes].tobytes())
+        store.reason_ids.frombytes(_view(self.reason_ids, np.uint8)[indexes].tobytes())
+        return store
+
+    def iter_by_reason(self, batch_size: int) -> Iterator[Tuple[Optional[str], List[dict]]]:
+        """Batches of file infos with one reason. Only one batch is materialized at a time."""
+        reason_ids = _view(self.reason_ids, np.uint8)
+        for reason_id, reason in enumerate(self._reasons):
+            indexes = np.flatnonzero(reason_ids == reason_id).tolist()
+            for start in range(0, len(indexes), batch_size):
+                batch = indexes[start : start + batch_size]
+                yield reason, [self.get(i).to_dict() for i in batch]
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the buffers, without interned directories."""
+        return (
+            self.names.nbytes
+            + self.updated_at.nbytes
+            + self.dir_ids.itemsize * len(self.dir_ids)
+            + self.sizes.itemsize * len(self.sizes)
+            + self.reason_ids.itemsize * len(self.reason_ids)
+        )
@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import supervisely as sly
+
+from scan_state import SCAN_STATE_FILENAME
+
+
+class TeamProgress(NamedTuple):
+    finished: bool
+    cursors: Dict[str, str]  # root -> continuation token of the last processed file
+    removed_files: int
+    removed_offline_files: int
+    planned_size: int
+
+
+class TeamHistory(NamedTuple):
+    """Result of the last cleaning of a team (not counting cycles where it was skipped)."""
+
+    reclaimed_size: int
+    removed_files: int
+    cleaned_at: float
+
+
+class CycleCheckpoint:
+    """
+    Durable progress of the current cleaning cycle, stored in the scan state database.
+
+    A checkpoint is written after every finished team and after every removed batch of
+    a team (continuation token of each root and removed files counters). If the app is
+    restarted in the middle of a cycle, the cycle is resumed with the same cutoff date:
+    finished teams are skipped and the team in progress continues listing from its
+    saved tokens. The time when every team was cleaned last is kept across cycles
+    for the scheduler, and the freed space of its last cleaning to prioritize teams.
+    """
+
+    def __init__(self, path: str, cycle_id: Optional[int] = None):
+        self.path = path
+        # set by `start_cycle`, or passed to continue the cycle in another process
+        self.cycle_id = cycle_id
+        self.started_at: Optional[datetime] = None
+        # worker processes of a sharded cycle write to the same database
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS cycles (
+                cycle_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mode TEXT NOT NULL,
+                del_date TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS cycle_teams (
+                cycle_id INTEGER NOT NULL,
+                team_id INTEGER NOT NULL,
+                finished INTEGER NOT NULL DEFAULT 0,
+                removed_files INTEGER NOT NULL DEFAULT 0,
+                removed_offline_files INTEGER NOT NULL DEFAULT 0,
+                planned_size INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (cycle_id, team_id)
+            );
+            CREATE TABLE IF NOT EXISTS cycle_cursors (
+                cycle_id INTEGER NOT NULL,
+                team_id INTEGER NOT NULL,
+                root TEXT NOT NULL,
+                continuation_token TEXT NOT NULL,
+                PRIMARY KEY (cycle_id, team_id, root)
+            );
+            CREATE TABLE IF NOT EXISTS teams_cleaned (
+                team_id INTEGER NOT NULL,
+                mode TEXT NOT NULL,
+                finished_at REAL NOT NULL,
+                PRIMARY KEY (team_id, mode)
+            );
+            CREATE TABLE IF NOT EXISTS teams_history (
+                team_id INTEGER NOT NULL,
+                mode TEXT NOT NULL,
+                reclaimed_size INTEGER NOT NULL,
+                removed_files INTEGER NOT NULL,
+                cleaned_at REAL NOT NULL,
+                PRIMARY KEY (team_id, mode)
+            );
+            """
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_app_data_dir(cls) -> "CycleCheckpoint":
+        return cls(os.path.join(sly.app.get_data_dir(), SCAN_STATE_FILENAME))
+
+    def close(self):
+        self._conn.close()
+
+    def start_cycle(
+        self, mode: str, del_date: datetime, started_at: Optional[datetime] = None
+    ) -> Tuple[datetime, bool]:
+        """
+        Resume the unfinished cycle of the same mode or start a new one.
+        Returns the cutoff date of the cycle and True if the cycle was resumed.
+        The start of the cycle (`started_at` of a new one) is kept in `self.started_at`.
+        """
+        row = self._conn.execute(
+            "SELECT cycle_id, del_date, started_at FROM cycles "
+            "WHERE finished_at IS NULL AND mode = ? ORDER BY cycle_id DESC LIMIT 1",
+            (mode,),
+        ).fetchone()
+        if row is not None:
+            self.cycle_id = row[0]
+            del_date = datetime.fromisoformat(row[1])
+            self.started_at = datetime.fromtimestamp(row[2])
+            finished = self._conn.execute(
+                "SELECT COUNT(*) FROM cycle_teams WHERE cycle_id = ? AND finished = 1",
+                (self.cycle_id,),
+            ).fetchone()[0]
+            sly.logger.info(
+                f"Resuming the interrupted cleaning cycle: {finished} teams are already "
+                f"finished, files older than {del_date:%Y-%m-%d} are removed."
+            )
+            return del_date, True
+        self.started_at = started_at or datetime.now()
+        cursor = self._conn.execute(
+            "INSERT INTO cycles (mode, del_date, started_at) VALUES (?, ?, ?)",
+            (mode, del_date.isoformat(), self.started_at.timestamp()),
+        )
+        self.cycle_id = cursor.lastrowid
+        # only the last finished cycle is needed
+        self._conn.execute("DELETE FROM cycle_teams WHERE cycle_id != ?", (self.cycle_id,))
+        self._conn.execute("DELETE FROM cycle_cursors WHERE cycle_id != ?", (self.cycle_id,))
+        self._conn.commit()
+        return del_date, False
+
+    def finish_cycle(self):
+        self._conn.execute(
+            "UPDATE cycles SET finished_at = ? WHERE cycle_id = ?", (time.time(), self.cycle_id)
+        )
+        self._conn.commit()
+
+    def get_last_cleaned(self, mode: str) -> Dict[int, float]:
+        """Time when every team was cleaned last time (in any cycle), by team id."""
+        rows = self._conn.execute(
+            "SELECT team_id, finished_at FROM teams_cleaned WHERE mode = ?", (mode,)
+        )
+        return dict(rows.fetchall())
+
+    def get_teams_history(self, mode: str) -> Dict[int, TeamHistory]:
+        rows = self._conn.execute(
+            "SELECT team_id, reclaimed_size, removed_files, cleaned_at FROM teams_history "
+            "WHERE mode = ?",
+            (mode,),
+        )
+        return {team_id: TeamHistory(*values) for team_id, *values in rows.fetchall()}
+
+    def get_teams_progress(self) -> Dict[int, TeamProgress]:
+        cursors: Dict[int, Dict[str, str]] = {}
+        rows = self._conn.execute(
+            "SELECT team_id, root, continuation_token FROM cycle_cursors WHERE cycle_id = ?",
+            (self.cycle_id,),
+        )
+        for team_id, root, token in rows.fetchall():
+            cursors.setdefault(team_id, {})[root] = token
+        rows = self._conn.execute(
+            "SELECT team_id, finished, removed_files, removed_offline_files, planned_size "
+            "FROM cycle_teams WHERE cycle_id = ?",
+            (self.cycle_id,),
+        )
+        return {
+            team_id: TeamProgress(bool(finished), cursors.get(team_id, {}), *counters)
+            for team_id, finished, *counters in rows.fetchall()
+        }
+
+    def save_team_progress(
+        self,
+        team_id: int,
+        cursors: Dict[str, str],
+        removed_files: int = 0,
+        removed_offline_files: int = 0,
+    ):
+        """Save tokens of files that are processed and the number of removed files so far."""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO cycle_cursors VALUES (?, ?, ?, ?)",
+            ((self.cycle_id, team_id, root, token) for root, token in cursors.items()),
+        )
+        self._conn.execute(
+            """
+            INSERT INTO cycle_teams
+                (cycle_id, team_id, removed_files, removed_offline_files, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (cycle_id, team_id) DO UPDATE SET
+                removed_files = excluded.removed_files,
+                removed_offline_files = excluded.removed_offline_files,
+                updated_at = excluded.updated_at
+            """,
+            (self.cycle_id, team_id, removed_files, removed_offline_files, time.time()),
+        )
+        self._conn.commit()
+
+    def finish_team(
+        self,
+        team_id: int,
+        removed_files: int,
+        removed_offline_files: int,
+        planned_size: int = 0,
+        reclaimed_size: int = 0,
+    ):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO teams_history "
+            "SELECT ?, mode, ?, ?, ? FROM cycles WHERE cycle_id = ?",
+            (team_id, reclaimed_size, removed_files + removed_offline_files, now, self.cycle_id),
+        )
+        self._finish_team(team_id, removed_files, removed_offline_files, planned_size, now)
+
+    def skip_team(self, team_id: int):
+        """Mark the team as cleaned without changing its history: it had nothing to remove."""
+        self._finish_team(team_id, 0, 0, 0, time.time())
+
+    def _finish_team(
+        self,
+        team_id: int,
+        removed_files: int,
+        removed_offline_files: int,
+        planned_size: int,
+        now: float,
+    ):
+        self._conn.execute(
+            "DELETE FROM cycle_cursors WHERE cycle_id = ? AND team_id = ?",
+            (self.cycle_id, team_id),
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cycle_teams VALUES (?, ?, 1, ?, ?, ?, ?)",
+            (
+                self.cycle_id,
+                team_id,
+                removed_files,
+                removed_offline_files,
+                planned_size,
+                now,
+            ),
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO teams_cleaned "
+            "SELECT ?, mode, ? FROM cycles WHERE cycle_id = ?",
+            (team_id, now, self.cycle_id),
+        )
+        self._conn.commit()
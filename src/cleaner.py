@@ -0,0 +1,168 @@
+"""
+Command line entry point: runs one cleaning cycle and exits, e.g. from cron.
+
+Usage (from the `src` directory, or as `python src/cleaner.py ...`):
+  python -m cleaner run [--team ID] [--days N] [--config FILE] [--set KEY=VALUE ...]
+      [--data-dir DIR] [--if-due] [--loop]
+  python -m cleaner plan|apply [...]
+  python -m cleaner bench NAME [ARGS ...]
+
+`run` cleans teams that are due, `plan` and `apply` work as the modes of the app.
+Settings are read from a JSON file with the keys of `modal_template_state` in config.json
+(`--config`), then from `--set` (the same keys) and the other options. The server address
+and API token are read from `SERVER_ADDRESS` and `API_TOKEN` (or ~/supervisely.env).
+
+Only the standard library is imported before the cleaning starts: with `--if-due` the
+scan state database is checked first, and if no team is due, the command exits without
+importing supervisely, httpx and numpy. Run `bench startup` to measure the import cost.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import List, Optional
+
+from settings import CleanerSettings
+
+COMMAND_MODES = {"run": "clean", "plan": "plan", "apply": "apply"}
+DEFAULT_DATA_DIR = "cleaner_data"
+# * the same file as `scan_state.SCAN_STATE_FILENAME`, not imported to keep the start fast
+SCAN_STATE_FILENAME = "scan_state.db"
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+
+
+def get_next_due_at(settings: CleanerSettings, data_dir: str) -> Optional[float]:
+    """
+    Time when the next team becomes due, from the checkpoints of cleaned teams (see
+    `CycleCheckpoint`). None if a team may be due now: the last cycle was not finished,
+    there are no checkpoints, or a new team could be created since the last cycle.
+    """
+    path = os.path.join(data_dir, SCAN_STATE_FILENAME)
+    if settings.mode != "clean" or not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        unfinished, last_finished = conn.execute(
+            "SELECT SUM(finished_at IS NULL), MAX(finished_at) FROM cycles WHERE mode = ?",
+            (settings.mode,),
+        ).fetchone()
+        last_cleaned = dict(
+            conn.execute(
+                "SELECT team_id, finished_at FROM teams_cleaned WHERE mode = ?", (settings.mode,)
+            )
+        )
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    if unfinished or last_finished is None:
+        return None
+
+    day = 24 * 60 * 60
+    intervals = {}
+    if settings.team_intervals and settings.team_intervals.strip():
+        intervals = {int(k): v * day for k, v in json.loads(settings.team_intervals).items()}
+
+    def _due_at(team_id: int) -> Optional[float]:
+        if team_id not in last_cleaned:
+            return None
+        return last_cleaned[team_id] + intervals.get(team_id, settings.sleep_days * day)
+
+    if not settings.all_teams:
+        next_due = _due_at(settings.selected_team_id)
+    else:
+        # teams created after the last cycle are cleaned by the next one, as in the app
+        next_due = min([last_finished + settings.sleep_days * day, *map(_due_at, last_cleaned)])
+    if next_due is None or next_due <= time.time():
+        return None
+    return next_due
+
+
+def load_settings(args: argparse.Namespace) -> CleanerSettings:
+    settings = CleanerSettings.from_file(args.config) if args.config else CleanerSettings()
+    state = {"mode": COMMAND_MODES[args.command]}
+    for item in args.set:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected KEY=VALUE, got '{item}'")
+        state[key.strip()] = value.strip()
+    if args.team is not None:
+        state.update(allTeams=False, teamId=args.team)
+    if args.days is not None:
+        state["clear"] = args.days
+    return settings.update(state)
+
+
+def run_benchmark(name: str, argv: List[str]):
+    import runpy
+
+    path = os.path.join(BENCHMARKS_DIR, f"bench_{name}.py")
+    if not os.path.exists(path):
+        raise SystemExit(f"Unknown benchmark: {name}")
+    sys.argv = [path, *argv]
+    runpy.run_path(path, run_name="__main__")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cleaner", description="Clean old files of teams.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command, description in [
+        ("run", "remove old files of teams that are due"),
+        ("plan", "save files to remove to manifests, without removing them"),
+        ("apply", "remove files from manifests saved by 'plan'"),
+    ]:
+        sub = commands.add_parser(command, help=description)
+        sub.add_argument("--team", type=int, help="clean only this team (default: all teams)")
+        sub.add_argument("--days", type=int, help="remove files older than this")
+        sub.add_argument("--config", help="JSON file with settings (keys of the modal state)")
+        sub.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="setting")
+        sub.add_argument(
+            "--data-dir",
+            default=os.environ.get("SLY_APP_DATA_DIR", DEFAULT_DATA_DIR),
+            help="checkpoints, manifests and metrics (default: $SLY_APP_DATA_DIR)",
+        )
+        sub.add_argument("--if-due", action="store_true", help="exit right away if no team is due")
+        sub.add_argument(
+            "--loop", action="store_true", help="keep running as the app, not one cycle"
+        )
+    bench = commands.add_parser("bench", help="run benchmarks/bench_<name>.py")
+    bench.add_argument("name", help="startup, cleaner, json, memory, age_filter")
+    bench.add_argument("args", nargs=argparse.REMAINDER)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    started = time.perf_counter()
+    args = build_parser().parse_args(argv)
+    if args.command == "bench":
+        run_benchmark(args.name, args.args)
+        return 0
+    try:
+        settings = load_settings(args)
+    except (OSError, ValueError) as e:
+        print(f"cleaner: {e}", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.environ["SLY_APP_DATA_DIR"] = os.path.abspath(args.data_dir)
+    if args.if_due:
+        next_due = get_next_due_at(settings, args.data_dir)
+        if next_due is not None:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(next_due))
+            print(f"No teams are due, the next team is due at {when}.")
+            return 0
+
+    import supervisely as sly
+
+    import main as app
+
+    sly.logger.debug(f"Modules are imported in {time.perf_counter() - started:.2f} sec")
+    sly.main_wrapper("main", app.main, settings, once=not args.loop)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import supervisely as sly
+from supervisely.api.module_api import ApiField
+
+from metrics import METRICS
+
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 20000
+# a batch rejected by a client error is split at most this many times (into 2**N parts)
+MAX_SPLIT_DEPTH = 6
+
+
+class DeleteDispatcher:
+    """
+    Removes files from Team Files with several concurrent `file-storage.bulk.remove` requests.
+
+    The batch size is adjusted AIMD-style: it grows by `increase_step` after every fast
+    successful request and is halved after a server error, a timeout or a request slower
+    than `target_latency` seconds. A failed batch is split in halves and retried:
+    client errors (4xx) are split up to `MAX_SPLIT_DEPTH` times to find the files the
+    server rejects, which are skipped; server errors and timeouts are split down to
+    `min_batch_size` and then retried with a jittered backoff up to `retries` times.
+    Batches are not split on 401 and 403, which fail the team, and a file that is not
+    found (404) is already gone, so it is counted as removed. Halves of a batch failed by
+    the server are sent after a backoff. Splits and retries take retries from the budget
+    of the cycle (see `Resilience`), `api` is a `CleanerApi`.
+    """
+
+    def __init__(
+        self,
+        api: sly.Api,
+        batch_size: int = MAX_BATCH_SIZE,
+        concurrency: int = 4,
+        min_batch_size: int = MIN_BATCH_SIZE,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        increase_step: int = 1000,
+        target_latency: float = 30.0,
+        retries: int = 3,
+    ):
+        self._api = api
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_size = max(min_batch_size, min(batch_size, max_batch_size))
+        self.concurrency = concurrency
+        self.increase_step = increase_step
+        self.target_latency = target_latency
+        self.retries = retries
+        self.requests_count = 0
+        self.failed_files = 0
+        self._reclaimed_sizes: Dict[int, int] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _on_success(self, latency: float):
+        if latency > self.target_latency:
+            self._decrease()
+        else:
+            self.batch_size = min(self.max_batch_size, self.batch_size + self.increase_step)
+
+    def _decrease(self):
+        self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        sly.logger.debug(f"Removal batch size decreased to {self.batch_size}")
+
+    async def _post(self, team_id: int, paths: List[str]):
+        self.requests_count += 1
+        t = time.monotonic()
+        await self._api.post_async(
+            "file-storage.bulk.remove",
+            {ApiField.TEAM_ID: team_id, ApiField.PATHS: paths},
+            retries=1,
+            raise_error=True,
+        )
+        latency = time.monotonic() - t
+        METRICS.observe("delete_batch_seconds", latency)
+        METRICS.inc("deleted_files", len(paths))
+        self._on_success(latency)
+
+    def _skip(self, paths: List[str], error: Exception) -> List[str]:
+        if len(paths) == 1:
+            sly.logger.warning(f"Failed to remove file {paths[0]}: {repr(error)}")
+        else:
+            sly.logger.warning(
+                f"Failed to remove {len(paths)} files ({paths[0]}, ...): {repr(error)}"
+            )
+        self.failed_files += len(paths)
+        METRICS.inc("delete_failed_files", len(paths))
+        return []
+
+    async def _remove_with_split(
+        self, team_id: int, paths: List[str], attempt: int = 0, depth: int = 0
+    ) -> List[str]:
+        """Remove files and return paths of the files that are removed (or already gone)."""
+        try:
+            await self._post(team_id, paths)
+            return paths
+        except (httpx.HTTPStatusError, httpx.RequestError) as e:
+            self._decrease()
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            client_error = status is not None and 400 <= status < 500 and status != 429
+            if status in (401, 403):
+                # other batches of the team fail the same way
+                raise
+            if status == 404 and len(paths) == 1:
+                sly.logger.debug(f"File {paths[0]} is already removed")
+                METRICS.inc("delete_missing_files")
+                return paths
+            if client_error:
+                if len(paths) == 1 or depth >= MAX_SPLIT_DEPTH:
+                    return self._skip(paths, e)
+            elif len(paths) <= self.min_batch_size and attempt >= self.retries:
+                raise
+            # split batches are sent again too, so they take retries from the budget
+            if not self._api.resilience.try_retry():
+                if client_error:
+                    return self._skip(paths, e)
+                raise
+            if client_error or len(paths) > self.min_batch_size:
+                METRICS.inc("delete_splits")
+                if not client_error:
+                    # the server is struggling, don't send both halves to it right away
+                    await self._api.resilience.backoff(depth, e)
+                middle = len(paths) // 2
+                removed = await self._remove_with_split(team_id, paths[:middle], depth=depth + 1)
+                return removed + await self._remove_with_split(
+                    team_id, paths[middle:], depth=depth + 1
+                )
+            sly.logger.debug(f"Failed to remove {len(paths)} files, retrying: {repr(e)}")
+            METRICS.inc("delete_retries")
+            await self._api.resilience.backoff(attempt, e)
+            return await self._remove_with_split(team_id, paths, attempt + 1)
+
+    async def _send(
+        self, team_id: int, paths: List[str], progress_cb: Optional[Callable]
+    ) -> List[str]:
+        try:
+            removed = await self._remove_with_split(team_id, paths)
+        finally:
+            self._semaphore.release()
+        if progress_cb is not None:
+            progress_cb(len(removed))
+        return removed
+
+    async def remove_files(
+        self,
+        team_id: int,
+        files_info: List[dict],
+        reason: Optional[str] = None,
+        on_removed: Optional[Callable[[List[str]], None]] = None,
+    ) -> int:
+        """
+        Remove files given as file infos. `reason` is only used in plan mode, `on_removed`
+        is called with paths of the removed files.
+        """
+        removed_paths = await self.remove_paths(
+            team_id, [file_info["path"] for file_info in files_info]
+        )
+        removed = set(removed_paths)
+        size = sum(i.get("size") or 0 for i in files_info if i["path"] in removed)
+        METRICS.inc("reclaimed_bytes", size)
+        self._reclaimed_sizes[team_id] = self._reclaimed_sizes.get(team_id, 0) + size
+        if on_removed is not None:
+            on_removed(removed_paths)
+        return len(removed)
+
+    def pop_reclaimed_size(self, team_id: int) -> int:
+        """Size of files of the team removed so far, counted as in the `reclaimed_bytes` metric."""
+        return self._reclaimed_sizes.pop(team_id, 0)
+
+    async def _remove_folder(self, team_id: int, path: str) -> int:
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    self.requests_count += 1
+                    await self._api.post_async(
+                        "file-storage.remove",
+                        {ApiField.TEAM_ID: team_id, ApiField.PATH: path},
+                        retries=1,
+                        raise_error=True,
+                    )
+                METRICS.inc("deleted_folders")
+                return 1
+            except (httpx.HTTPStatusError, httpx.RequestError) as e:
+                status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                if status is not None and 400 <= status < 500 and status != 429:
+                    sly.logger.warning(f"Failed to remove folder {path}: {repr(e)}")
+                    METRICS.inc("delete_failed_folders")
+                    return 0
+                if attempt >= self.retries or not self._api.resilience.try_retry():
+                    raise
+                METRICS.inc("delete_retries")
+                await self._api.resilience.backoff(attempt, e)
+                attempt += 1
+
+    async def remove_folders(
+        self, team_id: int, folders_info: List[dict], reason: Optional[str] = None
+    ) -> int:
+        """
+        Remove folders with all their files, one `file-storage.remove` request per folder.
+        Returns the number of removed folders. `reason` is only used in plan mode.
+        """
+        paths = [folder_info["path"].rstrip("/") + "/" for folder_info in folders_info]
+        removed = await asyncio.gather(*(self._remove_folder(team_id, path) for path in paths))
+        return sum(removed)
+
+    async def remove_paths(
+        self, team_id: int, paths: List[str], progress_cb: Optional[Callable] = None
+    ) -> List[str]:
+        """Remove files and return paths of the removed files."""
+        paths_to_remove = []
+        for path in paths:
+            if self._api.file.is_on_agent(path) is True:
+                sly.logger.warning(
+                    f"Data '{path}' is on agent. File skipped. "
+                    f"Method does not support agent storage."
+                )
+                continue
+            paths_to_remove.append(path)
+
+        tasks = []
+        start = 0
+        while start < len(paths_to_remove):
+            await self._semaphore.acquire()
+            # the batch size is read right before sending, so it follows the latest responses
+            batch = paths_to_remove[start : start + self.batch_size]
+            start += len(batch)
+            tasks.append(asyncio.create_task(self._send(team_id, batch, progress_cb)))
+        return [path for removed in await asyncio.gather(*tasks) for path in removed]
+
+    async def remove(
+        self, team_id: int, paths: List[str], progress_cb: Optional[Callable] = None
+    ) -> int:
+        """Remove files and return the number of removed files."""
+        return len(await self.remove_paths(team_id, paths, progress_cb))
@@ -0,0 +1,507 @@
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Literal, Optional, Union
+
+import supervisely as sly
+from supervisely.api.team_api import TeamInfo
+
+import sly_functions as f
+from candidates import CandidateStore
+from checkpoint import CycleCheckpoint, TeamProgress
+from deleter import DeleteDispatcher
+from manifest import REASON_AGE, REASON_SIZE, DryRunRemover, iter_manifest, mark_applied
+from metrics import METRICS, labels
+from policy import PolicySet, TeamPolicy
+from profiling import PROFILER
+from scan_state import ScanState
+from task_resolver import TaskResolver
+
+
+@dataclass
+class CleaningOptions:
+    """Settings shared by all teams processed in one cleaning cycle."""
+
+    paths_to_del: List[str]
+    offlines_path: str
+    apps_to_clean: List[str]
+    del_date: datetime
+    batch_size: int = 20000
+    concurrency: int = 4
+    delete_concurrency: int = 4
+    queue_size: int = 8
+    task_cache_size: Optional[int] = None
+    # "clean" - remove files, "plan" - only write files to per-team manifests,
+    # "apply" - remove files from manifests written in plan mode
+    mode: Literal["clean", "plan", "apply"] = "clean"
+    manifests: Optional[Dict[int, str]] = None  # team id -> manifest path, for "apply"
+    manifests_dir: Optional[str] = None  # for "plan"
+    policies: Optional[PolicySet] = None  # only age rule with `del_date` if not set
+    # start of the cycle, `max_age_days` of rules are counted from it
+    started_at: Optional[datetime] = None
+    # skip folders created after the cutoff date without listing their files
+    folder_prepass: bool = False
+    # remove offline sessions of `apps_to_clean` as whole task folders without listing them
+    offline_by_folder: bool = False
+    # team id -> directories that are not empty, found by the pre-scan (see `prescan`),
+    # other directories of these teams are not listed
+    team_roots: Optional[Dict[int, List[str]]] = None
+
+
+@dataclass
+class CycleContext:
+    """State shared by all teams of one cleaning cycle."""
+
+    task_resolver: TaskResolver
+    remover: Union[DeleteDispatcher, DryRunRemover]
+    scan_state: Optional[ScanState] = None
+    checkpoint: Optional[CycleCheckpoint] = None
+    # progress of teams of the resumed cycle
+    teams_progress: Dict[int, TeamProgress] = field(default_factory=dict)
+
+
+@dataclass
+class TeamResult:
+    """Outcome of cleaning a single team."""
+
+    team_id: int
+    team_name: str
+    removed_files: int = 0
+    removed_offline_files: int = 0
+    planned_size: int = 0
+    reclaimed_size: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def total_removed(self) -> int:
+        return self.removed_files + self.removed_offline_files
+
+
+@contextmanager
+def _phase(name: str, profiled: bool = False):
+    """Label metrics of the phase, measure its time and profile it if the team is sampled."""
+    with labels(phase=name), METRICS.timer("phase_seconds"), PROFILER.phase(profiled):
+        yield
+
+
+async def clean_team_async(
+    api: sly.Api,
+    team_info: TeamInfo,
+    options: CleaningOptions,
+    context: CycleContext,
+) -> TeamResult:
+    """Remove old files and offline sessions files of one team."""
+    try:
+        return await _clean_team_async(api, team_info, options, context)
+    except BaseException:
+        if isinstance(context.remover, DryRunRemover):
+            # the manifest of the team is incomplete, the team is planned again
+            context.remover.discard_team(team_info.id)
+        raise
+
+
+async def _clean_team_async(
+    api: sly.Api,
+    team_info: TeamInfo,
+    options: CleaningOptions,
+    context: CycleContext,
+) -> TeamResult:
+    team_id = team_info.id
+    team_name = team_info.name
+    result = TeamResult(team_id, team_name)
+    team_policy = (options.policies or PolicySet()).for_team(
+        team_id, options.del_date, options.started_at
+    )
+    scan_state = context.scan_state
+    size_rules = team_policy.has_size_rules(options.paths_to_del)
+    if scan_state is not None and size_rules:
+        sly.logger.debug(f"Team: {team_name}. Size rules are set, incremental scan is skipped.")
+        scan_state = None
+    # team listing can be resumed only when files are removed right away
+    checkpoint = context.checkpoint if options.mode == "clean" and not size_rules else None
+    remover = context.remover
+    # directories that are not empty, if the team was pre-scanned
+    roots = None
+    if options.team_roots is not None:
+        roots = options.team_roots.get(team_id)
+    profiled = PROFILER.sample_team()
+    t = time.monotonic()
+
+    if options.mode == "apply":
+        with _phase("apply", profiled):
+            result.removed_files = await apply_manifest_async(
+                team_id, options.manifests[team_id], remover, options.batch_size
+            )
+        result.reclaimed_size = remover.pop_reclaimed_size(team_id)
+        result.elapsed = time.monotonic() - t
+        return result
+
+    workspaces = await f.workspaces_get_list_async(api, team_id)
+    workspaces_ids = [workspace.id for workspace in workspaces]
+    sly.logger.info(f"Team: [{team_id}]{team_name}. Checking old files...")
+
+    cursors = {}  # root -> token of the last processed file in this cycle
+    progress = context.teams_progress.get(team_id)
+    if checkpoint is not None and progress is not None:
+        sly.logger.info(f"Team: [{team_id}]{team_name}. Resuming from the checkpoint.")
+        cursors.update(progress.cursors)
+        result.removed_files = progress.removed_files
+        result.removed_offline_files = progress.removed_offline_files
+    resumed = len(cursors) > 0
+
+    def save_progress():
+        if checkpoint is not None:
+            checkpoint.save_team_progress(
+                team_id, cursors, result.removed_files, result.removed_offline_files
+            )
+
+    tokens = {}
+    # files added before the saved tokens are missed until the next full scan, which has
+    # to happen before they can become old
+    latest_del_date = max(team_policy.get_del_date(root) for root in options.paths_to_del)
+    if scan_state is not None and (
+        resumed or not scan_state.start_team_scan(team_id, latest_del_date)
+    ):
+        # files remembered in previous cycles are checked without listing the roots again
+        tokens = scan_state.get_tokens(team_id)
+        with _phase("due_files", profiled):
+            result.removed_files += await _remove_due_files_async(
+                api, team_id, options, context.remover, scan_state, team_policy
+            )
+        save_progress()
+
+    tokens.update(cursors)
+    removed_before = result.removed_files
+
+    def on_old_files_progress(roots_cursors: Dict[str, str], removed_files: int):
+        cursors.update(roots_cursors)
+        result.removed_files = removed_before + removed_files
+        save_progress()
+
+    with _phase("old_files", profiled):
+        result.removed_files = removed_before + await _clean_old_files_async(
+            api,
+            team_id,
+            options,
+            context.remover,
+            scan_state,
+            team_policy,
+            tokens,
+            on_progress=on_old_files_progress,
+            roots=roots,
+        )
+
+    offlines_token = tokens.get(options.offlines_path)
+
+    def on_offlines_batch(token: str, removed_files: int):
+        if scan_state is not None:
+            scan_state.set_token(team_id, options.offlines_path, token)
+        cursors[options.offlines_path] = token
+        result.removed_offline_files += removed_files
+        save_progress()
+
+    if roots is not None and options.offlines_path not in roots:
+        sly.logger.debug(f"Team: {team_name}. No offline sessions found by the pre-scan.")
+    else:
+        sly.logger.info(f"Team: [{team_id}]{team_name}. Checking offline session files...")
+        with _phase("offline_sessions", profiled):
+            await f.clean_offline_sessions_async(
+                api,
+                team_id,
+                options.offlines_path,
+                options.apps_to_clean,
+                options.batch_size,
+                workspaces_ids,
+                context.task_resolver,
+                continuation_token=offlines_token,
+                on_batch=on_offlines_batch,
+                remover=remover,
+                by_folder=options.offline_by_folder,
+            )
+    sly.logger.debug(
+        f"Team: {team_name}. Removed offline sessions files: {result.removed_offline_files}."
+    )
+
+    if isinstance(remover, DryRunRemover):
+        _, result.planned_size = remover.close_team(team_id)
+        result.reclaimed_size = result.planned_size
+    else:
+        result.reclaimed_size = remover.pop_reclaimed_size(team_id)
+
+    result.elapsed = time.monotonic() - t
+    return result
+
+
+async def _remove_due_files_async(
+    api: sly.Api,
+    team_id: int,
+    options: CleaningOptions,
+    remover: DeleteDispatcher,
+    scan_state: ScanState,
+    team_policy: TeamPolicy,
+) -> int:
+    """
+    Remove files that were young in previous cycles and are old enough now.
+
+    Saved dates are only hints: a file can be uploaded again under the same path, so the
+    files are checked by the current listing of their directories before removal. Files
+    that are gone are forgotten, files with new dates are remembered with them, and files
+    that failed to be removed are kept until the next cycle.
+    """
+    removed_files = 0
+    for root in options.paths_to_del:
+        due_paths = scan_state.get_due_files(team_id, team_policy.get_del_date(root), root)
+        if len(due_paths) > 0:
+            sly.logger.debug(f"Team: {team_id}. {root}: {len(due_paths)} known old files.")
+        for batch in sly.batched(due_paths, options.batch_size):
+            files_info = await f.storage_get_files_async(
+                api, team_id, batch, concurrency=options.concurrency
+            )
+            files_to_del = team_policy.filter_page(root, files_info)
+            to_del = {i["path"] for files in files_to_del.values() for i in files}
+            scan_state.add_pending_files(
+                team_id,
+                root,
+                ((i["path"], i["updatedAt"]) for i in files_info if i["path"] not in to_del),
+            )
+            listed = {i["path"] for i in files_info}
+            done = [path for path in batch if path not in listed]
+            for reason, files in files_to_del.items():
+                removed_files += await remover.remove_files(
+                    team_id, files, reason, on_removed=done.extend
+                )
+            scan_state.remove_pending_files(team_id, done)
+    return removed_files
+
+
+def _to_tokens(cursor_paths: Dict[str, str]) -> Dict[str, str]:
+    return {root: f.path_to_base64(path) for root, path in cursor_paths.items()}
+
+
+def _save_cursors(
+    team_id: int,
+    cursor_paths: Dict[str, str],
+    scanned_files: Dict[str, int],
+    scan_state: Optional[ScanState],
+):
+    """Save tokens of the incremental scan when every listed file is processed."""
+    if scan_state is None:
+        return
+    for root, count in scanned_files.items():
+        scan_state.set_token(team_id, root, f.path_to_base64(cursor_paths[root]), count)
+    scanned_files.clear()
+
+
+async def _clean_old_files_async(
+    api: sly.Api,
+    team_id: int,
+    options: CleaningOptions,
+    remover: Union[DeleteDispatcher, DryRunRemover],
+    scan_state: Optional[ScanState],
+    team_policy: TeamPolicy,
+    tokens: Dict[str, str],
+    on_progress: Optional[Callable[[Dict[str, str], int], None]] = None,
+    roots: Optional[List[str]] = None,
+) -> int:
+    """
+    List `options.paths_to_del` and remove files selected by the team policy. If `roots`
+    are known to be not empty, only they are listed.
+
+    `on_progress` is called with tokens of the last processed file of every root and the
+    number of removed files, each time all listed files are processed. Tokens of the
+    incremental scan are saved at the same points, so files selected on a page are
+    removed before a restarted scan can continue after them.
+    """
+    removed_files = 0
+    # path of the last listed file by root, pages of a root are listed in path order
+    cursor_paths = {}
+    scanned_files = {}
+
+    # Listing, filtering and deleting run as a pipeline: files are removed as soon as
+    # there are enough of them for all concurrent delete requests, while the next pages
+    # are still being fetched. Files selected by size rules are removed after listing.
+    flush_size = options.batch_size * options.delete_concurrency
+    files_to_del = CandidateStore()
+    skip_folders = {}
+    if options.folder_prepass and scan_state is None:
+        # incremental scans need every new file to remember it
+        for root in options.paths_to_del:
+            skip_folders[root] = team_policy.get_folder_filter(root)
+    paths = options.paths_to_del
+    if roots is not None:
+        paths = [path for path in paths if path in roots]
+    listing = f.storage_iter_roots_async(
+        api,
+        team_id,
+        paths,
+        queue_size=options.queue_size,
+        continuation_tokens=tokens,
+        skip_folders=skip_folders,
+        include_folders=False,
+        with_metadata=False,
+        light=True,
+    )
+    try:
+        async for curr_path, files_info in listing:
+            page_files_to_del = team_policy.filter_page(curr_path, files_info)
+            if scan_state is not None and len(files_info) > 0:
+                to_del = {i["path"] for files in page_files_to_del.values() for i in files}
+                scan_state.add_pending_files(
+                    team_id,
+                    curr_path,
+                    ((i["path"], i["updatedAt"]) for i in files_info if i["path"] not in to_del),
+                )
+                scanned_files[curr_path] = scanned_files.get(curr_path, 0) + len(files_info)
+            if len(files_info) > 0:
+                last_path = files_info[-1]["path"]
+                if curr_path not in cursor_paths or last_path > cursor_paths[curr_path]:
+                    cursor_paths[curr_path] = last_path
+
+            for reason, files in page_files_to_del.items():
+                files_to_del.extend(files, reason)
+            if len(files_to_del) >= flush_size:
+                for reason, files in files_to_del.iter_by_reason(flush_size):
+                    removed_files += await remover.remove_files(team_id, files, reason)
+                files_to_del = CandidateStore()
+            if len(files_to_del) == 0 and len(files_info) > 0:
+                _save_cursors(team_id, cursor_paths, scanned_files, scan_state)
+                if on_progress is not None:
+                    on_progress(_to_tokens(cursor_paths), removed_files)
+    finally:
+        # stop listing of other roots right away if the team is cancelled
+        await listing.aclose()
+
+    for reason, files in files_to_del.iter_by_reason(flush_size):
+        removed_files += await remover.remove_files(team_id, files, reason)
+    _save_cursors(team_id, cursor_paths, scanned_files, scan_state)
+    if on_progress is not None:
+        on_progress(_to_tokens(cursor_paths), removed_files)
+
+    selected = team_policy.finish()
+    if len(selected) > 0:
+        sly.logger.info(f"Team: {team_id}. {len(selected)} files are selected by size rules.")
+        for batch in sly.batched(selected, options.batch_size):
+            removed_files += await remover.remove_files(team_id, batch, REASON_SIZE)
+    return removed_files
+
+
+async def apply_manifest_async(
+    team_id: int, manifest_path: str, remover: DeleteDispatcher, batch_size: int
+) -> int:
+    """Remove files listed in the team manifest without listing Team Files again."""
+    sly.logger.info(f"Team: {team_id}. Removing files from manifest {manifest_path}...")
+    removed_files = 0
+    entries = iter_manifest(manifest_path)
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if len(batch) == 0:
+            break
+        folders = [entry for entry in batch if entry["path"].endswith("/")]
+        if len(folders) > 0:
+            # offline sessions planned for removal as whole task folders
+            removed_files += await remover.remove_folders(team_id, folders)
+            batch = [entry for entry in batch if not entry["path"].endswith("/")]
+        removed_files += await remover.remove_files(team_id, batch)
+    mark_applied(manifest_path)
+    return removed_files
+
+
+async def clean_teams_async(
+    api: sly.Api,
+    teams_infos: List[TeamInfo],
+    options: CleaningOptions,
+    on_result: Optional[Callable[[TeamResult], None]] = None,
+    scan_state: Optional[ScanState] = None,
+    checkpoint: Optional[CycleCheckpoint] = None,
+    deadline: Optional[float] = None,
+) -> List[TeamResult]:
+    """
+    Clean teams concurrently with at most `options.concurrency` teams in flight.
+
+    Workers pull teams from a shared queue, so a new team starts only when a previous
+    one has finished. `on_result` is called as soon as each team is done. With
+    `checkpoint`, teams finished before a restart are reported without cleaning them again.
+    At `deadline` (unix time) teams in progress are cancelled and the rest are not started:
+    only results of processed teams are returned, the checkpoint keeps the progress.
+    """
+    results = []
+    teams_progress = checkpoint.get_teams_progress() if checkpoint is not None else {}
+    queue = asyncio.Queue()
+    for team_info in teams_infos:
+        progress = teams_progress.get(team_info.id)
+        if progress is not None and progress.finished:
+            # finished before the app was restarted
+            result = TeamResult(
+                team_info.id,
+                team_info.name,
+                progress.removed_files,
+                progress.removed_offline_files,
+                progress.planned_size,
+            )
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+            continue
+        queue.put_nowait(team_info)
+    if options.mode == "plan":
+        remover = DryRunRemover(options.manifests_dir)
+    else:
+        remover = DeleteDispatcher(api, options.batch_size, concurrency=options.delete_concurrency)
+    context = CycleContext(
+        task_resolver=TaskResolver(api, max_size=options.task_cache_size),
+        remover=remover,
+        scan_state=scan_state,
+        checkpoint=checkpoint,
+        teams_progress=teams_progress,
+    )
+
+    async def _worker():
+        while True:
+            if deadline is not None and time.time() >= deadline:
+                return
+            try:
+                team_info = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                with labels(team=team_info.id):
+                    result = await clean_team_async(api, team_info, options, context)
+                METRICS.inc("teams", status="ok")
+                if checkpoint is not None:
+                    checkpoint.finish_team(
+                        result.team_id,
+                        result.removed_files,
+                        result.removed_offline_files,
+                        result.planned_size,
+                        result.reclaimed_size,
+                    )
+            except Exception as e:
+                sly.logger.warning(
+                    f"Team: [{team_info.id}]{team_info.name}. Cleaning failed: {repr(e)}",
+                    exc_info=True,
+                )
+                result = TeamResult(team_info.id, team_info.name, error=repr(e))
+                METRICS.inc("teams", status="error")
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+    workers_count = max(1, min(options.concurrency, len(teams_infos)))
+    workers = [asyncio.create_task(_worker()) for _ in range(workers_count)]
+    timeout = None if deadline is None else max(0, deadline - time.time())
+    done, pending = await asyncio.wait(workers, timeout=timeout)
+    if len(pending) > 0:
+        sly.logger.info(
+            f"Cleaning time is over, {len(pending)} teams in progress are paused "
+            f"and will be resumed in the next cycle."
+        )
+        for worker in pending:
+            worker.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    for worker in done:
+        worker.result()
+    return results
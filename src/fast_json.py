@@ -0,0 +1,63 @@
+import json
+from typing import Dict, List, Optional, TypedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class ListingEntity(TypedDict, total=False):
+    """Fields of a listed file or folder that are used by the cleaner."""
+
+    type: str
+    path: str
+    name: str
+    size: Optional[int]
+    createdAt: Optional[str]
+    updatedAt: Optional[str]
+
+
+class ListingPage(TypedDict, total=False):
+    entities: List[ListingEntity]
+    continuationToken: Optional[str]
+
+
+if msgspec is not None:
+    # other fields of entities are skipped without creating Python objects for them
+    _page_decoder = msgspec.json.Decoder(ListingPage)
+
+
+def loads(content: bytes) -> Dict:
+    """Decode JSON with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def decode_page(content: bytes, light: bool = False) -> Dict:
+    """
+    Decode a `file-storage.v2.list` response.
+
+    With `light` entities keep only the fields of `ListingEntity` if msgspec is
+    installed, which is faster and takes less memory than full dicts. Otherwise the
+    page is decoded by `loads`.
+    """
+    if light and msgspec is not None:
+        try:
+            return _page_decoder.decode(content)
+        except msgspec.ValidationError:
+            # unexpected types of fields, e.g. a new server version
+            pass
+    return loads(content)
+
+
+def get_backend(light: bool = False) -> str:
+    if light and msgspec is not None:
+        return "msgspec"
+    return "orjson" if orjson is not None else "json"
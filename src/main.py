@@ -1,20 +1,25 @@
-import math
 import os
-import time
 from datetime import datetime, timedelta
-from distutils.util import strtobool
+from typing import Optional
 
 import supervisely as sly
 from dotenv import load_dotenv
+from supervisely._utils import sizeof_fmt
 from tqdm import tqdm
 
+import engine
+import fast_json
+import prescan
+import sharding
 import sly_functions as f
-
-if sly.is_development():
-    load_dotenv("local.env")
-    load_dotenv(os.path.expanduser("~/supervisely.env"))
-
-api = sly.Api.from_env()
+from checkpoint import CycleCheckpoint
+from manifest import get_manifests_dir, list_manifests
+from metrics import METRICS
+from policy import PolicySet
+from profiling import PROFILER
+from scan_state import ScanState
+from scheduler import Scheduler
+from settings import CleanerSettings
 
 # * list of apps to remove offline sessions files
 apps_to_clean = [
@@ -41,149 +46,209 @@ possible_paths_to_del = [
     "/export-to-dota",  # https://github.com/supervisely-ecosystem/export-to-dota
 ]
 
-all_teams = bool(strtobool(os.getenv("modal.state.allTeams")))
-selected_team_id = None
-if all_teams is False:
-    selected_team_id = int(os.environ["modal.state.teamId"])
-days_storage = int(os.environ.get("modal.state.clear", 30))
-sleep_days = int(os.environ.get("modal.state.sleep", 2))
-batch_size = int(os.environ.get("modal.state.batchSize", 20000))
-sleep_time = sleep_days * 86400
-del_date = datetime.now() - timedelta(days=days_storage)
-
 
-def main():
+def main(settings: Optional[CleanerSettings] = None, once: bool = False):
+    """
+    Clean teams in cycles until the app is stopped. Settings are read from the modal state
+    if not passed. With `once` only one cycle is run: the function returns instead of
+    waiting for a time window or for the next team to become due.
+    """
+    if sly.is_development():
+        load_dotenv("local.env")
+        load_dotenv(os.path.expanduser("~/supervisely.env"))
+    if settings is None:
+        settings = CleanerSettings.from_env()
+    api = f.CleanerApi.from_env()
+    policies = PolicySet.from_json(settings.policies)
+    scheduler = Scheduler.from_settings(
+        settings.sleep_days, settings.time_windows, settings.team_intervals
+    )
+    api.set_rate_limit(settings.requests_per_second)
+    api.set_retry_budget(settings.retry_budget)
+    api.set_connection_pool(settings.max_connections, http2=settings.http2)
+    sly.logger.debug(f"Listing pages are decoded by {fast_json.get_backend(light=True)}")
+    options = engine.CleaningOptions(
+        paths_to_del=[export_path_to_del, import_path_to_del, *possible_paths_to_del],
+        offlines_path=offlines_path,
+        apps_to_clean=apps_to_clean,
+        del_date=datetime.now() - timedelta(days=settings.days_storage),
+        batch_size=settings.batch_size,
+        concurrency=settings.concurrency,
+        delete_concurrency=settings.delete_concurrency,
+        task_cache_size=settings.task_cache_size,
+        mode=settings.mode,
+        policies=policies,
+        folder_prepass=settings.folder_prepass,
+        offline_by_folder=settings.offline_by_folder,
+    )
+    if settings.mode != "clean":
+        options.manifests_dir = get_manifests_dir()
+        sly.logger.info(f"Mode: {settings.mode}. Manifests directory: {options.manifests_dir}")
+    scan_state = None
+    if settings.incremental_scan and settings.mode == "clean":
+        scan_state = ScanState.from_app_data_dir(settings.full_scan_every)
+    if settings.metrics_port:
+        METRICS.start_http_server(settings.metrics_port)
+    PROFILER.configure(settings.profile_every)
+    metrics_textfile = os.path.join(sly.app.get_data_dir(), "metrics.prom")
+    metrics_summary = os.path.join(sly.app.get_data_dir(), "metrics_summary.json")
+    checkpoint = None
+    if settings.mode != "apply":
+        # applied manifests are renamed, so apply mode resumes without a checkpoint
+        checkpoint = CycleCheckpoint.from_app_data_dir()
 
     while True:
+        if settings.mode != "plan":
+            # plan mode doesn't remove files, so it runs at any time
+            if once and not scheduler.is_open():
+                sly.logger.info("Outside of cleaning time windows, nothing is done.")
+                break
+            scheduler.sleep_until(scheduler.next_window_start(), "Waiting for cleaning time window")
         total_files_cnt = 0
+        total_planned_size = 0
         teams_infos = None
         total_log_counter = 0
-        if all_teams is False and selected_team_id is not None:
-            teams_infos = [api.team.get_info_by_id(selected_team_id)]
+        if settings.all_teams is False and settings.selected_team_id is not None:
+            teams_infos = [
+                f.run_coroutine(f.team_get_info_by_id_async(api, settings.selected_team_id))
+            ]
         else:
             # teams_infos = api.team.get_list()
             teams_infos = f.run_coroutine(f.teams_get_list_async(api))
-        progress = tqdm(desc="Start cleaning", total=len(teams_infos))
-        for team_info in teams_infos:
-            team_id = team_info.id
-            team_name = team_info.name
-
-            workspaces = api.workspace.get_list(team_id)
-            workspaces_ids = [workspace.id for workspace in workspaces]
-            sly.logger.info(f"Team: [{team_id}]{team_name}. Checking old files...")
-
-            # export directory
-            sly.logger.debug(f"Team: {team_name}. Checking files in {export_path_to_del}.")
-            # files_info = api.storage.list(
-            #     team_id,
-            #     export_path_to_del,
-            #     return_type="dict",
-            #     include_folders=False,
-            #     with_metadata=False,
-            # )
-            files_info = f.run_coroutine(
-                f.storage_get_list_async(
-                    api,
-                    team_id,
-                    export_path_to_del,
-                    return_type="dict",
-                    include_folders=False,
-                    with_metadata=False,
-                )
+        if settings.shard_count > 1:
+            teams_infos = sharding.select_shard(
+                teams_infos, settings.shard_index, settings.shard_count
             )
-            file_to_del_paths = f.sort_by_date(files_info, del_date)
-
-            # import directory
-            sly.logger.debug(f"Team: {team_name}. Checking files in {import_path_to_del}.")
-            # files_info = api.storage.list(
-            #     team_id,
-            #     import_path_to_del,
-            #     return_type="dict",
-            #     include_folders=False,
-            #     with_metadata=False,
-            # )
-            files_info = f.run_coroutine(
-                f.storage_get_list_async(
-                    api,
-                    team_id,
-                    import_path_to_del,
-                    return_type="dict",
-                    include_folders=False,
-                    with_metadata=False,
-                )
+            sly.logger.info(
+                f"Shard {settings.shard_index} of {settings.shard_count}: {len(teams_infos)} "
+                f"teams are cleaned by this session."
             )
-            file_to_del_paths.extend(f.sort_by_date(files_info, del_date))
-
-            # other legacy directories
-            for curr_path in possible_paths_to_del:
-                sly.logger.debug(f"Team: {team_name}. Checking files in {curr_path}.")
-                # files_info_old = api.storage.list(
-                #     team_id,
-                #     curr_path,
-                #     return_type="dict",
-                #     include_folders=False,
-                #     with_metadata=False,
-                # )
-                files_info_old = f.run_coroutine(
-                    f.storage_get_list_async(
-                        api,
-                        team_id,
-                        curr_path,
-                        return_type="dict",
-                        include_folders=False,
-                        with_metadata=False,
-                    )
-                )
-                file_to_del_paths.extend(f.sort_by_date(files_info_old, del_date))
-
-            if len(file_to_del_paths) > 0:
-                # sly.logger.info(f"Team: {team_name}. Start removing.")
-                pbar = tqdm(
-                    total=len(file_to_del_paths), desc=f"Team: {team_name}. Cleaning"
-                ).update
-                api.file.remove_batch(team_id, file_to_del_paths, pbar, batch_size)
-                total_files_cnt += len(file_to_del_paths)
-
-            # # offline sessions files
-            sly.logger.info(f"Team: [{team_id}]{team_name}. Checking offline session files...")
-            removed_files = f.clean_offline_sessions(
-                api, team_id, offlines_path, apps_to_clean, batch_size, workspaces_ids
+        if settings.mode == "apply":
+            options.manifests = list_manifests(options.manifests_dir)
+            teams_infos = [t for t in teams_infos if t.id in options.manifests]
+            sly.logger.info(f"Found manifests for {len(teams_infos)} teams.")
+        last_cleaned = {}
+        due_teams_infos = teams_infos
+        if settings.mode == "clean":
+            last_cleaned = checkpoint.get_last_cleaned(settings.mode)
+            due_teams_infos = scheduler.due_teams(teams_infos, last_cleaned)
+            if len(due_teams_infos) == 0:
+                if once:
+                    sly.logger.info("No teams are due, nothing is done.")
+                    break
+                # e.g. the app was restarted while waiting for the next cycle
+                scheduler.sleep_until(scheduler.next_due_at(teams_infos, last_cleaned))
+                continue
+            sly.logger.info(f"{len(due_teams_infos)} of {len(teams_infos)} teams are due.")
+
+        METRICS.start_cycle()
+        api.resilience.start_cycle()
+        # the cutoff date is computed for every new cycle, a resumed cycle keeps its own
+        options.started_at = datetime.now()
+        options.del_date = options.started_at - timedelta(days=settings.days_storage)
+        if checkpoint is not None:
+            options.del_date, _ = checkpoint.start_cycle(
+                settings.mode, options.del_date, options.started_at
             )
-            sly.logger.debug(f"Team: {team_name}. Removed offline sessions files: {removed_files}.")
-
+            options.started_at = checkpoint.started_at
+        options.team_roots = None
+        if settings.prioritize_teams and settings.mode != "apply":
+            estimates = f.run_coroutine(
+                prescan.prescan_teams_async(api, due_teams_infos, options, checkpoint)
+            )
+            options.team_roots = {team_id: e.roots for team_id, e in estimates.items()}
+            due_teams_infos, skipped_teams = prescan.prioritize_teams(due_teams_infos, estimates)
+            for team_info in skipped_teams:
+                # the team is due again after its interval
+                checkpoint.skip_team(team_info.id)
+            METRICS.inc("teams", len(skipped_teams), status="skipped")
             sly.logger.info(
-                f"Team: [{team_id}]{team_name}. Total files removed: {len(file_to_del_paths) + removed_files}."
+                f"Pre-scan: {len(skipped_teams)} teams have nothing to remove and are skipped, "
+                f"{len(due_teams_infos)} teams are cleaned, biggest first."
             )
-
-            total_files_cnt += removed_files
+        deadline = None
+        if settings.mode != "plan" and scheduler.window_end() is not None:
+            deadline = scheduler.window_end().timestamp()
+        failed_teams = set()
+        progress = tqdm(desc="Start cleaning", total=len(due_teams_infos))
+
+        def _on_team_finished(result: engine.TeamResult):
+            nonlocal total_files_cnt, total_planned_size, total_log_counter
+            if result.error is None:
+                sly.logger.info(
+                    f"Team: [{result.team_id}]{result.team_name}. "
+                    f"Total files removed: {result.total_removed} ({result.elapsed:.1f} sec)."
+                )
+            else:
+                failed_teams.add(result.team_id)
+            total_files_cnt += result.total_removed
+            total_planned_size += result.planned_size
 
             total_log_counter += 1
             if total_log_counter >= 50:
                 sly.logger.info(f"App Session. Total files removed: {total_files_cnt}.")
                 total_log_counter = 0
 
-            progress(1)
-            time.sleep(2)
+            progress.update(1)
+
+        if settings.processes > 1:
+            results = sharding.clean_teams_in_processes(
+                due_teams_infos,
+                options,
+                settings.processes,
+                on_result=_on_team_finished,
+                scan_state=scan_state,
+                checkpoint=checkpoint,
+                deadline=deadline,
+                requests_per_second=settings.requests_per_second,
+                retry_budget=settings.retry_budget,
+                profile_every=settings.profile_every,
+                max_connections=settings.max_connections,
+                http2=settings.http2,
+            )
+        else:
+            results = f.run_coroutine(
+                engine.clean_teams_async(
+                    api,
+                    due_teams_infos,
+                    options,
+                    on_result=_on_team_finished,
+                    scan_state=scan_state,
+                    checkpoint=checkpoint,
+                    deadline=deadline,
+                )
+            )
+        paused = len(results) < len(due_teams_infos)
 
         sly.logger.info(f"App Session. Total files removed: {total_files_cnt}.")
-        sleep_text = f"{sleep_days} day" if sleep_days <= 1 else f"{sleep_days} days"
-        sly.logger.info(f"Finished. Sleep time: {sleep_text}.")
         progress.close()
+        METRICS.write_textfile(metrics_textfile)
+        METRICS.write_summary(metrics_summary)
+        sly.logger.info(f"Cycle metrics are saved to {metrics_summary}")
+        if paused:
+            # the cycle is resumed in the next time window
+            sly.logger.info(f"Cleaning is paused: {len(results)} teams are processed.")
+            if once:
+                break
+            continue
+        if checkpoint is not None:
+            checkpoint.finish_cycle()
+        if settings.mode == "plan":
+            sly.logger.info(
+                f"Plan is ready: {total_files_cnt} files, {sizeof_fmt(total_planned_size)} "
+                f"can be freed. Run the app in 'apply' mode to remove them."
+            )
+        if settings.mode != "clean" or once:
+            # plan and apply modes run one cycle
+            break
+
+        # failed teams are retried when other teams are due
+        last_cleaned = checkpoint.get_last_cleaned(settings.mode)
+        next_cycle_teams = [t for t in teams_infos if t.id not in failed_teams]
+        sly.logger.info("Finished.")
+        scheduler.sleep_until(scheduler.next_due_at(next_cycle_teams, last_cleaned))
 
-        # Waiting for the next cleaning cycle
-        sleep_time_hours = int(sleep_time / 3600)
-        with tqdm(
-            total=sleep_time_hours,
-            desc=f"Waiting {sleep_time_hours} hours for next cleaning cycle",
-            unit="hours",
-        ) as pbar:
-            chunk_size_hours = 1  # Update progress every hour
-            chunks = math.ceil(sleep_time_hours / chunk_size_hours)
-            for _ in range(chunks):
-                time_to_sleep_hours = min(chunk_size_hours, sleep_time_hours - pbar.n)
-                time_to_sleep_seconds = time_to_sleep_hours * 3600
-                time.sleep(time_to_sleep_seconds)
-                pbar.update(time_to_sleep_hours)
+    f.run_coroutine(api.close_async())
 
 
 if __name__ == "__main__":
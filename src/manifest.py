@@ -0,0 +1,142 @@
+import gzip
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import supervisely as sly
+from supervisely._utils import sizeof_fmt
+
+from metrics import METRICS
+
+MANIFESTS_DIR_NAME = "manifests"
+MANIFEST_EXT = ".jsonl.gz"
+APPLIED_EXT = ".applied"
+
+# * reasons why a file is planned for removal
+REASON_AGE = "age"
+REASON_APP = "app"
+REASON_EXTENSION = "extension"
+REASON_PATTERN = "pattern"
+REASON_SIZE = "size"
+
+
+def get_manifests_dir() -> str:
+    manifests_dir = os.path.join(sly.app.get_data_dir(), MANIFESTS_DIR_NAME)
+    sly.fs.mkdir(manifests_dir)
+    return manifests_dir
+
+
+def get_manifest_path(manifests_dir: str, team_id: int) -> str:
+    return os.path.join(manifests_dir, f"team_{team_id}{MANIFEST_EXT}")
+
+
+def list_manifests(manifests_dir: str) -> Dict[int, str]:
+    """Get paths of manifests that were not applied yet by team id."""
+    manifests = {}
+    if not os.path.isdir(manifests_dir):
+        return manifests
+    for filename in os.listdir(manifests_dir):
+        if filename.startswith("team_") and filename.endswith(MANIFEST_EXT):
+            team_id = int(filename[len("team_") : -len(MANIFEST_EXT)])
+            manifests[team_id] = os.path.join(manifests_dir, filename)
+    return manifests
+
+
+def iter_manifest(path: str) -> Iterator[dict]:
+    """Stream entries of a manifest: dicts with path, size, updatedAt and reason."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def mark_applied(path: str):
+    os.replace(path, path + APPLIED_EXT)
+
+
+class ManifestWriter:
+    """
+    Writes files planned for removal to a gzipped JSONL manifest, one file per line.
+
+    The manifest is written to a temporary file and appears under its name only
+    after `close`, so a manifest of an interrupted scan is never applied.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files_count = 0
+        self.total_size = 0
+        self._tmp_path = path + ".tmp"
+        self._file = gzip.open(self._tmp_path, "wt", encoding="utf-8")
+
+    def write(self, files_info: List[dict], reason: str):
+        for file_info in files_info:
+            size = file_info.get("size") or 0
+            entry = {
+                "path": file_info["path"],
+                "size": size,
+                "updatedAt": file_info.get("updatedAt"),
+                "reason": reason,
+            }
+            self._file.write(json.dumps(entry) + "\n")
+            self.files_count += 1
+            self.total_size += size
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        """Close the manifest of an interrupted scan and remove it."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class DryRunRemover:
+    """
+    Used instead of `DeleteDispatcher` in plan mode: files are written to per-team
+    manifests and nothing is removed.
+    """
+
+    def __init__(self, manifests_dir: str):
+        self.manifests_dir = manifests_dir
+        self._writers: Dict[int, ManifestWriter] = {}
+
+    def _get_writer(self, team_id: int) -> ManifestWriter:
+        if team_id not in self._writers:
+            path = get_manifest_path(self.manifests_dir, team_id)
+            self._writers[team_id] = ManifestWriter(path)
+        return self._writers[team_id]
+
+    async def remove_files(self, team_id: int, files_info: List[dict], reason: str) -> int:
+        writer = self._get_writer(team_id)
+        size_before = writer.total_size
+        writer.write(files_info, reason)
+        METRICS.inc("planned_files", len(files_info), reason=reason)
+        METRICS.inc("planned_bytes", writer.total_size - size_before, reason=reason)
+        return len(files_info)
+
+    async def remove_folders(self, team_id: int, folders_info: List[dict], reason: str) -> int:
+        # folder paths end with "/", so `apply_manifest_async` removes them as folders
+        folders_info = [
+            {"path": folder_info["path"].rstrip("/") + "/", "size": 0}
+            for folder_info in folders_info
+        ]
+        return await self.remove_files(team_id, folders_info, reason)
+
+    def close_team(self, team_id: int) -> Tuple[int, int]:
+        """Finish the team manifest. Returns the number of files and their total size."""
+        writer = self._get_writer(team_id)
+        writer.close()
+        del self._writers[team_id]
+        sly.logger.info(
+            f"Team: {team_id}. Manifest {writer.path}: {writer.files_count} files, "
+            f"{sizeof_fmt(writer.total_size)} can be freed."
+        )
+        return writer.files_count, writer.total_size
+
+    def discard_team(self, team_id: int):
+        """Drop the unfinished manifest of a team that failed or was cancelled."""
+        writer = self._writers.pop(team_id, None)
+        if writer is not None:
+            writer.discard()
@@ -0,0 +1,248 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import supervisely as sly
+
+PREFIX = "cleaner_"
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# * labels of the current team/root/phase, set by the engine and inherited by created tasks
+_labels: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("labels", default={})
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+@contextmanager
+def labels(**new_labels):
+    """Add labels to all metrics recorded inside the block (and in tasks created in it)."""
+    token = _labels.set({**_labels.get(), **{k: str(v) for k, v in new_labels.items()}})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def get_labels() -> Dict[str, str]:
+    return _labels.get()
+
+
+class Histogram:
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+
+class Metrics:
+    """
+    In-process metrics registry with a Prometheus text exporter and a JSON summary.
+
+    Series are labeled by `phase`/`root`/`method` only, to keep the number of series
+    small on instances with many teams. Per-team values are kept separately (the current
+    team is taken from `labels(team=...)`) and are only included in the cycle summary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Key, float] = defaultdict(float)
+        self.histograms: Dict[Key, Histogram] = {}
+        self.teams: Dict[str, Counter] = defaultdict(Counter)
+        self._cycle_start = time.time()
+        self._cycle_counters: Dict[Key, float] = {}
+        self._cycle_histograms: Dict[Key, Tuple[int, float]] = {}
+
+    @staticmethod
+    def _key(name: str, series_labels: Dict[str, str]) -> Key:
+        current = {k: v for k, v in get_labels().items() if k != "team"}
+        return name, tuple(sorted({**current, **series_labels}.items()))
+
+    def inc(self, name: str, value: float = 1, **series_labels):
+        key = self._key(name, series_labels)
+        team = get_labels().get("team")
+        with self._lock:
+            self.counters[key] += value
+            if team is not None:
+                self.teams[team][_format_key(key)] += value
+
+    def observe(self, name: str, value: float, **series_labels):
+        key = self._key(name, series_labels)
+        team = get_labels().get("team")
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+            if team is not None:
+                self.teams[team][_format_key(key)] += value
+
+    @contextmanager
+    def timer(self, name: str, **series_labels):
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - t, **series_labels)
+
+    def start_cycle(self):
+        """
+        Reset per-team values and remember counters and histograms to report the next
+        cycle only. Exported metrics stay cumulative, as Prometheus expects.
+        """
+        with self._lock:
+            self.teams.clear()
+            self._cycle_start = time.time()
+            self._cycle_counters = dict(self.counters)
+            self._cycle_histograms = {
+                key: (hist.count, hist.sum) for key, hist in self.histograms.items()
+            }
+
+    def reset(self):
+        """Drop all values, e.g. in a worker process that reports them to the coordinator."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.teams.clear()
+            self._cycle_counters = {}
+            self._cycle_histograms = {}
+
+    def get_state(self) -> dict:
+        """Picklable copy of all values, to be added to another registry by `merge`."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": dict(self.histograms),
+                "teams": {team: Counter(values) for team, values in self.teams.items()},
+            }
+
+    def merge(self, state: dict):
+        """Add values of another registry, e.g. of a worker process."""
+        with self._lock:
+            for key, value in state["counters"].items():
+                self.counters[key] += value
+            for key, hist in state["histograms"].items():
+                if key in self.histograms:
+                    self.histograms[key].merge(hist)
+                else:
+                    self.histograms[key] = hist
+            for team, values in state["teams"].items():
+                self.teams[team].update(values)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, series_labels), value in sorted(self.counters.items()):
+                lines.append(f"{PREFIX}{name}_total{_format_labels(series_labels)} {value}")
+            for (name, series_labels), hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + [float("inf")], hist.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    bucket_labels = _format_labels(series_labels + (("le", le),))
+                    lines.append(f"{PREFIX}{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(series_labels)} {hist.count}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(series_labels)} {hist.sum}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Write metrics for node_exporter textfile collector (atomically)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self) -> dict:
+        """Values of the current cycle: counters, latency stats and per-team values."""
+        with self._lock:
+            duration = time.time() - self._cycle_start
+            counters = {}
+            for key, value in self.counters.items():
+                value -= self._cycle_counters.get(key, 0)
+                if value:
+                    counters[_format_key(key)] = value
+            histograms = {}
+            for key, hist in self.histograms.items():
+                count_before, sum_before = self._cycle_histograms.get(key, (0, 0.0))
+                count, total = hist.count - count_before, hist.sum - sum_before
+                if count:
+                    histograms[_format_key(key)] = {
+                        "count": count,
+                        "sum": round(total, 4),
+                        "avg": round(total / count, 4),
+                    }
+            teams = {team: dict(values) for team, values in self.teams.items()}
+        listed = sum(v for k, v in counters.items() if k.startswith("listed_entities"))
+        return {
+            "cycle_started_at": self._cycle_start,
+            "duration_sec": round(duration, 2),
+            "listed_entities_per_sec": round(listed / duration, 2) if duration else 0,
+            "counters": counters,
+            "latency": histograms,
+            "teams": teams,
+        }
+
+    def write_summary(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def start_http_server(self, port: int) -> ThreadingHTTPServer:
+        """Serve metrics at http://0.0.0.0:<port>/metrics in a background thread."""
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") == "/summary":
+                    body = json.dumps(registry.summary()).encode()
+                    content_type = "application/json"
+                else:
+                    body = registry.to_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        sly.logger.info(f"Metrics are available at http://0.0.0.0:{port}/metrics")
+        return server
+
+
+def _format_labels(series_labels) -> str:
+    if not series_labels:
+        return ""
+    values = ",".join(f'{k}="{_escape(v)}"' for k, v in series_labels)
+    return "{" + values + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_key(key: Key) -> str:
+    name, series_labels = key
+    return name + _format_labels(series_labels)
+
+
+METRICS = Metrics()
@@ -0,0 +1,353 @@
+import fnmatch
+import json
+import re
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Literal, Optional, Union
+
+import numpy as np
+import supervisely as sly
+
+from candidates import CandidateStore
+from columnar import ListingColumns, created_after, select_files
+from manifest import REASON_AGE, REASON_EXTENSION, REASON_PATTERN
+
+MAX_CANDIDATES = 100000
+COMPACT_MIN = 10000  # files in the store of a size rule before it is compacted
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+
+def parse_size(size: Union[int, str, None]) -> Optional[int]:
+    """Parse sizes like `1024`, `"500MB"` or `"1.5 TB"` to bytes."""
+    if size is None or isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B)?\s*", size.upper())
+    if match is None:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2) or "B"])
+
+
+@dataclass
+class Rule:
+    """
+    Cleaning rule of a root (or of all roots of a team).
+
+    Files older than `max_age_days`, with one of `extensions` or matching one of `globs`
+    are removed right away. If the root is bigger than `target_size` after that, the
+    remaining files are removed in `order` ("oldest" - least recently updated first,
+    "largest" - largest first) until it fits. `free_bytes` is set on teams only: files of
+    all team roots are removed in `order` until that many bytes are freed.
+    """
+
+    max_age_days: Optional[int] = None
+    extensions: List[str] = field(default_factory=list)
+    globs: List[str] = field(default_factory=list)
+    target_size: Optional[int] = None
+    free_bytes: Optional[int] = None
+    order: Literal["oldest", "largest"] = "oldest"
+    max_candidates: int = MAX_CANDIDATES
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Rule":
+        names = {f.name for f in fields(cls)}
+        unknown = set(data) - names - {"roots"}
+        if unknown:
+            raise ValueError(f"Unknown policy fields: {sorted(unknown)}")
+        rule = cls(**{k: v for k, v in data.items() if k in names})
+        rule.target_size = parse_size(rule.target_size)
+        rule.free_bytes = parse_size(rule.free_bytes)
+        if rule.order not in ("oldest", "largest"):
+            raise ValueError(f"Invalid policy order: {rule.order}")
+        return rule
+
+    def merge(self, data: dict) -> "Rule":
+        """Copy of the rule with fields overridden by `data`."""
+        merged = {f.name: getattr(self, f.name) for f in fields(self)}
+        merged.update({k: v for k, v in data.items() if k != "roots"})
+        return Rule.from_dict(merged)
+
+
+class TopKSelector:
+    """
+    Keeps the highest priority files of a streamed listing.
+
+    Files are appended to a compact `CandidateStore` and their priorities to NumPy
+    arrays. When the store doubles, it is compacted to at most `max_candidates` files
+    with the highest priority. If `bytes_to_free` is known in advance, files that are
+    not needed to free that many bytes are dropped as well, so the store stays small
+    even for huge listings.
+    """
+
+    def __init__(
+        self,
+        order: str = "oldest",
+        max_candidates: int = MAX_CANDIDATES,
+        bytes_to_free: Optional[int] = None,
+    ):
+        self.order = order
+        self.max_candidates = max_candidates
+        self.bytes_to_free = bytes_to_free
+        self.total_size = 0  # of all pushed files
+        self._reset()
+
+    def _reset(self):
+        self._store = CandidateStore()
+        self._priorities: List[np.ndarray] = []
+        self._compact_at = COMPACT_MIN
+        # files with lower priority are dropped by compaction anyway
+        self._threshold: Optional[int] = None
+
+    def __len__(self):
+        return len(self._store)
+
+    def push(self, columns: ListingColumns, files_info: List[dict], mask: np.ndarray):
+        """Add files of a page selected by `mask`."""
+        indexes = np.flatnonzero(mask)
+        if len(indexes) == 0:
+            return
+        sizes = columns.sizes[indexes]
+        self.total_size += int(sizes.sum())
+        # older files and larger files have higher priority
+        if self.order == "largest":
+            priorities = sizes
+        else:
+            priorities = -columns.updated_at[indexes]
+        if self._threshold is not None:
+            keep = priorities > self._threshold
+            indexes, sizes, priorities = indexes[keep], sizes[keep], priorities[keep]
+        self._store.extend([files_info[i] for i in indexes.tolist()], sizes=sizes.tolist())
+        self._priorities.append(priorities)
+        if len(self._store) >= self._compact_at:
+            self._compact()
+
+    def _compact(self, sort: bool = False):
+        """Keep only the needed files. With `sort` they are sorted from the highest priority."""
+        if len(self._store) == 0:
+            return
+        priorities = np.concatenate(self._priorities)
+        order = np.argsort(-priorities, kind="stable")[: self.max_candidates]
+        if self.bytes_to_free is not None:
+            sizes = self._store.get_sizes()[order]
+            needed = int(np.searchsorted(np.cumsum(sizes), self.bytes_to_free)) + 1
+            order = order[:needed]
+        if len(order) == len(priorities) and not sort:
+            # nothing to drop, the store is sorted once before selection
+            self._priorities = [priorities]
+            self._compact_at = 2 * len(order)
+            return
+        self._store = self._store.take(order)
+        self._priorities = [priorities[order]]
+        self._compact_at = max(2 * len(order), COMPACT_MIN)
+        if len(order) < len(priorities):
+            self._threshold = int(priorities[order[-1]])
+
+    def select(self, bytes_to_free: int, skip_paths=frozenset()) -> List[dict]:
+        """Files with the highest priority whose total size is at least `bytes_to_free`."""
+        self._compact(sort=True)
+        selected = []
+        freed = 0
+        for i in range(len(self._store)):
+            if freed >= bytes_to_free:
+                break
+            candidate = self._store.get(i)
+            if candidate.path in skip_paths:
+                continue
+            selected.append(candidate.to_dict())
+            freed += candidate.size
+        if freed < bytes_to_free:
+            sly.logger.warning(
+                f"Only {freed} of {bytes_to_free} bytes can be freed by size rules: "
+                f"not enough candidates (max {self.max_candidates})."
+            )
+        self._reset()
+        return selected
+
+
+class RootPolicy:
+    """Applies a rule to pages of one root."""
+
+    def __init__(self, rule: Rule, del_date: datetime, now: Optional[datetime] = None):
+        self.rule = rule
+        self.del_date = del_date
+        if rule.max_age_days is not None:
+            # counted from the start of the cycle, so a resumed cycle keeps its cutoffs
+            self.del_date = (now or datetime.now()) - timedelta(days=rule.max_age_days)
+        self._globs = None
+        if rule.globs:
+            self._globs = re.compile("|".join(fnmatch.translate(g) for g in rule.globs))
+        self.selector = None
+        if rule.target_size is not None:
+            self.selector = TopKSelector(rule.order, rule.max_candidates)
+        self.removed_size = 0
+
+    def filter_page(
+        self, files_info: List[dict], team_selector: Optional[TopKSelector] = None
+    ) -> Dict[str, List[dict]]:
+        """Get files to remove right away by reason. Other files become size candidates."""
+        result = {}
+        if len(files_info) == 0:
+            return result
+        with_sizes = self.selector is not None or team_selector is not None
+        columns = ListingColumns.from_page(
+            files_info, with_sizes=with_sizes, with_extensions=bool(self.rule.extensions)
+        )
+        to_remove = columns.older_than(self.del_date)
+        result[REASON_AGE] = to_remove
+        if self.rule.extensions:
+            mask = columns.has_extension(self.rule.extensions) & ~to_remove
+            result[REASON_EXTENSION] = mask
+            to_remove = to_remove | mask
+        if self._globs is not None:
+            matched = np.fromiter(
+                (self._globs.match(path) is not None for path in columns.paths),
+                dtype=bool,
+                count=len(columns),
+            )
+            result[REASON_PATTERN] = matched & ~to_remove
+            to_remove = to_remove | matched
+        if with_sizes:
+            self.removed_size += int(columns.sizes[to_remove].sum())
+            for selector in (self.selector, team_selector):
+                if selector is not None:
+                    selector.push(columns, files_info, ~to_remove)
+        return {
+            reason: select_files(files_info, mask) for reason, mask in result.items() if mask.any()
+        }
+
+    def get_folder_filter(self) -> Optional[Callable[[dict], bool]]:
+        """
+        Folders created after the cutoff date can't contain old files, so they don't have
+        to be listed if only the age rule is set for the root.
+        """
+        if self.rule.extensions or self.rule.globs or self.selector is not None:
+            return None
+        return lambda folder_info: created_after(folder_info, self.del_date)
+
+    def finish(self) -> List[dict]:
+        """Files to remove to fit the root into `target_size`."""
+        if self.selector is None:
+            return []
+        bytes_to_free = self.selector.total_size - self.rule.target_size
+        if bytes_to_free <= 0:
+            return []
+        return self.selector.select(bytes_to_free)
+
+
+class TeamPolicy:
+    """Rules of all roots of one team and the team-wide `free_bytes` goal."""
+
+    def __init__(
+        self,
+        policy_set: "PolicySet",
+        team_id: int,
+        del_date: datetime,
+        now: Optional[datetime] = None,
+    ):
+        self._policy_set = policy_set
+        self.team_id = team_id
+        self.del_date = del_date
+        self.now = now
+        self.rule = policy_set.get_rule(team_id)
+        self.roots: Dict[str, RootPolicy] = {}
+        self.selector = None
+        if self.rule.free_bytes is not None:
+            self.selector = TopKSelector(
+                self.rule.order, self.rule.max_candidates, self.rule.free_bytes
+            )
+
+    def has_size_rules(self, roots: List[str]) -> bool:
+        """Size rules need a full listing, so incremental scans can't be used for the team."""
+        if self.selector is not None:
+            return True
+        return any(self.get_root(root).rule.target_size is not None for root in roots)
+
+    def get_del_date(self, root: str) -> datetime:
+        return self.get_root(root).del_date
+
+    def get_root(self, root: str) -> RootPolicy:
+        if root not in self.roots:
+            rule = self._policy_set.get_rule(self.team_id, root)
+            self.roots[root] = RootPolicy(rule, self.del_date, self.now)
+        return self.roots[root]
+
+    def get_folder_filter(self, root: str) -> Optional[Callable[[dict], bool]]:
+        if self.selector is not None:
+            return None
+        return self.get_root(root).get_folder_filter()
+
+    def filter_page(self, root: str, files_info: List[dict]) -> Dict[str, List[dict]]:
+        return self.get_root(root).filter_page(files_info, self.selector)
+
+    def finish(self) -> List[dict]:
+        """Files selected by size rules, once all roots are listed."""
+        selected = []
+        for root_policy in self.roots.values():
+            selected.extend(root_policy.finish())
+        if self.selector is not None:
+            freed = sum(p.removed_size for p in self.roots.values())
+            freed += sum(file_info["size"] for file_info in selected)
+            if freed < self.rule.free_bytes:
+                skip_paths = {file_info["path"] for file_info in selected}
+                selected.extend(self.selector.select(self.rule.free_bytes - freed, skip_paths))
+        return selected
+
+
+class PolicySet:
+    """
+    Cleaning rules loaded from JSON:
+
+        {
+            "default": {"max_age_days": 30},
+            "roots": {"/import": {"max_age_days": 7, "target_size": "50GB"}},
+            "teams": {
+                "5": {"free_bytes": "500GB", "order": "largest",
+                      "roots": {"/import": {"extensions": [".zip"]}}}
+            }
+        }
+
+    Rules are merged field by field: default < root < team < root of the team.
+    Without rules, files older than the cleaning period are removed, as before.
+    """
+
+    def __init__(self, data: Optional[dict] = None):
+        data = data or {}
+        self._default = Rule.from_dict(data.get("default", {}))
+        self._roots: Dict[str, dict] = {_norm(r): v for r, v in data.get("roots", {}).items()}
+        self._teams: Dict[int, dict] = {int(t): v for t, v in data.get("teams", {}).items()}
+        # validate all rules at load time
+        for team_id, team_data in self._teams.items():
+            for root in team_data.get("roots", {}):
+                self.get_rule(team_id, root)
+            self.get_rule(team_id)
+        for root in self._roots:
+            self.get_rule(None, root)
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> "PolicySet":
+        if not text or not text.strip():
+            return cls()
+        return cls(json.loads(text))
+
+    def get_rule(self, team_id: Optional[int], root: Optional[str] = None) -> Rule:
+        rule = self._default
+        team_data = self._teams.get(team_id, {})
+        if root is not None:
+            root = _norm(root)
+            rule = rule.merge(self._roots.get(root, {}))
+        rule = rule.merge({k: v for k, v in team_data.items() if k != "free_bytes"})
+        if root is not None:
+            team_roots = {_norm(r): v for r, v in team_data.get("roots", {}).items()}
+            rule = rule.merge(team_roots.get(root, {}))
+        else:
+            rule.free_bytes = parse_size(team_data.get("free_bytes"))
+        return rule
+
+    def for_team(
+        self, team_id: int, del_date: datetime, now: Optional[datetime] = None
+    ) -> TeamPolicy:
+        """Rules of the team. Ages of rules are counted from `now` (the start of the cycle)."""
+        return TeamPolicy(self, team_id, del_date, now)
+
+
+def _norm(root: str) -> str:
+    return "/" + root.strip("/")
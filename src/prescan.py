@@ -0,0 +1,209 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import supervisely as sly
+from supervisely.api.module_api import ApiField
+from supervisely.api.team_api import TeamInfo
+
+import sly_functions as f
+from checkpoint import CycleCheckpoint, TeamHistory
+from columnar import ListingColumns
+from engine import CleaningOptions
+from metrics import METRICS, labels
+from policy import PolicySet, TeamPolicy
+
+# entities of a directory checked by the pre-scan, the rest are counted as one candidate
+PRESCAN_LIMIT = 1000
+
+
+@dataclass
+class TeamEstimate:
+    """Space that cleaning of a team can free, estimated from shallow listings of its roots."""
+
+    team_id: int
+    # old files and folders that can hold old files
+    candidates: int = 0
+    # total size of candidates with known sizes
+    scanned_size: int = 0
+    # candidates without sizes: folders, directories with rules other than age
+    unsized: int = 0
+    # space freed by the last cleaning of the team
+    history_size: int = 0
+    # directories that are not empty, other directories are not listed by the cleaning
+    roots: List[str] = field(default_factory=list)
+    # False if some entities were not checked: a directory didn't fit into the first page
+    # or offline sessions were taken as checked by the last cleaning
+    fully_probed: bool = True
+
+    @property
+    def reclaimable_size(self) -> int:
+        if self.unsized == 0:
+            return self.scanned_size
+        # the last cleaning tells how much candidates without sizes usually hold
+        return max(self.scanned_size, self.history_size)
+
+    @property
+    def is_empty(self) -> bool:
+        """Nothing to remove for sure: a team with unchecked entities is cleaned anyway."""
+        return self.candidates == 0 and self.fully_probed
+
+
+def _changed_since(entity: dict, since: datetime) -> bool:
+    """True if the entity was created or updated on the day of `since` or later."""
+    dates = [entity.get("createdAt"), entity.get("updatedAt")]
+    if not any(dates):
+        return True
+    return any(d and datetime.strptime(d[:10], "%Y-%m-%d") >= since for d in dates)
+
+
+def _estimate_root(
+    estimate: TeamEstimate, team_policy: TeamPolicy, root: str, entities: List[dict]
+):
+    folder_filter = team_policy.get_folder_filter(root)
+    if folder_filter is None:
+        # extensions, patterns and size rules select files of any age
+        estimate.candidates += len(entities)
+        estimate.unsized += 1
+        return
+    files = [entity for entity in entities if entity[ApiField.TYPE] != "folder"]
+    if len(files) > 0:
+        columns = ListingColumns.from_page(files, with_sizes=True)
+        old = columns.older_than(team_policy.get_del_date(root))
+        estimate.candidates += int(old.sum())
+        estimate.scanned_size += int(columns.sizes[old].sum())
+    for entity in entities:
+        # folders created after the cutoff date can't hold old files
+        if entity[ApiField.TYPE] != "folder" or folder_filter(entity):
+            continue
+        estimate.candidates += 1
+        if entity.get("size"):
+            estimate.scanned_size += entity["size"]
+        else:
+            estimate.unsized += 1
+
+
+def _estimate_offlines(
+    estimate: TeamEstimate, entities: List[dict], history: Optional[TeamHistory]
+):
+    # sessions of cleaned apps are found by their tasks, which is not cheap: sessions
+    # that didn't change since the last cleaning were already checked
+    if history is not None:
+        since = datetime.fromtimestamp(history.cleaned_at).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        changed = [entity for entity in entities if _changed_since(entity, since)]
+        if len(changed) < len(entities):
+            # files can be added to a session folder without changing its dates
+            estimate.fully_probed = False
+        entities = changed
+    estimate.candidates += len(entities)
+    estimate.unsized += len(entities)
+
+
+async def estimate_team_async(
+    api: sly.Api,
+    team_id: int,
+    options: CleaningOptions,
+    history: Optional[TeamHistory] = None,
+) -> TeamEstimate:
+    """
+    Estimate how much space cleaning of the team can free with one non-recursive request
+    per directory: old files are counted with their sizes, folders created before the
+    cutoff date with their sizes if the server returns them. Offline sessions and
+    directories with other rules than age are counted as candidates without size.
+    """
+    team_policy = (options.policies or PolicySet()).for_team(
+        team_id, options.del_date, options.started_at
+    )
+    estimate = TeamEstimate(team_id, history_size=history.reclaimed_size if history else 0)
+    roots = [*options.paths_to_del, options.offlines_path]
+    pages = await asyncio.gather(
+        *(
+            f.storage_list_page_async(
+                api,
+                team_id,
+                root,
+                recursive=False,
+                with_metadata=False,
+                light=True,
+                limit=PRESCAN_LIMIT,
+            )
+            for root in roots
+        )
+    )
+    for root, (entities, continuation_token) in zip(roots, pages):
+        if len(entities) == 0:
+            continue
+        estimate.roots.append(root)
+        if root == options.offlines_path:
+            _estimate_offlines(estimate, entities, history)
+        else:
+            _estimate_root(estimate, team_policy, root, entities)
+        if continuation_token:
+            # entities after the first page are not checked
+            estimate.candidates += 1
+            estimate.unsized += 1
+            estimate.fully_probed = False
+    return estimate
+
+
+async def prescan_teams_async(
+    api: sly.Api,
+    teams_infos: List[TeamInfo],
+    options: CleaningOptions,
+    checkpoint: Optional[CycleCheckpoint] = None,
+) -> Dict[int, TeamEstimate]:
+    """
+    Estimate teams concurrently, `options.concurrency` teams at a time. Teams that are
+    already processed in the resumed cycle and teams that failed to be estimated get
+    no estimate.
+    """
+    history = {}
+    progress = {}
+    if checkpoint is not None:
+        history = checkpoint.get_teams_history(options.mode)
+        progress = checkpoint.get_teams_progress()
+    semaphore = asyncio.Semaphore(options.concurrency)
+    estimates = {}
+
+    async def _estimate(team_info: TeamInfo):
+        async with semaphore:
+            try:
+                with labels(team=team_info.id):
+                    estimate = await estimate_team_async(
+                        api, team_info.id, options, history.get(team_info.id)
+                    )
+            except Exception as e:
+                sly.logger.warning(
+                    f"Team: [{team_info.id}]{team_info.name}. Pre-scan failed: {repr(e)}"
+                )
+                return
+        estimates[team_info.id] = estimate
+        sly.logger.debug(
+            f"Team: [{team_info.id}]{team_info.name}. Candidates: {estimate.candidates} "
+            f"({estimate.unsized} without size), can be freed: {estimate.reclaimable_size} bytes."
+        )
+
+    with labels(phase="prescan"), METRICS.timer("phase_seconds"):
+        await asyncio.gather(*(_estimate(t) for t in teams_infos if t.id not in progress))
+    return estimates
+
+
+def prioritize_teams(
+    teams_infos: List[TeamInfo], estimates: Dict[int, TeamEstimate]
+) -> Tuple[List[TeamInfo], List[TeamInfo]]:
+    """
+    Order teams by the space that can be freed, biggest first, and split off teams
+    that have nothing to remove in every directory checked in full (see `is_empty`).
+    Teams without an estimate go first, in their order.
+    Returns teams to clean and teams to skip.
+    """
+    not_estimated = [t for t in teams_infos if t.id not in estimates]
+    estimated = [t for t in teams_infos if t.id in estimates and not estimates[t.id].is_empty]
+    skipped = [t for t in teams_infos if t.id in estimates and estimates[t.id].is_empty]
+    estimated.sort(
+        key=lambda t: (estimates[t.id].reclaimable_size, estimates[t.id].unsized), reverse=True
+    )
+    return not_estimated + estimated, skipped
@@ -0,0 +1,118 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+import supervisely as sly
+from supervisely._utils import sizeof_fmt
+
+from metrics import get_labels
+
+PROFILES_DIR_NAME = "profiles"
+TOP_N = 30
+TRACEMALLOC_FRAMES = 5
+
+
+class Profiler:
+    """
+    Opt-in profiling of cleaning phases of sampled teams.
+
+    Every `every`-th team started by the process is sampled. Each phase of a sampled team
+    runs under cProfile and tracemalloc, and two files are written to `output_dir`:
+    `team_<id>_<phase>.prof` (open it with `pstats` or snakeviz) and `team_<id>_<phase>.txt`
+    with the top `top_n` functions by cumulative time and allocations of the phase by line.
+    Files of the previous cycle are overwritten.
+
+    Both profilers are global, so only one phase is profiled at a time, and with several
+    teams in parallel the work of other teams (and waiting for I/O) shows up in it too.
+    """
+
+    def __init__(self):
+        self.every = 0
+        self.output_dir: Optional[str] = None
+        self.top_n = TOP_N
+        self._teams = 0
+        self._active = False
+
+    def configure(self, every: int, output_dir: Optional[str] = None, top_n: int = TOP_N):
+        """Profile every `every`-th team (0 - disabled)."""
+        self.every = every
+        self.top_n = top_n
+        if every > 0:
+            if output_dir is None:
+                output_dir = os.path.join(sly.app.get_data_dir(), PROFILES_DIR_NAME)
+            sly.fs.mkdir(output_dir)
+            sly.logger.info(f"Every {every} team is profiled, reports are saved to {output_dir}")
+        self.output_dir = output_dir
+
+    def sample_team(self) -> bool:
+        """Called when a team is started. True if phases of the team have to be profiled."""
+        if self.every <= 0:
+            return False
+        self._teams += 1
+        return (self._teams - 1) % self.every == 0
+
+    @contextmanager
+    def phase(self, enabled: bool = True):
+        """Profile the block as the phase of the team from the current metrics labels."""
+        if not enabled or self._active:
+            yield
+            return
+        self._active = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        t = time.monotonic()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.monotonic() - t
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self._active = False
+            self._write(profile, before, after, peak, elapsed)
+
+    def _write(
+        self,
+        profile: cProfile.Profile,
+        before: tracemalloc.Snapshot,
+        after: tracemalloc.Snapshot,
+        peak: int,
+        elapsed: float,
+    ):
+        current_labels = get_labels()
+        name = f"team_{current_labels.get('team')}_{current_labels.get('phase')}"
+        path = os.path.join(self.output_dir, name)
+        profile.dump_stats(path + ".prof")
+
+        stream = io.StringIO()
+        stream.write(f"{name}: {elapsed:.2f} sec, traced memory peak {sizeof_fmt(peak)}\n\n")
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        # frames of the profilers themselves are not interesting
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+        diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+        stream.write(f"Top {self.top_n} allocations of the phase by line:\n")
+        for stat in diff[: self.top_n]:
+            stream.write(f"{stat}\n")
+        with open(path + ".txt", "w") as file:
+            file.write(stream.getvalue())
+        sly.logger.debug(f"Profile of {name} is saved to {path}.prof")
+
+
+# * one profiler per process, configured by the app
+PROFILER = Profiler()
@@ -0,0 +1,233 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import httpx
+import supervisely as sly
+from supervisely.io.network_exceptions import RETRY_STATUS_CODES
+
+from metrics import METRICS
+
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_CAP = 60.0  # seconds
+
+
+class CircuitOpenError(Exception):
+    """Requests of a team are not sent: too many of them failed recently."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Connection errors, timeouts and server errors (5xx, 429) can be retried."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """
+    Exponential backoff with full jitter: a random delay up to `BACKOFF_BASE * 2**attempt`
+    seconds, so clients that failed together don't retry together. `Retry-After` of the
+    response is respected.
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    if isinstance(error, httpx.HTTPStatusError):
+        retry_after = error.response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(BACKOFF_CAP, int(retry_after)))
+    return delay
+
+
+class RateLimiter:
+    """Token bucket that limits the number of requests per second sent to the server."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RetryBudget:
+    """
+    Limits retries in a cycle to `ratio` of sent requests (plus `min_retries`), so when the
+    server is struggling, retries don't multiply the load on it.
+    """
+
+    def __init__(self, ratio: float, min_retries: int = 20):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.retries = 0
+        self._exhausted = False
+
+    def on_request(self):
+        self.requests += 1
+
+    def try_spend(self) -> bool:
+        if self.retries >= self.min_retries + self.ratio * self.requests:
+            if not self._exhausted:
+                sly.logger.warning(
+                    f"Retry budget is spent: {self.retries} retries of {self.requests} requests. "
+                    f"Failed requests are not retried until more requests are sent."
+                )
+                self._exhausted = True
+            METRICS.inc("retry_budget_exhausted")
+            return False
+        self._exhausted = False
+        self.retries += 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Stops requests when most of them fail.
+
+    Results of the last `window` requests are counted. When at least `min_requests` are
+    counted and the share of failures reaches `failure_rate`, the circuit opens for
+    `cooldown` seconds. Then a single trial request is let through: the circuit closes if
+    it succeeds and opens again for twice as long (up to `max_cooldown`) if it fails.
+    """
+
+    def __init__(
+        self,
+        scope: str,
+        failure_rate: float = 0.5,
+        window: int = 50,
+        min_requests: int = 20,
+        cooldown: float = 10.0,
+        max_cooldown: float = 300.0,
+    ):
+        self.scope = scope
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self._results = deque(maxlen=window)
+        self._opened_until: Optional[float] = None
+        self._trial = False
+
+    def _open(self):
+        self._opened_until = time.monotonic() + self.cooldown
+        self._trial = False
+        self._results.clear()
+        METRICS.inc("circuit_opened", scope=self.scope)
+        sly.logger.warning(
+            f"Too many failed requests ({self.scope}): requests are paused "
+            f"for {self.cooldown:.0f} sec."
+        )
+
+    def get_delay(self) -> float:
+        """Seconds to wait before the next request can be sent, 0 if it can be sent now."""
+        if self._opened_until is None:
+            return 0
+        delay = self._opened_until - time.monotonic()
+        if delay > 0:
+            return delay
+        if self._trial:
+            # wait for the result of the trial request
+            return min(1.0, self.cooldown)
+        self._trial = True
+        return 0
+
+    def record(self, failed: bool) -> bool:
+        """Count the result of a request. Returns True if the circuit is opened by it."""
+        if self._opened_until is not None:
+            if not self._trial:
+                # sent before the circuit was opened
+                return False
+            if failed:
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open()
+                return True
+            sly.logger.info(f"Requests are resumed ({self.scope}).")
+            self._opened_until = None
+            self._trial = False
+            self.cooldown = self.base_cooldown
+            return False
+        self._results.append(failed)
+        if len(self._results) < self.min_requests:
+            return False
+        if sum(self._results) < self.failure_rate * len(self._results):
+            return False
+        self._open()
+        return True
+
+    def clear(self):
+        """Forget counted results, e.g. failures that were not caused by this scope."""
+        self._results.clear()
+
+
+class Resilience:
+    """
+    Policy shared by all requests of the app: rate limit, retries with jittered backoff
+    within the retry budget of the cycle, and circuit breakers.
+
+    The global circuit pauses all requests while the server fails. Every team has its
+    own circuit with a higher threshold as well: when it opens, requests of the team fail
+    right away with `CircuitOpenError`, so the team is paused until the next cycle and
+    other teams go on. When the global circuit opens, failures counted by teams are
+    forgotten: the server failed, not the teams.
+    """
+
+    def __init__(self, retry_budget: Optional[float] = 0.2):
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.budget = RetryBudget(retry_budget) if retry_budget else None
+        self.start_cycle()
+
+    def start_cycle(self):
+        if self.budget is not None:
+            self.budget.reset()
+        self.breaker = CircuitBreaker("all requests")
+        self._team_breakers: Dict[int, CircuitBreaker] = {}
+
+    def _get_team_breaker(self, team_id: int) -> CircuitBreaker:
+        if team_id not in self._team_breakers:
+            self._team_breakers[team_id] = CircuitBreaker(f"team {team_id}", failure_rate=0.8)
+        return self._team_breakers[team_id]
+
+    async def acquire(self, team_id: Optional[int] = None):
+        """Wait until a request can be sent."""
+        if team_id is not None and self._get_team_breaker(team_id).get_delay() > 0:
+            raise CircuitOpenError(f"Requests of team {team_id} are paused after failures")
+        while True:
+            delay = self.breaker.get_delay()
+            if delay == 0:
+                break
+            await asyncio.sleep(delay)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        if self.budget is not None:
+            self.budget.on_request()
+
+    def record(self, team_id: Optional[int], error: Optional[Exception]):
+        failed = error is not None and is_retryable(error)
+        if self.breaker.record(failed):
+            for breaker in self._team_breakers.values():
+                breaker.clear()
+        elif team_id is not None:
+            self._get_team_breaker(team_id).record(failed)
+
+    def try_retry(self) -> bool:
+        """Take a retry from the budget of the cycle. False if the budget is spent."""
+        return self.budget is None or self.budget.try_spend()
+
+    async def backoff(self, attempt: int, error: Optional[Exception] = None):
+        await asyncio.sleep(backoff_delay(attempt, error))
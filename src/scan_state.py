@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import supervisely as sly
+
+SCAN_STATE_FILENAME = "scan_state.db"
+
+
+class ScanState:
+    """
+    SQLite store with scan progress of every team kept between cleaning cycles.
+
+    For every team root it keeps the continuation token of the last listed file and the
+    files that were listed but were too new to be removed ("pending" files). Next cycles
+    continue listing from the saved token and remove pending files as soon as they pass
+    the age cutoff, without listing the whole root again. Saved dates are only hints:
+    a file can be uploaded again under the same path, so due files are checked by the
+    listing of their directories before they are removed.
+
+    Listing continues after the last listed path, so new files with paths that sort before
+    it (e.g. `/offline-sessions/10000/...` after `/offline-sessions/9999/...`) are found only
+    when the team state is dropped and the team is listed from scratch: every
+    `full_scan_every` cycles, and whenever the last full scan is older than the cutoff
+    date passed to `start_team_scan`. Then files missed by the incremental listing are
+    listed before they become old, and old files are not removed later than without it.
+    """
+
+    def __init__(self, path: str, full_scan_every: int = 7):
+        self.path = path
+        self.full_scan_every = full_scan_every
+        # worker processes of a sharded cycle write to the same database
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS teams (
+                team_id INTEGER PRIMARY KEY,
+                cycles_since_full_scan INTEGER NOT NULL,
+                full_scan_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS roots (
+                team_id INTEGER NOT NULL,
+                root TEXT NOT NULL,
+                continuation_token TEXT,
+                scanned_files INTEGER NOT NULL DEFAULT 0,
+                scanned_at REAL,
+                PRIMARY KEY (team_id, root)
+            );
+            CREATE TABLE IF NOT EXISTS pending_files (
+                team_id INTEGER NOT NULL,
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (team_id, path)
+            );
+            CREATE INDEX IF NOT EXISTS pending_files_updated_at
+                ON pending_files (team_id, updated_at);
+            """
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_app_data_dir(cls, full_scan_every: int = 7) -> "ScanState":
+        path = os.path.join(sly.app.get_data_dir(), SCAN_STATE_FILENAME)
+        sly.logger.info(f"Scan state is stored in {path}")
+        return cls(path, full_scan_every)
+
+    def close(self):
+        self._conn.close()
+
+    def start_team_scan(self, team_id: int, del_date: Optional[datetime] = None) -> bool:
+        """
+        Register a new cycle for the team. Returns True if the team has to be listed from
+        scratch: it was not listed yet, `full_scan_every` cycles passed, or the day of the
+        last full scan is before `del_date` (the latest cutoff date of the team roots).
+        """
+        row = self._conn.execute(
+            "SELECT cycles_since_full_scan, full_scan_at FROM teams WHERE team_id = ?",
+            (team_id,),
+        ).fetchone()
+        full_scan = row is None or row[0] + 1 >= self.full_scan_every
+        if not full_scan and del_date is not None:
+            # files are old by the date of their update (see `sort_by_date`), so a file
+            # added on the day of the last full scan is old as soon as that day is
+            full_scan_day = datetime.fromtimestamp(row[1]).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            if full_scan_day < del_date:
+                sly.logger.debug(f"Team: {team_id}. The last full scan is older than the cutoff.")
+                full_scan = True
+        if full_scan:
+            self._conn.execute("DELETE FROM roots WHERE team_id = ?", (team_id,))
+            self._conn.execute("DELETE FROM pending_files WHERE team_id = ?", (team_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO teams VALUES (?, 0, ?)", (team_id, time.time())
+            )
+        else:
+            self._conn.execute(
+                "UPDATE teams SET cycles_since_full_scan = cycles_since_full_scan + 1 "
+                "WHERE team_id = ?",
+                (team_id,),
+            )
+        self._conn.commit()
+        return full_scan
+
+    def get_tokens(self, team_id: int) -> Dict[str, str]:
+        rows = self._conn.execute(
+            "SELECT root, continuation_token FROM roots "
+            "WHERE team_id = ? AND continuation_token IS NOT NULL",
+            (team_id,),
+        )
+        return dict(rows.fetchall())
+
+    def set_token(self, team_id: int, root: str, continuation_token: str, scanned_files: int = 0):
+        self._conn.execute(
+            """
+            INSERT INTO roots VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (team_id, root) DO UPDATE SET
+                continuation_token = excluded.continuation_token,
+                scanned_files = scanned_files + excluded.scanned_files,
+                scanned_at = excluded.scanned_at
+            """,
+            (team_id, root, continuation_token, scanned_files, time.time()),
+        )
+        self._conn.commit()
+
+    def add_pending_files(self, team_id: int, root: str, files: Iterable[Tuple[str, str]]):
+        """Save `(path, updatedAt)` of files that are not old enough to be removed yet."""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO pending_files VALUES (?, ?, ?, ?)",
+            ((team_id, root, path, updated_at) for path, updated_at in files),
+        )
+        self._conn.commit()
+
+    def get_due_files(
+        self, team_id: int, del_date: datetime, root: Optional[str] = None
+    ) -> List[str]:
+        """Get pending files of the team (or of its root) that are older than `del_date` now."""
+        # updatedAt is an ISO string, so dates are compared as strings
+        # (same rule as in `sort_by_date`: file date at midnight < del_date)
+        last_date = (del_date - timedelta(microseconds=1)).date()
+        cutoff = (last_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        query = "SELECT path FROM pending_files WHERE team_id = ? AND updated_at < ?"
+        params = (team_id, cutoff)
+        if root is not None:
+            query += " AND root = ?"
+            params += (root,)
+        rows = self._conn.execute(query, params)
+        return [row[0] for row in rows.fetchall()]
+
+    def remove_pending_files(self, team_id: int, paths: Iterable[str]):
+        self._conn.executemany(
+            "DELETE FROM pending_files WHERE team_id = ? AND path = ?",
+            ((team_id, path) for path in paths),
+        )
+        self._conn.commit()
@@ -0,0 +1,181 @@
+import json
+import math
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import supervisely as sly
+from supervisely.api.team_api import TeamInfo
+from tqdm import tqdm
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+WINDOW_RE = re.compile(r"\s*(?:([a-z,\-]+)\s+)?(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*")
+MIN_SLEEP = timedelta(hours=1)
+
+
+class TimeWindow(NamedTuple):
+    """Allowed time of the day on some weekdays; the end can be on the next day."""
+
+    weekdays: frozenset
+    start: int  # minutes since midnight
+    end: int
+
+    @classmethod
+    def parse(cls, text: str) -> "TimeWindow":
+        """Parse windows like `22:00-06:00`, `sat,sun 00:00-24:00` or `mon-fri 20:00-23:30`."""
+        match = WINDOW_RE.fullmatch(text.lower())
+        if match is None:
+            raise ValueError(f"Invalid time window: '{text}'")
+        days, start_h, start_m, end_h, end_m = match.groups()
+        weekdays = set(range(7))
+        if days is not None:
+            weekdays = set()
+            for part in days.split(","):
+                first, _, last = part.partition("-")
+                first_i = WEEKDAYS.index(first[:3])
+                last_i = WEEKDAYS.index(last[:3]) if last else first_i
+                i = first_i
+                weekdays.add(i)
+                while i != last_i:
+                    i = (i + 1) % 7
+                    weekdays.add(i)
+        start = int(start_h) * 60 + int(start_m)
+        end = int(end_h) * 60 + int(end_m)
+        if start > 24 * 60 or end > 24 * 60:
+            raise ValueError(f"Invalid time window: '{text}'")
+        return cls(frozenset(weekdays), start, end)
+
+    def occurrences(self, day: datetime):
+        """Start and end of the window that starts on the day, if the window is open on it."""
+        if day.weekday() not in self.weekdays:
+            return None
+        midnight = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        start = midnight + timedelta(minutes=self.start)
+        end = midnight + timedelta(minutes=self.end)
+        if end <= start:
+            end += timedelta(days=1)
+        return start, end
+
+
+class Scheduler:
+    """
+    Decides when cleaning cycles run and which teams they clean.
+
+    Every team is cleaned once per its interval (`team_intervals`, `interval` for other
+    teams). If time windows are set, cycles that remove files run only inside a window
+    and are paused when it closes; the paused cycle is resumed in the next window.
+    Windows use the local time of the app.
+    """
+
+    def __init__(
+        self,
+        interval: timedelta,
+        windows: Optional[List[TimeWindow]] = None,
+        team_intervals: Optional[Dict[int, timedelta]] = None,
+    ):
+        self.interval = interval
+        self.windows = windows or []
+        self.team_intervals = team_intervals or {}
+
+    @classmethod
+    def from_settings(
+        cls, sleep_days: float, windows: Optional[str], team_intervals: Optional[str]
+    ) -> "Scheduler":
+        """
+        `windows` - time windows separated by `;`, `team_intervals` - JSON with intervals
+        in days by team id, e.g. `{"5": 1, "7": 14}`.
+        """
+        parsed_windows = [TimeWindow.parse(w) for w in (windows or "").split(";") if w.strip()]
+        intervals = {}
+        if team_intervals and team_intervals.strip():
+            intervals = {
+                int(team_id): timedelta(days=days)
+                for team_id, days in json.loads(team_intervals).items()
+            }
+        return cls(timedelta(days=sleep_days), parsed_windows, intervals)
+
+    def _current_or_next_window(self, now: datetime):
+        # a window that started yesterday can still be open
+        candidates = []
+        for days in range(-1, 8):
+            day = now + timedelta(days=days)
+            for window in self.windows:
+                occurrence = window.occurrences(day)
+                if occurrence is not None and occurrence[1] > now:
+                    candidates.append(occurrence)
+        if not candidates:
+            return None
+        # merge overlapping and adjacent windows, e.g. "sat,sun 00:00-24:00"
+        candidates.sort()
+        start, end = candidates[0]
+        for next_start, next_end in candidates[1:]:
+            if next_start > end:
+                break
+            end = max(end, next_end)
+        return start, end
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        if not self.windows:
+            return True
+        now = now or datetime.now()
+        window = self._current_or_next_window(now)
+        return window is not None and window[0] <= now
+
+    def window_end(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """End of the current window (`now` if it is closed), None if there are no windows."""
+        if not self.windows:
+            return None
+        now = now or datetime.now()
+        window = self._current_or_next_window(now)
+        return window[1] if window is not None and window[0] <= now else now
+
+    def next_window_start(self, now: Optional[datetime] = None) -> datetime:
+        now = now or datetime.now()
+        if self.is_open(now):
+            return now
+        return self._current_or_next_window(now)[0]
+
+    def get_interval(self, team_id: int) -> timedelta:
+        return self.team_intervals.get(team_id, self.interval)
+
+    def due_teams(
+        self, teams_infos: List[TeamInfo], last_cleaned: Dict[int, float], now: datetime = None
+    ) -> List[TeamInfo]:
+        """Teams that were never cleaned or were cleaned more than their interval ago."""
+        now = now or datetime.now()
+        return [
+            team_info
+            for team_info in teams_infos
+            if team_info.id not in last_cleaned
+            or datetime.fromtimestamp(last_cleaned[team_info.id]) + self.get_interval(team_info.id)
+            <= now
+        ]
+
+    def next_due_at(self, teams_infos: List[TeamInfo], last_cleaned: Dict[int, float]) -> datetime:
+        """Time when the next team becomes due, but not earlier than in `MIN_SLEEP`."""
+        now = datetime.now()
+        next_due = now + self.interval
+        for team_info in teams_infos:
+            cleaned_at = last_cleaned.get(team_info.id)
+            if cleaned_at is None:
+                due = now
+            else:
+                due = datetime.fromtimestamp(cleaned_at) + self.get_interval(team_info.id)
+            next_due = min(next_due, due)
+        return max(next_due, now + MIN_SLEEP)
+
+    def sleep_until(self, when: datetime, desc: str = "Waiting for next cleaning cycle"):
+        """Sleep with a progress bar updated every hour."""
+        seconds = (when - datetime.now()).total_seconds()
+        if seconds <= 0:
+            return
+        sly.logger.info(f"{desc} until {when:%Y-%m-%d %H:%M}.")
+        total_hours = math.ceil(seconds / 3600)
+        with tqdm(total=total_hours, desc=desc, unit="hours") as pbar:
+            while True:
+                seconds = (when - datetime.now()).total_seconds()
+                if seconds <= 0:
+                    break
+                time.sleep(min(seconds, 3600))
+                pbar.update(1)
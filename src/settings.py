@@ -0,0 +1,113 @@
+import json
+import os
+from dataclasses import dataclass, field, fields, replace
+from typing import Any, Callable, Mapping, Optional
+
+# * only the standard library is imported here, so the CLI can read settings and decide
+# * whether there is anything to do before the heavy modules are imported
+
+ENV_PREFIX = "modal.state."
+
+
+def to_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "y", "on"):
+        return True
+    if text in ("0", "false", "no", "n", "off"):
+        return False
+    raise ValueError(f"Invalid boolean value: '{value}'")
+
+
+def _setting(key: str, convert: Callable[[Any], Any], default: Any = None):
+    """Field read from the modal state key `key` (or `modal.state.<key>` env variable)."""
+    return field(default=default, metadata={"key": key, "convert": convert})
+
+
+@dataclass
+class CleanerSettings:
+    """
+    Settings of the app.
+
+    In the app they are read from the `modal.state.*` environment variables, which are
+    set from the modal window (see `modal_template_state` in config.json). The CLI reads
+    a JSON file with the same keys and arguments instead. Empty values keep defaults.
+    """
+
+    all_teams: bool = _setting("allTeams", to_bool, True)
+    selected_team_id: Optional[int] = _setting("teamId", int)
+    days_storage: int = _setting("clear", int, 30)
+    sleep_days: float = _setting("sleep", float, 2)
+    batch_size: int = _setting("batchSize", int, 20000)
+    concurrency: int = _setting("concurrency", int, 4)
+    delete_concurrency: int = _setting("deleteConcurrency", int, 4)
+    requests_per_second: float = _setting("requestsPerSecond", float, 20)
+    # share of requests that can be retried in a cycle (0 - no limit)
+    retry_budget: float = _setting("retryBudget", float, 0.2)
+    # one pool of kept-alive connections is shared by all requests of the app
+    max_connections: int = _setting("maxConnections", int, 16)
+    http2: bool = _setting("http2", to_bool, True)
+    task_cache_size: Optional[int] = _setting("taskCacheSize", lambda v: int(v) or None)
+    mode: str = _setting("mode", str, "clean")  # clean | plan | apply
+    incremental_scan: bool = _setting("incrementalScan", to_bool, False)
+    full_scan_every: int = _setting("fullScanEvery", int, 7)
+    # don't list folders created after the cutoff date (they can't contain old files)
+    folder_prepass: bool = _setting("folderPrepass", to_bool, False)
+    # remove offline sessions of apps as whole task folders, without listing their files
+    offline_by_folder: bool = _setting("offlineByFolder", to_bool, False)
+    # estimate space to free in every team with shallow listings, clean the biggest first
+    # and skip teams with nothing to remove
+    prioritize_teams: bool = _setting("prioritizeTeams", to_bool, False)
+    # teams are split between app sessions by a stable hash of the team id: every session
+    # cleans only teams of its shard (0 <= shard_index < shard_count)
+    shard_index: int = _setting("shardIndex", int, 0)
+    shard_count: int = _setting("shardCount", int, 1)
+    # teams of the session are split between worker processes the same way
+    processes: int = _setting("processes", int, 1)
+    # profile phases of every N-th team with cProfile and tracemalloc (0 - disabled)
+    profile_every: int = _setting("profileEvery", int, 0)
+    metrics_port: int = _setting("metricsPort", int, 0)  # 0 - no HTTP endpoint
+    # cleaning rules per root and per team (JSON, see `PolicySet`), only age rule if not set
+    policies: Optional[str] = _setting("policies", str)
+    # when files can be removed, e.g. "mon-fri 22:00-06:00; sat,sun 00:00-24:00",
+    # any time if not set
+    time_windows: Optional[str] = _setting("timeWindows", str)
+    # cleaning interval in days by team id (JSON), `sleep_days` for other teams
+    team_intervals: Optional[str] = _setting("teamIntervals", str)
+
+    def __post_init__(self):
+        if self.mode not in ("clean", "plan", "apply"):
+            raise ValueError(f"Unknown mode: '{self.mode}'")
+        if not self.all_teams and self.selected_team_id is None:
+            raise ValueError("Select a team or all teams")
+
+    def update(self, state: Mapping[str, Any]) -> "CleanerSettings":
+        """New settings with values of modal state keys, e.g. `{"clear": 7}`."""
+        known = {f.metadata["key"]: f for f in fields(self)}
+        changes = {}
+        for key, value in state.items():
+            if key not in known:
+                raise ValueError(f"Unknown setting: '{key}'")
+            if value is None or value == "":
+                continue
+            if isinstance(value, (dict, list)):
+                # policies and team intervals can be written as JSON objects in a file
+                value = json.dumps(value)
+            changes[known[key].name] = known[key].metadata["convert"](value)
+        return replace(self, **changes)
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "CleanerSettings":
+        keys = {f.metadata["key"] for f in fields(cls)}
+        state = {}
+        for name, value in environ.items():
+            # other keys of the modal state are not settings of the cleaner
+            if name.startswith(ENV_PREFIX) and name[len(ENV_PREFIX) :] in keys:
+                state[name[len(ENV_PREFIX) :]] = value
+        return cls().update(state)
+
+    @classmethod
+    def from_file(cls, path: str) -> "CleanerSettings":
+        with open(path) as file:
+            return cls().update(json.load(file))
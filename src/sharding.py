@@ -0,0 +1,195 @@
+import multiprocessing
+import queue
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import supervisely as sly
+from supervisely.api.team_api import TeamInfo
+
+import engine
+import sly_functions as f
+from checkpoint import CycleCheckpoint
+from metrics import METRICS
+from profiling import PROFILER
+from scan_state import ScanState
+
+# results of finished teams, sent by worker processes as soon as every team is done
+_results_queue: Optional[multiprocessing.Queue] = None
+
+
+def get_shard(team_id: int, shard_count: int) -> int:
+    """Shard of the team. The hash is stable, so every process and node gets the same shard."""
+    return zlib.crc32(str(team_id).encode()) % shard_count
+
+
+def split_shards(teams_infos: List[TeamInfo], shard_count: int) -> List[List[TeamInfo]]:
+    shards = [[] for _ in range(shard_count)]
+    for team_info in teams_infos:
+        shards[get_shard(team_info.id, shard_count)].append(team_info)
+    return shards
+
+
+def select_shard(teams_infos: List[TeamInfo], shard_index: int, shard_count: int) -> List[TeamInfo]:
+    """Teams of one app session when teams are split between `shard_count` sessions."""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index must be from 0 to {shard_count - 1}, got {shard_index}")
+    return [t for t in teams_infos if get_shard(t.id, shard_count) == shard_index]
+
+
+@dataclass
+class WorkerSettings:
+    """
+    Settings of the connection and state of the cycle for worker processes. The server
+    address and token are taken from the environment, which workers inherit.
+    """
+
+    requests_per_second: Optional[float] = None
+    retry_budget: Optional[float] = None
+    max_connections: int = 16
+    http2: bool = True
+    checkpoint_path: Optional[str] = None
+    cycle_id: Optional[int] = None
+    scan_state_path: Optional[str] = None
+    full_scan_every: int = 7
+    deadline: Optional[float] = None
+    profile_every: int = 0
+    profiles_dir: Optional[str] = None
+
+
+def _init_worker(results_queue: multiprocessing.Queue):
+    global _results_queue
+    _results_queue = results_queue
+
+
+def _clean_shard(
+    teams_infos: List[TeamInfo], options: engine.CleaningOptions, settings: WorkerSettings
+) -> Tuple[List[engine.TeamResult], dict]:
+    """Clean teams of one shard in a worker process. Returns results and metrics of the shard."""
+    METRICS.reset()
+    PROFILER.configure(settings.profile_every, settings.profiles_dir)
+    api = f.CleanerApi.from_env()
+    api.set_rate_limit(settings.requests_per_second)
+    api.set_retry_budget(settings.retry_budget)
+    api.set_connection_pool(settings.max_connections, http2=settings.http2)
+    checkpoint = None
+    if settings.checkpoint_path is not None:
+        checkpoint = CycleCheckpoint(settings.checkpoint_path, settings.cycle_id)
+    scan_state = None
+    if settings.scan_state_path is not None:
+        scan_state = ScanState(settings.scan_state_path, settings.full_scan_every)
+    try:
+        results = f.run_coroutine(
+            engine.clean_teams_async(
+                api,
+                teams_infos,
+                options,
+                on_result=_results_queue.put,
+                scan_state=scan_state,
+                checkpoint=checkpoint,
+                deadline=settings.deadline,
+            )
+        )
+    finally:
+        f.run_coroutine(api.close_async())
+        for state in (checkpoint, scan_state):
+            if state is not None:
+                state.close()
+    return results, METRICS.get_state()
+
+
+def clean_teams_in_processes(
+    teams_infos: List[TeamInfo],
+    options: engine.CleaningOptions,
+    processes: int,
+    on_result: Optional[Callable[[engine.TeamResult], None]] = None,
+    scan_state: Optional[ScanState] = None,
+    checkpoint: Optional[CycleCheckpoint] = None,
+    deadline: Optional[float] = None,
+    requests_per_second: Optional[float] = None,
+    retry_budget: Optional[float] = None,
+    profile_every: int = 0,
+    max_connections: int = 16,
+    http2: bool = True,
+) -> List[engine.TeamResult]:
+    """
+    Same as `engine.clean_teams_async`, but teams are split into `processes` shards by
+    `get_shard`, and every shard is cleaned in its own process, so JSON decoding and
+    filtering use several cores. The rate limit and connections are divided between
+    processes, every process has its own retry budget, circuit breakers and profiler
+    (which samples every `profile_every`-th team of the process). `on_result`
+    is called in this process as soon as each team is done, and metrics of the workers
+    are added to `METRICS` when they finish.
+    """
+    shards = [shard for shard in split_shards(teams_infos, processes) if len(shard) > 0]
+    if len(shards) == 0:
+        return []
+    settings = WorkerSettings(
+        requests_per_second=requests_per_second / len(shards) if requests_per_second else None,
+        retry_budget=retry_budget,
+        max_connections=max(1, max_connections // len(shards)),
+        http2=http2,
+        checkpoint_path=checkpoint.path if checkpoint is not None else None,
+        cycle_id=checkpoint.cycle_id if checkpoint is not None else None,
+        scan_state_path=scan_state.path if scan_state is not None else None,
+        full_scan_every=scan_state.full_scan_every if scan_state is not None else 7,
+        deadline=deadline,
+        profile_every=profile_every,
+        profiles_dir=PROFILER.output_dir,
+    )
+    sly.logger.info(f"Cleaning {len(teams_infos)} teams in {len(shards)} processes")
+
+    # "spawn": the app has threads (metrics server, connection pool), which are not forked
+    context = multiprocessing.get_context("spawn")
+    results_queue = context.Queue()
+    reported: Dict[int, engine.TeamResult] = {}
+
+    def _report(result: engine.TeamResult):
+        reported[result.team_id] = result
+        if on_result is not None:
+            on_result(result)
+
+    def _drain(timeout: float = 0.01):
+        while True:
+            try:
+                _report(results_queue.get(timeout=timeout))
+            except queue.Empty:
+                return
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=len(shards),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(results_queue,),
+    ) as pool:
+        futures = {pool.submit(_clean_shard, shard, options, settings): shard for shard in shards}
+        pending = set(futures)
+        while len(pending) > 0:
+            _, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            _drain()
+        for future, shard in futures.items():
+            try:
+                shard_results, metrics_state = future.result()
+            except Exception as e:
+                # e.g. the worker process was killed: unfinished teams are retried next cycle
+                sly.logger.warning(f"Shard of {len(shard)} teams failed: {repr(e)}", exc_info=True)
+                _drain()
+                for team_info in shard:
+                    if team_info.id in reported:
+                        results.append(reported[team_info.id])
+                        continue
+                    result = engine.TeamResult(team_info.id, team_info.name, error=repr(e))
+                    METRICS.inc("teams", status="error")
+                    _report(result)
+                    results.append(result)
+                continue
+            METRICS.merge(metrics_state)
+            results.extend(shard_results)
+    # results are put to the queue before the shard returns, but may arrive later
+    for _ in range(10):
+        if all(result.team_id in reported for result in results):
+            break
+        _drain(timeout=1)
+    return results
@@ -1,20 +1,41 @@
 import asyncio
 import base64
-import json
 import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Literal, Optional, Union
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import httpx
+import numpy as np
 import requests
 import supervisely as sly
 from supervisely._utils import run_coroutine
 from supervisely.api.file_api import FileInfo
 from supervisely.api.module_api import ApiField
 from supervisely.api.storage_api import StorageApi
-from tqdm import tqdm
+from supervisely.api.team_api import TeamInfo
+from supervisely.api.workspace_api import WorkspaceInfo
 
-DEFAULT_LIMIT = 10000
+import fast_json
+from columnar import ListingColumns, select_files
+from deleter import DeleteDispatcher
+from manifest import REASON_APP, REASON_EXTENSION, DryRunRemover
+from metrics import METRICS, labels
+from resilience import RateLimiter, Resilience, RetryBudget, is_retryable
+from task_resolver import TaskResolver
+
+# * offline sessions files that are removed for any app
+EXTENSIONS_TO_DELETE = [".py", ".pyc", ".md", ".sh"]
 
 
 def sort_by_date(files_info: List[dict], del_date: datetime) -> List[str]:
@@ -40,6 +61,7 @@ class CustomStorageApi(StorageApi):
         recursive: bool = True,
         return_type: Literal["dict", "fileinfo"] = "fileinfo",
         with_metadata: bool = True,
+        light: bool = False,
         include_files: bool = True,
         include_folders: bool = True,
         limit: Optional[int] = None,
@@ -47,46 +69,23 @@ class CustomStorageApi(StorageApi):
     ) -> List[Union[Dict, FileInfo]]:
         """Custom implementation of the list method."""
 
-        if not path.endswith("/"):
-            path += "/"
-        method = "file-storage.v2.list"
-        json_body = {
-            ApiField.TEAM_ID: team_id,
-            ApiField.PATH: path,
-            ApiField.RECURSIVE: recursive,
-            ApiField.WITH_METADATA: with_metadata,
-            ApiField.FILES: include_files,
-            ApiField.FOLDERS: include_folders,
-        }
-        if limit is not None:
-            json_body[ApiField.LIMIT] = limit
-
         try:
-            data = []
-            limit_exceeded = False
-            if continuation_token is None:
-                # * get first response only if continuation_token is None
-                first_response = self._api.post(method, json_body).json()
-                data = first_response.get("entities", [])
-
-                continuation_token = first_response.get("continuationToken", None)
-                if limit is not None and len(data) >= limit:
-                    limit_exceeded = True
-
-            if continuation_token is None or limit_exceeded:
-                pass
-            else:
-                while continuation_token is not None:
-                    json_body["continuationToken"] = continuation_token
-                    temp_resp = self._api.post(method, json_body)
-                    temp_data = temp_resp.json().get("entities", [])
-                    data.extend(temp_data)
-                    continuation_token = temp_resp.json().get("continuationToken", None)
-                    if limit is not None and len(data) >= limit:
-                        limit_exceeded = True
-                        break
-
-        except requests.exceptions.RequestException as e:
+            data = run_coroutine(
+                storage_get_list_async(
+                    self._api,
+                    team_id,
+                    path,
+                    recursive=recursive,
+                    return_type="dict",
+                    with_metadata=with_metadata,
+                    light=light,
+                    include_files=include_files,
+                    include_folders=include_folders,
+                    limit=limit,
+                    continuation_token=continuation_token,
+                )
+            )
+        except (requests.exceptions.RequestException, httpx.HTTPError) as e:
             if self.is_on_agent(path) is True:
                 sly.logger.warning(
                     f"Failed to list files on agent {path}: {repr(e)}", exc_info=True
@@ -94,8 +93,6 @@ class CustomStorageApi(StorageApi):
                 return []
             else:
                 raise e
-        if limit_exceeded:
-            data = data[:limit]
 
         if return_type == "fileinfo":
             results = []
@@ -107,20 +104,137 @@ class CustomStorageApi(StorageApi):
         return data
 
 
+class CleanerApi(sly.Api):
+    """
+    Api with a shared per-server rate limit, retry policy (see `Resilience`) and
+    connection pool for async requests.
+    """
+
+    connections_limiter: Optional[asyncio.Semaphore] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resilience = Resilience()
+
+    def set_rate_limit(self, requests_per_second: Optional[float]):
+        rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+        self.resilience.rate_limiter = rate_limiter
+
+    def set_retry_budget(self, retry_budget: Optional[float]):
+        """Share of requests that can be retried in a cycle, no limit if not set."""
+        self.resilience.budget = RetryBudget(retry_budget) if retry_budget else None
+
+    def set_connection_pool(
+        self,
+        max_connections: int = 16,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+    ):
+        """
+        Use one async client with a bounded pool for all requests of the app.
+
+        The client of the SDK keeps only 20 idle connections, so with more requests in
+        flight connections are closed and opened again all the time. Here all connections
+        are kept alive between requests, and at most `max_connections` requests are in
+        flight: others wait for a free connection on a semaphore, not in the queue of the
+        httpx pool, which is rescanned on every request. HTTP/2 is used if the server
+        supports it and the `h2` package is installed.
+        """
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                sly.logger.warning("HTTP/2 is disabled: the 'h2' package is not installed.")
+                http2 = False
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.async_httpx_client = httpx.AsyncClient(http2=http2, limits=limits)
+        self.connections_limiter = asyncio.Semaphore(max_connections)
+
+    async def close_async(self):
+        if self.async_httpx_client is not None:
+            await self.async_httpx_client.aclose()
+            self.async_httpx_client = None
+
+    async def post_async(
+        self,
+        method: str,
+        json: Optional[Dict] = None,
+        retries: Optional[int] = None,
+        raise_error: bool = False,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send a request, retrying connection errors and server errors up to `retries`
+        attempts with a jittered backoff while the retry budget of the cycle lasts.
+        With `raise_error` the request is sent once, as in `sly.Api`.
+        """
+        attempts = 1 if raise_error else retries or self.retry_count
+        attempt = 0
+        while True:
+            try:
+                return await self._post_once_async(method, json, **kwargs)
+            except (httpx.HTTPStatusError, httpx.RequestError) as e:
+                attempt += 1
+                if attempt >= attempts or not is_retryable(e) or not self.resilience.try_retry():
+                    raise
+                sly.logger.debug(f"Retrying {method} ({attempt}/{attempts - 1}): {repr(e)}")
+                METRICS.inc("retries", method=method)
+                await self.resilience.backoff(attempt - 1, e)
+
+    async def _post_once_async(self, method: str, json: Optional[Dict], **kwargs) -> httpx.Response:
+        team_id = json.get(ApiField.TEAM_ID) if isinstance(json, dict) else None
+        await self.resilience.acquire(team_id)
+        t = time.monotonic()
+        status = "error"
+        error = None
+        try:
+            if self.connections_limiter is None:
+                response = await super().post_async(
+                    method, json, retries=1, raise_error=True, **kwargs
+                )
+            else:
+                async with self.connections_limiter:
+                    response = await super().post_async(
+                        method, json, retries=1, raise_error=True, **kwargs
+                    )
+            status = f"{response.status_code // 100}xx"
+            return response
+        except httpx.HTTPStatusError as e:
+            status = f"{e.response.status_code // 100}xx"
+            error = e
+            raise
+        except httpx.RequestError as e:
+            error = e
+            raise
+        finally:
+            self.resilience.record(team_id, error)
+            METRICS.observe("request_seconds", time.monotonic() - t, method=method)
+            METRICS.inc("requests", method=method, status=status)
+
+
 def path_to_base64(path: str) -> str:
     return base64.b64encode(path.encode()).decode()
 
 
-def get_task_id(path):
-    return int(path.split("/")[2])
+def base64_to_path(token: str) -> Optional[str]:
+    """Decode a continuation token made by `path_to_base64`. Returns None for other tokens."""
+    try:
+        path = base64.b64decode(token, validate=True).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return path if path.startswith("/") else None
 
 
-def is_removable(task_info, apps):
-    return task_info["meta"]["app"]["name"] in apps
+def get_task_id(path):
+    return int(path.split("/")[2])
 
 
 def should_delete_file(file_info: dict) -> bool:
-    return sly.fs.get_file_ext(file_info["name"]) in [".py", ".pyc", ".md", ".sh"]
+    return sly.fs.get_file_ext(file_info["name"]) in EXTENSIONS_TO_DELETE
 
 
 def clean_offline_sessions(
@@ -130,153 +244,201 @@ def clean_offline_sessions(
     app_names: List[str],
     batch_size: int = 20000,
     w_ids=None,
+    task_resolver: Optional[TaskResolver] = None,
+    by_folder: bool = False,
 ):
     """Clean offline sessions files."""
+    return run_coroutine(
+        clean_offline_sessions_async(
+            api,
+            team_id,
+            offlines_path,
+            app_names,
+            batch_size,
+            w_ids,
+            task_resolver,
+            by_folder=by_folder,
+        )
+    )
+
+
+async def remove_task_folders_async(
+    api: sly.Api,
+    team_id: int,
+    offlines_path: str,
+    app_names: List[str],
+    w_ids: List[int],
+    task_resolver: TaskResolver,
+    remover: Union[DeleteDispatcher, DryRunRemover],
+) -> Tuple[int, List[dict]]:
+    """
+    Remove offline sessions of `app_names` tasks as whole `<offlines_path>/<task_id>/` folders.
+
+    Only task folders are listed (non-recursively), and every folder is removed with one
+    request, so files of removed sessions are never listed. Returns the number of removed
+    folders and infos of all folders selected for removal.
+    """
+    if not offlines_path.endswith("/"):
+        offlines_path += "/"
+    folders = []
+    async for page in storage_iter_pages_async(
+        api,
+        team_id,
+        offlines_path,
+        recursive=False,
+        with_metadata=False,
+        light=True,
+        include_files=False,
+        include_folders=True,
+    ):
+        folders.extend(page)
+    if len(folders) == 0:
+        return 0, []
+
+    columns = ListingColumns.from_page(folders, with_dates=False, with_task_ids=True)
+    task_apps = await task_resolver.resolve(columns.unique_task_ids(), w_ids)
+    task_ids = [task_id for task_id, app_name in task_apps.items() if app_name in app_names]
+    folders = select_files(folders, columns.in_tasks(task_ids))
+    removed_folders = 0
+    if len(folders) > 0:
+        removed_folders = await remover.remove_folders(team_id, folders, REASON_APP)
+        sly.logger.debug(f"Removed {removed_folders} of {len(folders)} offline sessions folders")
+    return removed_folders, folders
+
+
+async def clean_offline_sessions_async(
+    api: sly.Api,
+    team_id: int,
+    offlines_path: str,
+    app_names: List[str],
+    batch_size: int = 20000,
+    w_ids=None,
+    task_resolver: Optional[TaskResolver] = None,
+    continuation_token: Optional[str] = None,
+    on_batch: Optional[Callable[[str, int], None]] = None,
+    remover: Optional[Union[DeleteDispatcher, DryRunRemover]] = None,
+    by_folder: bool = False,
+):
+    """
+    Clean offline sessions files asynchronously.
+
+    Pass the same `task_resolver` and `remover` for all teams of a cycle to reuse
+    resolved tasks and the tuned removal batch size. With `DryRunRemover` files are
+    only written to the team manifest.
+    Listing starts from `continuation_token` if it is set; `on_batch` is called with
+    the token of the last processed file and the number of removed files after every batch.
+
+    With `by_folder` sessions of `app_names` are removed as whole task folders first (see
+    `remove_task_folders_async`, each removed folder is counted as one file), and only
+    other folders are listed file by file for the extension rule.
+    """
     sly.logger.debug(f"Start cleaning offline sessions files (batch size: {batch_size})")
 
     # * custom implementation of the list method for Cleaner
     api.storage = CustomStorageApi(api)
 
     if w_ids is None:
-        w_ids = [workspace.id for workspace in api.workspace.get_list(team_id)]
+        workspaces = await workspaces_get_list_async(api, team_id)
+        w_ids = [workspace.id for workspace in workspaces]
+    if task_resolver is None:
+        task_resolver = TaskResolver(api)
+    if remover is None:
+        remover = DeleteDispatcher(api, batch_size)
 
     removed_files = 0
     batch_num = 1
-    task_ids_to_remove = set()
-    continuation_token = None
+    # sorted array instead of a set of Python ints, it is passed to `np.isin` for every batch
+    task_ids_to_remove = np.empty(0, dtype=np.int64)
     scanned_files = 0
 
-    while True:
-
-        last_file = None
-        files_infos = []
-
-        try:
-            # files_infos = api.storage.list(
-            #     team_id,
-            #     offlines_path,
-            #     return_type="dict",
-            #     include_folders=False,
-            #     with_metadata=False,
-            #     limit=batch_size,
-            #     continuation_token=continuation_token,
-            # )
-            files_infos = run_coroutine(
-                storage_get_list_async(
-                    api,
-                    team_id,
-                    offlines_path,
-                    return_type="dict",
-                    include_folders=False,
-                    with_metadata=False,
-                    limit=batch_size,
-                    continuation_token=continuation_token,
-                )
-            )
-        except (requests.exceptions.HTTPError, httpx.HTTPStatusError) as e:
-            if e.response.status_code == 400 and "limit" in e.response.text:
-                sly.logger.warning(
-                    f"Failed to list storage files due to limit error. Checking max limit..."
-                )
-                try:
-                    error_details = json.loads(e.response.text)
-                    max_limit = error_details["details"][0]["context"]["limit"]
-                    sly.logger.info(
-                        f"Max limit for storage listing set to {max_limit} due to API response recommendation."
-                    )
-                except Exception as e:
-                    sly.logger.warning(f"Failed to get max limit, setting default: {DEFAULT_LIMIT}")
-                    max_limit = DEFAULT_LIMIT
-                batch_size = max_limit
-                try:
-                    # files_infos = api.storage.list(
-                    #     team_id,
-                    #     offlines_path,
-                    #     return_type="dict",
-                    #     include_folders=False,
-                    #     with_metadata=False,
-                    #     limit=batch_size,
-                    #     continuation_token=continuation_token,
-                    # )
-                    files_infos = run_coroutine(
-                        storage_get_list_async(
-                            api,
-                            team_id,
-                            offlines_path,
-                            return_type="dict",
-                            include_folders=False,
-                            with_metadata=False,
-                            limit=batch_size,
-                            continuation_token=continuation_token,
-                        )
-                    )
-                except Exception as e:
-                    sly.logger.warning(f"Failed to list files after adjusting limit: {repr(e)}")
-            else:
-                sly.logger.warning(f"Failed to list files: {repr(e)}")
-        except Exception as e:
-            sly.logger.warning(f"Failed to list files: {repr(e)}")
-
-        if not files_infos:
-            break
-
-        scanned_files += len(files_infos)
-
-        all_task_ids = list(set([get_task_id(file_info["path"]) for file_info in files_infos]))
-        if all_task_ids:
-            if w_ids:
-                task_infos = []
-                for batch_tasks in sly.batched(all_task_ids, 500):
-                    filters = [{"field": "id", "operator": "in", "value": batch_tasks}]
-                    task_infos.extend(
-                        [t for w_id in w_ids for t in api.task.get_list(w_id, filters)]
-                    )
-            else:
-                task_infos = []
-        else:
-            task_infos = []
-
-        if len(task_infos) > 0:
-            task_ids_to_remove.update({t["id"] for t in task_infos if is_removable(t, app_names)})
-
-        file_to_del_paths = []
-        for file_info in files_infos:
-            if get_task_id(file_info["path"]) in task_ids_to_remove:
-                file_to_del_paths.append(file_info["path"])
-                continue
-            elif should_delete_file(file_info):
-                file_to_del_paths.append(file_info["path"])
-                continue
-            last_file = file_info["path"]
-
-        continuation_token = path_to_base64(last_file) if last_file else None
-
-        curr_batch_len = len(file_to_del_paths)
+    async def _clean_batch(files_infos: List[Dict]) -> int:
+        nonlocal batch_num, task_ids_to_remove
+
+        columns = ListingColumns.from_page(
+            files_infos, with_dates=False, with_task_ids=True, with_extensions=True
+        )
+        task_apps = await task_resolver.resolve(columns.unique_task_ids(), w_ids)
+        task_ids_to_remove = np.union1d(
+            task_ids_to_remove,
+            [task_id for task_id, app_name in task_apps.items() if app_name in app_names],
+        ).astype(np.int64)
+
+        app_mask = columns.in_tasks(task_ids_to_remove)
+        ext_mask = columns.has_extension(EXTENSIONS_TO_DELETE) & ~app_mask
+
+        curr_batch_len = 0
+        if app_mask.any():
+            files = select_files(files_infos, app_mask)
+            curr_batch_len += await remover.remove_files(team_id, files, REASON_APP)
+        if ext_mask.any():
+            files = select_files(files_infos, ext_mask)
+            curr_batch_len += await remover.remove_files(team_id, files, REASON_EXTENSION)
         if curr_batch_len > 0:
-            pbar = tqdm(desc=f"Batch {batch_num}. Removing", total=curr_batch_len).update
-            api.file.remove_batch(team_id, file_to_del_paths, pbar, batch_size)
-            removed_files += curr_batch_len
             sly.logger.debug(f"Batch {batch_num} finished. Removed: {curr_batch_len}")
             batch_num += 1
 
-        if len(files_infos) < batch_size:
-            break
+        # all files up to the last listed one are processed
+        if on_batch is not None:
+            on_batch(path_to_base64(files_infos[-1]["path"]), curr_batch_len)
+        return curr_batch_len
+
+    skip_folder = None
+    if by_folder:
+        removed_folders, folders = await remove_task_folders_async(
+            api, team_id, offlines_path, app_names, w_ids, task_resolver, remover
+        )
+        removed_files += removed_folders
+        if on_batch is not None:
+            # removed folders are not listed again, so listing starts from the same place
+            on_batch(continuation_token or path_to_base64(offlines_path), removed_folders)
+        if isinstance(remover, DryRunRemover) and len(folders) > 0:
+            # in plan mode folders are not removed, their files must not be listed
+            folders_paths = {folder_info["path"].rstrip("/") + "/" for folder_info in folders}
+
+            def skip_folder(folder_info: dict) -> bool:
+                return folder_info["path"].rstrip("/") + "/" in folders_paths
+
+        elif len(folders) > 0:
+            # files of folders that failed to be removed are removed one by one
+            columns = ListingColumns.from_page(folders, with_dates=False, with_task_ids=True)
+            task_ids_to_remove = np.unique(columns.task_ids)
+
+    # the tree is listed once, pages come in path order and are processed by batches
+    files_infos = []
+    async for page in storage_crawl_async(
+        api,
+        team_id,
+        offlines_path,
+        continuation_token=continuation_token,
+        include_folders=False,
+        with_metadata=False,
+        light=True,
+        skip_folder=skip_folder,
+    ):
+        files_infos.extend(page)
+        scanned_files += len(page)
+        if len(files_infos) >= batch_size:
+            removed_files += await _clean_batch(files_infos)
+            files_infos = []
+
+    if len(files_infos) > 0:
+        removed_files += await _clean_batch(files_infos)
 
     sly.logger.debug(f"Total files scanned in offline sessions: {scanned_files}")
     return removed_files
 
 
-async def teams_get_list_async(
+async def get_list_all_pages_async(
     api: sly.Api,
-    filters: List[Dict[str, str]] = None,
+    method: str,
+    data: Dict,
+    convert_json_info: Callable[[Dict], NamedTuple],
     limit: int = None,
-):
+) -> List[NamedTuple]:
     """
-    Get list of teams asynchronously from the Supervisely server.
+    Get all pages of a list method asynchronously: the first page, then the rest in parallel.
     """
-    method = "teams.list"
-    data = {ApiField.FILTER: filters or [], ApiField.SORT: ApiField.ID, ApiField.SORT_ORDER: "asc"}
-
+    data = {**data}
     semaphore = asyncio.Semaphore(5)
     pages_count = None
     tasks: List[asyncio.Task] = []
@@ -288,13 +450,13 @@ async def teams_get_list_async(
             response_json = response.json()
             items = response_json.get("entities", [])
             pages_count = response_json["pagesCount"]
-        return [api.team._convert_json_info(item) for item in items]
+        return [convert_json_info(item) for item in items]
 
     # Get first page
     data[ApiField.PAGE] = 1
     t = time.monotonic()
     items = await _r(data, 1)
-    sly.logger.debug(f"Awaited teams page 1/{pages_count} for {time.monotonic() - t:.4f} sec")
+    sly.logger.debug(f"Awaited {method} page 1/{pages_count} for {time.monotonic() - t:.4f} sec")
 
     # Check if we've exceeded the limit with just the first page
     if limit is not None and len(items) >= limit:
@@ -307,37 +469,70 @@ async def teams_get_list_async(
         tasks.append(asyncio.create_task(_r(data.copy(), page_n)))
 
     # Await all tasks and collect results
-    for i, task in enumerate(tasks, 2):
-        new_items = await task
-        items.extend(new_items)
-        sly.logger.debug(f"Awaited teams page {i}/{pages_count} for {time.monotonic() - t:.4f} sec")
-        t = time.monotonic()
+    try:
+        for i, task in enumerate(tasks, 2):
+            new_items = await task
+            items.extend(new_items)
+            sly.logger.debug(
+                f"Awaited {method} page {i}/{pages_count} for {time.monotonic() - t:.4f} sec"
+            )
+            t = time.monotonic()
 
-        # Check if we've exceeded the limit
-        if limit is not None and len(items) >= limit:
-            return items[:limit]
+            # Check if we've exceeded the limit
+            if limit is not None and len(items) >= limit:
+                return items[:limit]
+    finally:
+        for task in tasks:
+            task.cancel()
 
     return items
 
 
-async def storage_get_list_async(
+async def teams_get_list_async(
+    api: sly.Api,
+    filters: List[Dict[str, str]] = None,
+    limit: int = None,
+):
+    """
+    Get list of teams asynchronously from the Supervisely server.
+    """
+    data = {ApiField.FILTER: filters or [], ApiField.SORT: ApiField.ID, ApiField.SORT_ORDER: "asc"}
+    return await get_list_all_pages_async(
+        api, "teams.list", data, api.team._convert_json_info, limit=limit
+    )
+
+
+async def team_get_info_by_id_async(api: sly.Api, team_id: int) -> TeamInfo:
+    response = await api.post_async("teams.info", {ApiField.ID: team_id})
+    return api.team._convert_json_info(response.json())
+
+
+async def workspaces_get_list_async(api: sly.Api, team_id: int) -> List[WorkspaceInfo]:
+    data = {ApiField.TEAM_ID: team_id, ApiField.FILTER: []}
+    return await get_list_all_pages_async(
+        api, "workspaces.list", data, api.workspace._convert_json_info
+    )
+
+
+async def storage_list_page_async(
     api: sly.Api,
     team_id: int,
     path: str,
     recursive: bool = True,
-    return_type: Literal["dict", "fileinfo"] = "fileinfo",
     with_metadata: bool = True,
+    light: bool = False,
     include_files: bool = True,
     include_folders: bool = True,
     limit: Optional[int] = None,
     continuation_token: Optional[str] = None,
-):
+) -> Tuple[List[Dict], Optional[str]]:
     """
-    List files asynchronously from the Team Files or Cloud Storages.
+    Get one page of files (as dicts) and the continuation token of the next page.
+
+    With `light` files keep only the fields used by the cleaner (see `fast_json`).
     """
     if not path.endswith("/"):
         path += "/"
-    method = "file-storage.v2.list"
     json_body = {
         ApiField.TEAM_ID: team_id,
         ApiField.PATH: path,
@@ -348,71 +543,434 @@ async def storage_get_list_async(
     }
     if limit is not None:
         json_body[ApiField.LIMIT] = limit
+    if continuation_token:
+        json_body["continuationToken"] = continuation_token
 
-    semaphore = asyncio.Semaphore(5)
-    tasks = []
-    all_data = []
+    t = time.monotonic()
+    response = await api.post_async("file-storage.v2.list", json_body)
+    response_json = fast_json.decode_page(response.content, light=light)
+    entities = response_json.get("entities", [])
+    sly.logger.debug(f"Fetched {len(entities)} files in {time.monotonic() - t:.4f} sec")
+    METRICS.inc("listed_pages")
+    METRICS.inc("listed_entities", len(entities))
+    METRICS.inc("listed_bytes", len(response.content))
+    return entities, response_json.get("continuationToken", None)
 
-    async def _fetch_data(token=None):
-        nonlocal json_body
-        req_data = json_body.copy()
-        if token:
-            req_data["continuationToken"] = token
 
-        async with semaphore:
-            t = time.monotonic()
-            response = await api.post_async(method, req_data)
-            response_json = response.json()
-            entities = response_json.get("entities", [])
-            token = response_json.get("continuationToken", None)
-            sly.logger.debug(f"Fetched {len(entities)} files in {time.monotonic() - t:.4f} sec")
-            return entities, token
+async def storage_iter_pages_async(
+    api: sly.Api,
+    team_id: int,
+    path: str,
+    recursive: bool = True,
+    with_metadata: bool = True,
+    light: bool = False,
+    include_files: bool = True,
+    include_folders: bool = True,
+    limit: Optional[int] = None,
+    continuation_token: Optional[str] = None,
+) -> AsyncIterator[List[Dict]]:
+    """
+    Yield pages of files (as dicts) from the Team Files or Cloud Storages as soon as they
+    are fetched.
+    """
+    fetched = 0
+    while True:
+        entities, continuation_token = await storage_list_page_async(
+            api,
+            team_id,
+            path,
+            recursive=recursive,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+            limit=limit,
+            continuation_token=continuation_token,
+        )
 
-    # Get first batch of data
-    t_total = time.monotonic()
-    # Use provided continuation token if available
-    initial_token = continuation_token
-    entities, continuation_token = await _fetch_data(initial_token)
-    all_data.extend(entities)
-
-    # Check if we've exceeded the limit with just the first batch
-    if limit is not None and len(all_data) >= limit:
-        all_data = all_data[:limit]
-        continuation_token = None
-
-    # Process remaining data in parallel batches
-    while continuation_token:
-        next_batch_tokens = []
-        current_token = continuation_token
-        continuation_token = None
-
-        # Create initial task for the current token
-        tasks.append(asyncio.create_task(_fetch_data(current_token)))
-
-        # Wait for all tasks to complete
-        for task in asyncio.as_completed(tasks):
-            entities, token = await task
-            all_data.extend(entities)
-            if token:
-                next_batch_tokens.append(token)
+        # Check if we've exceeded the limit
+        if limit is not None and fetched + len(entities) >= limit:
+            yield entities[: limit - fetched]
+            return
+        fetched += len(entities)
+        yield entities
 
-            # Check if we've exceeded the limit
-            if limit is not None and len(all_data) >= limit:
-                all_data = all_data[:limit]
-                next_batch_tokens = []
+        if not continuation_token:
+            return
+
+
+PageSource = Callable[[], AsyncIterator[List[Dict]]]
+
+
+async def _iter_in_order_async(
+    sources: AsyncIterator[PageSource],
+    concurrency: int,
+    queue_size: int,
+) -> AsyncIterator[List[Dict]]:
+    """
+    Run up to `concurrency` page iterators ahead, yield their pages in the order of `sources`.
+    Sources are taken only when there is room for them, so they can be produced lazily.
+    """
+
+    async def _fill(source, queue):
+        try:
+            async for page in source():
+                await queue.put(page)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    window = deque()
+    exhausted = False
+    try:
+        while True:
+            while len(window) < concurrency and not exhausted:
+                try:
+                    source = await sources.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                queue = asyncio.Queue(maxsize=queue_size)
+                window.append((asyncio.create_task(_fill(source, queue)), queue))
+            if len(window) == 0:
                 break
+            _, queue = window[0]
+            while True:
+                page = await queue.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+            window.popleft()
+    finally:
+        for task, _ in window:
+            task.cancel()
+        await sources.aclose()
+
+
+def _page_source(page: List[Dict]) -> PageSource:
+    async def _source():
+        yield page
+
+    return _source
+
+
+def _folder_source(
+    list_folder: Callable[[str, Optional[str]], AsyncIterator[List[Dict]]],
+    folder_path: str,
+    token: Optional[str],
+) -> PageSource:
+    return lambda: list_folder(folder_path, token)
+
+
+async def _iter_children_async(
+    pages: AsyncIterator[List[Dict]],
+    list_folder: Callable[[str, Optional[str]], AsyncIterator[List[Dict]]],
+    continuation_token: Optional[str] = None,
+    include_folders: bool = True,
+    skip_folder: Optional[Callable[[Dict], bool]] = None,
+) -> AsyncIterator[PageSource]:
+    """
+    Sources of pages of a directory in path order, made from `pages` of its non-recursive
+    listing: runs of its own files (not longer than a listing page) and subfolders listed
+    by `list_folder(folder_path, token)`. Entities up to the path of `continuation_token`
+    (made by `path_to_base64`) are skipped, the subfolder that contains the path is listed
+    from it. Subfolders for which `skip_folder` is True are not listed.
+    """
+    start_path = base64_to_path(continuation_token) if continuation_token else None
+    async for page in pages:
+        items = []
+        for entity in page:
+            if entity[ApiField.TYPE] != "folder":
+                if start_path is None or entity["path"] > start_path:
+                    items.append((entity["path"], entity))
+                continue
+            if skip_folder is not None and skip_folder(entity):
+                METRICS.inc("skipped_folders")
+                continue
+            folder_path = entity["path"].rstrip("/") + "/"
+            if include_folders and (start_path is None or entity["path"] > start_path):
+                items.append((folder_path, entity))
+            if start_path is None or folder_path > start_path:
+                items.append((folder_path, (folder_path, None)))
+            elif start_path.startswith(folder_path):
+                items.append((folder_path, (folder_path, continuation_token)))
+        # files of a folder go after files of the directory that sort before its path
+        # with "/" (e.g. "a/0" after "a.txt"), the folder itself goes before its files
+        items.sort(key=lambda item: item[0])
+        files = []
+        for _, item in items:
+            if isinstance(item, dict):
+                files.append(item)
+                continue
+            if len(files) > 0:
+                yield _page_source(files)
+                files = []
+            yield _folder_source(list_folder, *item)
+        if len(files) > 0:
+            yield _page_source(files)
 
-        # Clear tasks for next batch
-        tasks = []
 
-        # Set continuation token for next iteration if we have more tokens
-        if next_batch_tokens:
-            continuation_token = next_batch_tokens[0]
-            for token in next_batch_tokens[1:]:
-                tasks.append(asyncio.create_task(_fetch_data(token)))
+async def storage_crawl_async(
+    api: sly.Api,
+    team_id: int,
+    path: str,
+    continuation_token: Optional[str] = None,
+    max_depth: int = 1,
+    concurrency: int = 8,
+    queue_size: int = 4,
+    with_metadata: bool = True,
+    light: bool = False,
+    include_files: bool = True,
+    include_folders: bool = True,
+    skip_folder: Optional[Callable[[Dict], bool]] = None,
+) -> AsyncIterator[List[Dict]]:
+    """
+    List a directory recursively, paging through its subfolders in parallel.
+
+    Directories that fit into one page are listed with a single request. Otherwise the
+    directory is listed non-recursively after the first page, then every subfolder is
+    listed by its own chain of continuation tokens (or split further while `max_depth`
+    allows). Up to `concurrency` subfolders are listed ahead, but files of the directory
+    and of its subfolders are yielded in path order, at most a listing page at a time,
+    so there are no duplicates and the path of the last yielded file can be used as
+    a continuation token.
+
+    `continuation_token` has to be made by `path_to_base64`: entities before it are
+    skipped. Any other token and `max_depth=0` list the directory with a single chain.
+    With `skip_folder` the directory is listed by `storage_crawl_skipping_async`.
+    """
+    start_path = base64_to_path(continuation_token) if continuation_token else None
+    if skip_folder is not None and (continuation_token is None or start_path is not None):
+        async for page in storage_crawl_skipping_async(
+            api,
+            team_id,
+            path,
+            skip_folder,
+            continuation_token=continuation_token,
+            concurrency=concurrency,
+            queue_size=queue_size,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+        ):
+            yield page
+        return
+    if max_depth <= 0 or (continuation_token is not None and start_path is None):
+        async for page in storage_iter_pages_async(
+            api,
+            team_id,
+            path,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+            continuation_token=continuation_token,
+        ):
+            yield page
+        return
+
+    entities, next_token = await storage_list_page_async(
+        api,
+        team_id,
+        path,
+        with_metadata=with_metadata,
+        light=light,
+        include_files=include_files,
+        include_folders=include_folders,
+        continuation_token=continuation_token,
+    )
+    if len(entities) > 0:
+        yield entities
+    if not next_token or len(entities) == 0:
+        return
+    continuation_token = path_to_base64(entities[-1]["path"])
+
+    if not path.endswith("/"):
+        path += "/"
+    sly.logger.debug(f"Listing {path} by subfolders")
+    children = storage_iter_pages_async(
+        api,
+        team_id,
+        path,
+        recursive=False,
+        with_metadata=with_metadata,
+        light=light,
+        include_files=include_files,
+        include_folders=True,
+    )
+
+    def _crawl_folder(folder_path: str, token: Optional[str]):
+        return storage_crawl_async(
+            api,
+            team_id,
+            folder_path,
+            continuation_token=token,
+            max_depth=max_depth - 1,
+            concurrency=concurrency,
+            queue_size=queue_size,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+        )
+
+    sources = _iter_children_async(children, _crawl_folder, continuation_token, include_folders)
+    async for page in _iter_in_order_async(sources, concurrency, queue_size):
+        yield page
+
+
+async def storage_crawl_skipping_async(
+    api: sly.Api,
+    team_id: int,
+    path: str,
+    skip_folder: Callable[[Dict], bool],
+    continuation_token: Optional[str] = None,
+    concurrency: int = 8,
+    queue_size: int = 4,
+    with_metadata: bool = True,
+    light: bool = False,
+    include_files: bool = True,
+    include_folders: bool = True,
+) -> AsyncIterator[List[Dict]]:
+    """
+    List a directory recursively without files of subfolders for which `skip_folder` is True.
+
+    `file-storage.v2.list` can't filter files by date or name, and a recursive chain
+    can't stop before a folder, so the subfolders are checked before their files are
+    listed: the directory is listed non-recursively first, then every subfolder that is
+    not skipped is listed by its own chain, as in `storage_crawl_async`. If the directory
+    fits into one page and no folder is skipped, it is listed by a single chain, which
+    costs one request more than without the check. `continuation_token` has to be made
+    by `path_to_base64`.
+    """
+    if not path.endswith("/"):
+        path += "/"
+    entities, next_token = await storage_list_page_async(
+        api,
+        team_id,
+        path,
+        recursive=False,
+        with_metadata=with_metadata,
+        light=light,
+        include_files=include_files,
+        include_folders=True,
+    )
+    if len(entities) == 0 and not next_token:
+        # the directory is empty or doesn't exist
+        return
+    folders = [entity for entity in entities if entity[ApiField.TYPE] == "folder"]
+    if not next_token and not any(skip_folder(entity) for entity in folders):
+        async for page in storage_iter_pages_async(
+            api,
+            team_id,
+            path,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+            continuation_token=continuation_token,
+        ):
+            yield page
+        return
+
+    async def _children():
+        yield entities
+        if next_token:
+            async for page in storage_iter_pages_async(
+                api,
+                team_id,
+                path,
+                recursive=False,
+                with_metadata=with_metadata,
+                light=light,
+                include_files=include_files,
+                include_folders=True,
+                continuation_token=next_token,
+            ):
+                yield page
+
+    def _list_folder(folder_path: str, token: Optional[str]):
+        return storage_iter_pages_async(
+            api,
+            team_id,
+            folder_path,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+            continuation_token=token,
+        )
+
+    sly.logger.debug(f"Listing {path} by subfolders that are not skipped")
+    sources = _iter_children_async(
+        _children(), _list_folder, continuation_token, include_folders, skip_folder
+    )
+    async for page in _iter_in_order_async(sources, concurrency, queue_size):
+        yield page
+
+
+async def storage_get_list_async(
+    api: sly.Api,
+    team_id: int,
+    path: str,
+    recursive: bool = True,
+    return_type: Literal["dict", "fileinfo"] = "fileinfo",
+    with_metadata: bool = True,
+    light: bool = False,
+    include_files: bool = True,
+    include_folders: bool = True,
+    limit: Optional[int] = None,
+    continuation_token: Optional[str] = None,
+    crawl_depth: int = 1,
+):
+    """
+    List files asynchronously from the Team Files or Cloud Storages.
+
+    Recursive listings are split by subfolders up to `crawl_depth` levels deep
+    and listed in parallel (see `storage_crawl_async`).
+    """
+    t_total = time.monotonic()
+    all_data = []
+    if recursive:
+        pages = storage_crawl_async(
+            api,
+            team_id,
+            path,
+            continuation_token=continuation_token,
+            max_depth=crawl_depth,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+        )
+    else:
+        pages = storage_iter_pages_async(
+            api,
+            team_id,
+            path,
+            recursive=False,
+            with_metadata=with_metadata,
+            light=light,
+            include_files=include_files,
+            include_folders=include_folders,
+            limit=limit,
+            continuation_token=continuation_token,
+        )
+    async for entities in pages:
+        all_data.extend(entities)
+        # Check if we've exceeded the limit
+        if limit is not None and len(all_data) >= limit:
+            all_data = all_data[:limit]
+            await pages.aclose()
+            break
 
     sly.logger.debug(
-        f"Total file listing completed in {time.monotonic() - t_total:.4f} sec, fetched {len(all_data)} files"
+        f"Total file listing completed in {time.monotonic() - t_total:.4f} sec, "
+        f"fetched {len(all_data)} files"
     )
 
     # Convert results if needed
@@ -424,3 +982,100 @@ async def storage_get_list_async(
         return results
 
     return all_data
+
+
+async def storage_get_files_async(
+    api: sly.Api, team_id: int, paths: List[str], concurrency: int = 8
+) -> List[Dict]:
+    """
+    Get current infos of files that still exist. Directories of the files are listed
+    non-recursively, up to `concurrency` at a time.
+    """
+    wanted = set(paths)
+    directories = sorted({path.rsplit("/", 1)[0] + "/" for path in wanted})
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _list_directory(path: str) -> List[Dict]:
+        files = []
+        async with semaphore:
+            try:
+                async for page in storage_iter_pages_async(
+                    api,
+                    team_id,
+                    path,
+                    recursive=False,
+                    with_metadata=False,
+                    light=True,
+                    include_folders=False,
+                ):
+                    files.extend(entity for entity in page if entity["path"] in wanted)
+            except httpx.HTTPStatusError as e:
+                # the directory was removed with its files
+                if e.response.status_code != 404:
+                    raise
+        return files
+
+    listed = await asyncio.gather(*(_list_directory(path) for path in directories))
+    return [file_info for files in listed for file_info in files]
+
+
+async def storage_iter_roots_async(
+    api: sly.Api,
+    team_id: int,
+    paths: List[str],
+    queue_size: int = 8,
+    continuation_tokens: Optional[Dict[str, str]] = None,
+    skip_folders: Optional[Dict[str, Callable[[Dict], bool]]] = None,
+    **list_kwargs,
+) -> AsyncIterator[Tuple[str, List[Dict]]]:
+    """
+    List several directories concurrently and yield `(path, page)` as soon as each page is fetched.
+
+    The first listing page tells if a directory exists: directories that don't exist
+    (404 or an empty page) cost one request and give no pages. Pages go through a bounded queue, so listing pauses while the consumer is busy and
+    memory doesn't grow with the size of the directories. Listing of a directory starts
+    from its token in `continuation_tokens` if there is one. `skip_folders` holds
+    `skip_folder` callbacks by directory, `list_kwargs` are passed to `storage_crawl_async`.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    continuation_tokens = continuation_tokens or {}
+    skip_folders = skip_folders or {}
+
+    async def _produce(path):
+        listed = False
+        try:
+            with labels(root=path), METRICS.timer("root_list_seconds"):
+                async for page in storage_crawl_async(
+                    api,
+                    team_id,
+                    path,
+                    continuation_token=continuation_tokens.get(path),
+                    skip_folder=skip_folders.get(path),
+                    **list_kwargs,
+                ):
+                    listed = True
+                    await queue.put((path, page))
+        except httpx.HTTPStatusError as e:
+            if listed or e.response.status_code != 404:
+                await queue.put((path, e))
+                return
+            sly.logger.debug(f"Team: {team_id}. Directory {path} doesn't exist, skipped.")
+        except Exception as e:
+            await queue.put((path, e))
+            return
+        await queue.put((path, None))
+
+    producers = [asyncio.create_task(_produce(path)) for path in paths]
+    remaining = len(producers)
+    try:
+        while remaining > 0:
+            path, page = await queue.get()
+            if isinstance(page, Exception):
+                raise page
+            if page is None:
+                remaining -= 1
+                continue
+            yield path, page
+    finally:
+        for producer in producers:
+            producer.cancel()
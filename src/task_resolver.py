@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import supervisely as sly
+from supervisely.api.module_api import ApiField
+
+from metrics import METRICS
+
+
+def get_task_app_name(task_info: dict) -> Optional[str]:
+    return task_info.get("meta", {}).get("app", {}).get("name")
+
+
+class TaskResolver:
+    """
+    Resolves task ids to app names with concurrent async lookups.
+
+    Results are cached for the whole run, so every task is requested only once no matter
+    how many listing batches (or teams) it appears in. Tasks that were not found in any
+    workspace are cached too (as `None`). The cache is unbounded by default; set
+    `max_size` to evict least recently used entries and `ttl` (in seconds) to expire them.
+    """
+
+    def __init__(
+        self,
+        api: sly.Api,
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        chunk_size: int = 500,
+        concurrency: int = 10,
+    ):
+        self._api = api
+        self.max_size = max_size
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self._cache: OrderedDict = OrderedDict()  # task id -> (app name, cached at)
+        self.requests_count = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _get_cached(self, task_id: int):
+        entry = self._cache.get(task_id)
+        if entry is None:
+            return False, None
+        app_name, cached_at = entry
+        if self.ttl is not None and time.monotonic() - cached_at > self.ttl:
+            del self._cache[task_id]
+            return False, None
+        self._cache.move_to_end(task_id)
+        return True, app_name
+
+    def _set_cached(self, task_id: int, app_name: Optional[str]):
+        self._cache[task_id] = (app_name, time.monotonic())
+        self._cache.move_to_end(task_id)
+        if self.max_size is not None:
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    async def _get_tasks_async(self, workspace_id: int, task_ids: List[int]) -> List[dict]:
+        filters = [{"field": ApiField.ID, "operator": "in", "value": task_ids}]
+        data = {
+            ApiField.WORKSPACE_ID: workspace_id,
+            ApiField.FILTER: filters,
+            ApiField.PER_PAGE: len(task_ids),
+        }
+        tasks = []
+        page, pages_count = 1, 1
+        while page <= pages_count:
+            self.requests_count += 1
+            response = await self._api.post_async("tasks.list", {**data, ApiField.PAGE: page})
+            response_json = response.json()
+            tasks.extend(response_json.get("entities", []))
+            pages_count = response_json.get("pagesCount", 1)
+            page += 1
+        return tasks
+
+    async def resolve(self, task_ids: Iterable[int], w_ids: List[int]) -> Dict[int, Optional[str]]:
+        """
+        Get app names for the given task ids. Only ids that are not cached yet are requested.
+        """
+        result = {}
+        unknown = []
+        for task_id in set(task_ids):
+            found, app_name = self._get_cached(task_id)
+            if found:
+                result[task_id] = app_name
+            else:
+                unknown.append(task_id)
+        METRICS.inc("task_cache_hits", len(result))
+        METRICS.inc("task_cache_misses", len(unknown))
+
+        if not unknown or not w_ids:
+            return result
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _lookup(w_id, batch_tasks):
+            async with semaphore:
+                return await self._get_tasks_async(w_id, batch_tasks)
+
+        t = time.monotonic()
+        lookups = [
+            _lookup(w_id, batch_tasks)
+            for batch_tasks in sly.batched(unknown, self.chunk_size)
+            for w_id in w_ids
+        ]
+        found_apps = {}
+        for tasks in await asyncio.gather(*lookups):
+            for task_info in tasks:
+                found_apps[task_info["id"]] = get_task_app_name(task_info)
+
+        for task_id in unknown:
+            app_name = found_apps.get(task_id)
+            self._set_cached(task_id, app_name)
+            result[task_id] = app_name
+        METRICS.observe("task_resolve_seconds", time.monotonic() - t)
+        sly.logger.debug(
+            f"Resolved {len(unknown)} tasks with {len(lookups)} requests "
+            f"in {time.monotonic() - t:.4f} sec ({len(result) - len(unknown)} cached)"
+        )
+        return result